@@ -2,6 +2,7 @@
 # app.py
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
 import datetime
 import time
@@ -9,14 +10,25 @@ import pytz
 import random
 import re
 import json
+import os
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from supabase import create_client
+from local_supabase import LocalSupabase
 
 # ==============================================================================
 # 0. System Configuration & CSS (V10.6 Fix: Explicit Odds Display)
 # ==============================================================================
 st.set_page_config(page_title="Football App V10.6", layout="wide", page_icon="⚽")
 JST = pytz.timezone('Asia/Tokyo')
+# Shared cached frames are handed out as shallow copies (pandas>=3 is always CoW)
+if int(pd.__version__.split('.')[0]) < 3: pd.set_option("mode.copy_on_write", True)
 
 st.markdown("""
 <style>
@@ -138,48 +150,521 @@ st.markdown("""
 @st.cache_resource
 def get_supabase():
     try:
+        # オフライン検証用: secrets.toml に [local_db] seed = "seed.json" (latency = 0.05) があればローカル DB を使う
+        local = st.secrets.get("local_db")
+        if local: return LocalSupabase.from_json(local["seed"], latency=float(local.get("latency", 0)), max_rows=local.get("max_rows"))
         return create_client(st.secrets["supabase"]["url"], st.secrets["supabase"]["key"])
     except: return None
 
 supabase = get_supabase()
 
-def fetch_all_data():
+# --- V11.0 DELTA SYNC ---
+# cols: 取得カラム (select 句に使用) / pk: マージキー / watermark: 差分取得に使う更新時刻カラム (None = 毎回全件)
+TABLE_SPECS = {
+    "bets": {"cols": ['key','user','match_id','match','pick','stake','odds','result','payout','net','gw','placed_at','chip_used','status'], "pk": ['key'], "watermark": 'placed_at'},
+    "odds": {"cols": ['match_id','home_win','draw','away_win'], "pk": ['match_id'], "watermark": None},
+    "result": {"cols": ['match_id','gw','home','away','utc_kickoff','status','home_score','away_score','bm_shield','updated_at'], "pk": ['match_id'], "watermark": 'updated_at'},
+    "bm_log": {"cols": ['gw','bookmaker'], "pk": ['gw'], "watermark": None},
+    "users": {"cols": ['username','role','team'], "pk": ['username'], "watermark": None},  # password は LOGIN 時のみ個別取得
+    "config": {"cols": ['key','value'], "pk": ['key'], "watermark": None},
+    "user_chips": {"cols": ['user_name','chip_type','amount'], "pk": ['user_name','chip_type'], "watermark": None},
+}
+# Safety net: settlement updates / deletes by other processes do not move the watermark
+DELTA_FULL_RELOAD_SEC = 300
+
+def utc_now_iso():
+    """Watermark value for updated_at: tz-aware UTC, so the app and worker.py agree whatever the host timezone."""
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+# --- V11.1 SHARED CACHE ---
+CACHE_TTL_SEC = 30  # 外部からの書き込み (worker / 手動SQL) を拾うまでの最大遅延
+CACHE_MAX_BYTES = 256 * 1024 * 1024  # 旧バージョン保持分を含めた上限
+# --- V11.2 PARALLEL LOAD ---
+FETCH_MAX_WORKERS = 7  # 同時に張る Supabase リクエスト数の上限
+FETCH_TIMINGS = {}  # label -> {name: sec, '_wall': sec}  (ADMIN > PERF で表示)
+# --- V11.4 PAGINATION ---
+PAGE_SIZE = 1000  # 1ページの行数。Supabase の max-rows (既定 1000) を超えても count で取りこぼしは検知できる
+PAGE_PREFETCH = True  # 現ページの DataFrame 化と並行して次ページを取得
+# --- V11.6 BULK WRITES ---
+WRITE_BATCH_SIZE = 500  # 1回の upsert に載せる行数 (PostgREST のリクエストサイズ上限に余裕を持たせる)
+WRITE_MAX_WORKERS = 4  # 同時に投げる書き込みリクエスト数の上限
+WRITE_REPORTS = {}  # label -> flush_upserts の結果 (ADMIN > PERF で表示)
+
+def unseen_at_mark(delta_df, base_df, wm, mark, pk):
+    """A gte(mark) delta re-reads the rows stamped exactly at the mark; drop the ones base_df already holds."""
+    at_mark = (delta_df[wm].astype(str) == mark).to_numpy()
+    if not at_mark.any(): return delta_df
+    held = base_df[base_df[wm].astype(str) == mark]
+    known = pd.MultiIndex.from_frame(delta_df[pk].astype(str)).isin(pd.MultiIndex.from_frame(held[pk].astype(str)))
+    return delta_df[~(at_mark & known)]
+
+def merge_by_pk(base_df, delta_df, pk):
+    """Replace rows of base_df that share a primary key with delta_df, append the rest."""
+    if base_df.empty: return delta_df.reset_index(drop=True)
+    if delta_df.empty: return base_df
+    base_keys = pd.MultiIndex.from_frame(base_df[pk].astype(str))
+    delta_keys = pd.MultiIndex.from_frame(delta_df[pk].astype(str))
+    kept = base_df[~base_keys.isin(delta_keys)]
+    return pd.concat([kept, delta_df], ignore_index=True)
+
+def iter_table_pages(table, columns="*", where=None, page_size=PAGE_SIZE, prefetch=PAGE_PREFETCH):
+    """Stream a table as DataFrame chunks using range() pages ordered by its primary key.
+
+    The first page asks for an exact count, so the reader advances by the rows it actually got
+    and keeps going even when the server caps pages below page_size. With a known total the next
+    page is requested while the current one is being parsed.
+    """
+    order_cols = TABLE_SPECS.get(table, {}).get('pk', [])
+    def fetch(start):
+        q = supabase.table(table).select(columns, count="exact" if start == 0 else None)
+        if where is not None: q = where(q)
+        for col in order_cols: q = q.order(col)
+        return q.range(start, start + page_size - 1).execute()
+
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"page:{table}") if prefetch else None
     try:
-        def get_df_safe(table, expected_cols):
+        res = fetch(0)
+        total = getattr(res, 'count', None)
+        start = 0
+        while True:
+            rows = res.data or []
+            start += len(rows)
+            more = (start < total) if total is not None else (len(rows) == page_size)
+            more = more and len(rows) > 0
+            pending = pool.submit(fetch, start) if (more and pool) else None
+            if rows: yield pd.DataFrame(rows)
+            if not more: break
+            res = pending.result() if pending else fetch(start)
+    finally:
+        if pool: pool.shutdown(wait=False, cancel_futures=True)
+
+def read_table_paged(table, columns="*", where=None, page_size=PAGE_SIZE, prefetch=PAGE_PREFETCH):
+    """Read a whole (optionally filtered) table page by page; chunks are concatenated once at the end."""
+    chunks = list(iter_table_pages(table, columns, where, page_size, prefetch))
+    if not chunks: return pd.DataFrame()
+    return chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+
+# --- V11.5 CANONICAL SCHEMA ---
+# ingest 時に一度だけ型をそろえ、以降の関数はこの型を前提にする (str<->int の往復や .strip().upper() は不要)
+#   match_id: int32 / gw・user・pick・status・chip_used・team: category / stake・net・payout: int32 (円単位)
+#   odds: float64 (float32 だと 2.1 などが丸まり int(stake*odds) の払戻が 1円ずれる) / kickoff: tz-aware JST (dt_jst)
+def _as_code(s, upper=True):
+    s = s.astype(str).str.strip()
+    if upper: s = s.str.upper()
+    return s.replace({'NONE': '', 'NAN': '', 'None': '', 'nan': ''}).astype('category')
+
+def _as_int(s, dtype='int32'):
+    return pd.to_numeric(s, errors='coerce').fillna(0).round().astype(dtype)
+
+def normalize_table(table, df):
+    """Ingest-time typing, applied once per loaded/merged frame instead of on every rerun."""
+    for col in TABLE_SPECS[table]['cols']:
+        if col not in df.columns: df[col] = None
+    if df.empty: return df
+    if table == "bets":
+        df['match_id'] = _as_int(df['match_id'])
+        df['user'] = df['user'].astype('category')
+        for col in ['pick', 'gw', 'result', 'status']: df[col] = _as_code(df[col])
+        df['chip_used'] = _as_code(df['chip_used'], upper=False)
+        for col in ['stake', 'net', 'payout']: df[col] = _as_int(df[col])
+        df['odds'] = pd.to_numeric(df['odds'], errors='coerce')
+    elif table == "result":
+        df['match_id'] = _as_int(df['match_id'])
+        for col in ['gw', 'status']: df[col] = _as_code(df[col])
+        for col in ['home', 'away']: df[col] = df[col].astype('category')
+        for col in ['home_score', 'away_score']: df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int16')
+        df['bm_shield'] = df['bm_shield'].fillna(False).astype(bool)
+        df['gw_num'] = _as_int(df['gw'].astype(str).str.extract(r'(\d+)', expand=False), 'int16')
+        df['dt_jst'] = kickoff_jst(df['utc_kickoff'])
+    elif table == "odds":
+        df['match_id'] = _as_int(df['match_id'])
+        for col in ['home_win', 'draw', 'away_win']: df[col] = pd.to_numeric(df[col], errors='coerce')
+    elif table == "user_chips":
+        df['amount'] = _as_int(df['amount'])
+    return df
+
+class SharedTableCache:
+    """Process-wide table store: one immutable, versioned frame per table shared by every session.
+
+    App writes call invalidate() for the touched table; writes from outside the app are picked
+    up after CACHE_TTL_SEC. Superseded versions are kept (LRU) until CACHE_MAX_BYTES is hit.
+    """
+    def __init__(self, ttl_sec=CACHE_TTL_SEC, max_bytes=CACHE_MAX_BYTES):
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self._meta_lock = threading.Lock()
+        self._table_locks = {t: threading.Lock() for t in TABLE_SPECS}
+        self._current = {}  # table -> {'version','df','mark','loaded_at','full_at','seq','nbytes'}
+        self._archive = OrderedDict()  # (table, version) -> (df, nbytes)
+        self._dirty_seq = {t: 0 for t in TABLE_SPECS}
+        self._full_pending = set()
+        self._derived = {}  # (table, name) -> (version, object built from that version)
+
+    def invalidate(self, *tables, full=False):
+        with self._meta_lock:
+            for t in tables:
+                self._dirty_seq[t] += 1
+                if full: self._full_pending.add(t)
+
+    def is_fresh(self, table):
+        return self._is_fresh(table, self._current.get(table))
+
+    def version(self, table):
+        ent = self._current.get(table)
+        return ent['version'] if ent else 0
+
+    def get(self, table):
+        """Return (version, df). The frame is shared: treat it as read-only (or copy)."""
+        ent = self._current.get(table)
+        if self._is_fresh(table, ent): return ent['version'], ent['df']
+        with self._table_locks[table]:
+            ent = self._current.get(table)
+            if self._is_fresh(table, ent): return ent['version'], ent['df']
             try:
-                res = supabase.table(table).select("*").execute()
-                df = pd.DataFrame(res.data) if res.data else pd.DataFrame(columns=expected_cols)
-                for col in expected_cols:
-                    if col not in df.columns: df[col] = None
-                return df
-            except:
-                return pd.DataFrame(columns=expected_cols)
-
-        bets = get_df_safe("bets", ['key','user','match_id','pick','stake','odds','result','payout','net','gw','placed_at','chip_used'])
-        odds = get_df_safe("odds", ['match_id','home_win','draw','away_win'])
-        results = get_df_safe("result", ['match_id','gw','home','away','utc_kickoff','status','home_score','away_score','bm_shield'])
-        bm_log = get_df_safe("bm_log", ['gw','bookmaker'])
-        users = get_df_safe("users", ['username','password','role','team'])
-        config = get_df_safe("config", ['key','value'])
-        user_chips = get_df_safe("user_chips", ['user_name','chip_type','amount'])
-        
-        if not bets.empty:
-            bets['pick'] = bets['pick'].astype(str).str.strip().str.upper()
-            bets['gw'] = bets['gw'].astype(str).str.strip().str.upper()
-            bets['result'] = bets['result'].astype(str).str.strip().str.upper().replace({'NONE': '', 'NAN': ''})
-            bets['net'] = pd.to_numeric(bets['net'], errors='coerce').fillna(0)
-            bets['chip_used'] = bets['chip_used'].fillna("")
-        
-        if not results.empty:
-            results['status'] = results['status'].astype(str).str.strip().str.upper()
-            results['gw'] = results['gw'].astype(str).str.strip().str.upper()
-            results['bm_shield'] = results['bm_shield'].fillna(False)
-            
+                ent = self._refresh(table, ent)
+            except Exception as e:
+                print(f"Cache Refresh Error ({table}): {e}")
+                if ent: return ent['version'], ent['df']
+                return 0, normalize_table(table, pd.DataFrame(columns=TABLE_SPECS[table]['cols']))
+            return ent['version'], ent['df']
+
+    def derived(self, table, name, build):
+        """build(df) memoized per table version, for indexes and other structures derived from a table."""
+        version, df = self.get(table)
+        hit = self._derived.get((table, name))
+        if hit and hit[0] == version: return hit[1]
+        obj = build(df)
+        with self._meta_lock: self._derived[(table, name)] = (version, obj)
+        return obj
+
+    def drop_rows(self, table, keys):
+        """Publish a new version without the rows whose (single-column) primary key is in keys.
+
+        For deletes made by the app itself: the cached frame is patched instead of reloaded.
+        """
+        pk = TABLE_SPECS[table]['pk'][0]
+        keys = {str(k) for k in keys}
+        with self._table_locks[table]:
+            ent = self._current.get(table)
+            if not ent or not keys: return
+            keep = ~ent['df'][pk].astype(str).isin(keys)
+            if keep.all(): return
+            df = ent['df'][keep].reset_index(drop=True)
+            new_ent = dict(ent, version=ent['version'] + 1, df=df, nbytes=int(df.memory_usage(deep=True).sum()))
+            with self._meta_lock:
+                self._archive[(table, ent['version'])] = (ent['df'], ent['nbytes'])
+                self._current[table] = new_ent
+                self._evict()
+
+    def get_version(self, table, version):
+        """Look up a specific (possibly superseded) version, or None if it was evicted."""
+        ent = self._current.get(table)
+        if ent and ent['version'] == version: return ent['df']
+        with self._meta_lock:
+            hit = self._archive.get((table, version))
+            if hit is None: return None
+            self._archive.move_to_end((table, version))
+            return hit[0]
+
+    def stats(self):
+        with self._meta_lock:
+            return {
+                'tables': {t: {'version': e['version'], 'rows': len(e['df']), 'bytes': e['nbytes'], 'age_sec': round(time.time() - e['loaded_at'], 1)} for t, e in self._current.items()},
+                'archived_versions': len(self._archive),
+                'total_bytes': self._total_bytes(),
+            }
+
+    def _is_fresh(self, table, ent):
+        if ent is None: return False
+        return ent['seq'] == self._dirty_seq[table] and (time.time() - ent['loaded_at']) < self.ttl_sec
+
+    def _refresh(self, table, ent):
+        spec = TABLE_SPECS[table]
+        wm = spec['watermark']
+        with self._meta_lock:
+            seq = self._dirty_seq[table]
+            full = table in self._full_pending
+            self._full_pending.discard(table)
+        now_ts = time.time()
+        full = full or ent is None or ent['mark'] is None or (now_ts - ent['full_at']) > DELTA_FULL_RELOAD_SEC
+        try:
+            if full:
+                df = normalize_table(table, read_table_paged(table, ",".join(spec['cols'])))
+                changed = True
+            else:
+                # gte, not gt: rows written in the same instant as the mark (parallel batches, other writers)
+                # may land after the last read; the ones already held are dropped again
+                delta = read_table_paged(table, ",".join(spec['cols']), where=lambda q: q.gte(wm, ent['mark']))
+                if not delta.empty: delta = unseen_at_mark(delta, ent['df'], wm, ent['mark'], spec['pk'])
+                changed = not delta.empty
+                # re-type after the merge: concat of differing categoricals falls back to object
+                df = normalize_table(table, merge_by_pk(ent['df'], delta, spec['pk'])) if changed else ent['df']
+        except Exception:
+            if full:
+                with self._meta_lock: self._full_pending.add(table)
+            raise
+        marks = df[wm].dropna() if wm and not df.empty else pd.Series(dtype=object)
+        new_ent = {
+            'version': (ent['version'] + 1 if changed else ent['version']) if ent else 1,
+            'df': df,
+            'mark': str(marks.astype(str).max()) if not marks.empty else None,
+            'loaded_at': now_ts,
+            'full_at': now_ts if full else ent['full_at'],
+            'seq': seq,
+            'nbytes': int(df.memory_usage(deep=True).sum()) if changed else ent['nbytes'],
+        }
+        with self._meta_lock:
+            if ent and changed:
+                self._archive[(table, ent['version'])] = (ent['df'], ent['nbytes'])
+            self._current[table] = new_ent
+            self._evict()
+        return new_ent
+
+    def _total_bytes(self):
+        return sum(e['nbytes'] for e in self._current.values()) + sum(n for _, n in self._archive.values())
+
+    def _evict(self):
+        # Current versions are never evicted; the oldest superseded ones go first
+        while self._archive and self._total_bytes() > self.max_bytes:
+            self._archive.popitem(last=False)
+
+@st.cache_resource
+def get_table_cache():
+    return SharedTableCache()
+
+def invalidate_tables(*tables, full=False):
+    """Call after every app-side write. full=True when the write does not move the watermark (update/delete)."""
+    get_table_cache().invalidate(*tables, full=full)
+
+def get_table(table):
+    _, df = get_table_cache().get(table)
+    return df.copy(deep=False)
+
+# --- V11.11 ODDS BOOK ---
+class OddsBook:
+    """Odds indexed by match_id: float64 home/draw/away columns behind a hash index.
+
+    Replaces odds_df[odds_df['match_id'] == mid] scans; the first row wins on duplicate ids,
+    as it did with .iloc[0].
+    """
+    PICKS = ('HOME', 'DRAW', 'AWAY')
+
+    def __init__(self, odds_df):
+        df = odds_df.drop_duplicates('match_id')
+        self._index = pd.Index(df['match_id'].to_numpy(dtype='int64'))
+        self._prices = np.column_stack([df[c].to_numpy(dtype='float64') for c in ('home_win', 'draw', 'away_win')]).reshape(-1, 3)
+        self._ai = None  # predictions() の全行分、初回に計算
+
+    def __len__(self):
+        return len(self._index)
+
+    def row(self, match_id):
+        """(home_win, draw, away_win) as floats, or None when the match has no odds row."""
+        try: return tuple(self._prices[self._index.get_loc(int(match_id))].tolist())
+        except KeyError: return None
+
+    def lookup(self, match_ids, picks, default=np.nan):
+        """Price of each (match_id, pick) pair; default where the match has no odds or the pick is not HOME/DRAW/AWAY."""
+        pos = self._index.get_indexer(np.asarray(match_ids, dtype='int64'))
+        picks = np.asarray(picks, dtype=object)
+        col = np.select([picks == p for p in self.PICKS], [0, 1, 2], -1)
+        ok = (pos >= 0) & (col >= 0)
+        out = np.full(len(pos), default, dtype='float64')
+        out[ok] = self._prices[pos[ok], col[ok]]
+        return out
+
+    def predictions(self, match_ids):
+        """AI pick (None without a full set of positive odds) and confidence % for each match_id.
+
+        The pick / confidence of every row is computed once per book, i.e. once per odds version.
+        """
+        if self._ai is None:
+            p = self._prices
+            valid = (p > 0).all(axis=1)  # NaN 価格も無効
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ip = 1 / p
+                pct = ip / ip.sum(axis=1, keepdims=True) * 100
+            h, d, a = pct[:, 0], pct[:, 1], pct[:, 2]
+            # 同率は DRAW (スカラー版の if / elif / else と同じ順序)
+            col = np.select([(h > a) & (h > d), (a > h) & (a > d)], [0, 2], 1)
+            picks = np.array(self.PICKS, dtype=object)[col]
+            picks[~valid] = None
+            conf = np.where(valid, pct[np.arange(len(col)), col], 0).astype('int64')
+            self._ai = (picks, conf)
+        picks, conf = self._ai
+        pos = self._index.get_indexer(np.asarray(match_ids, dtype='int64'))
+        hit = pos >= 0
+        out_p = np.full(len(pos), None, dtype=object)
+        out_c = np.zeros(len(pos), dtype='int64')
+        out_p[hit], out_c[hit] = picks[pos[hit]], conf[pos[hit]]
+        return out_p, out_c
+
+def get_odds_book():
+    """OddsBook of the cached odds table, rebuilt only when a new odds version is loaded."""
+    return get_table_cache().derived("odds", "book", OddsBook)
+
+def run_parallel(jobs, label, max_workers=FETCH_MAX_WORKERS):
+    """Run independent loaders ({name: callable}) concurrently; returns {name: result}.
+
+    Per-job and wall-clock timings are recorded in FETCH_TIMINGS[label]. The first job
+    exception is re-raised after all jobs finish.
+    """
+    def timed(fn):
+        t0 = time.perf_counter()
+        try: return fn(), time.perf_counter() - t0
+        except Exception as e: return e, time.perf_counter() - t0
+    t_wall = time.perf_counter()
+    if len(jobs) <= 1 or max_workers <= 1:
+        done = {name: timed(fn) for name, fn in jobs.items()}
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs)), thread_name_prefix=label) as pool:
+            futures = {name: pool.submit(timed, fn) for name, fn in jobs.items()}
+            done = {name: f.result() for name, f in futures.items()}
+    timings = {name: round(sec, 4) for name, (_, sec) in done.items()}
+    timings['_wall'] = round(time.perf_counter() - t_wall, 4)
+    FETCH_TIMINGS[label] = timings
+    for res, _ in done.values():
+        if isinstance(res, Exception): raise res
+    return {name: res for name, (res, _) in done.items()}
+
+def flush_upserts(table, rows, label, batch_size=WRITE_BATCH_SIZE, max_workers=WRITE_MAX_WORKERS, failed_rows=None):
+    """Write a plan of row dicts as batched upserts keyed on the table's primary key.
+
+    All rows must carry the same columns (PostgREST bulk upsert). A failed batch does not stop
+    the others; the report {rows, written, batches, failed: [{first_key, rows, error}], sec}
+    is returned and kept in WRITE_REPORTS[label]. failed_rows: a list that receives the rows of
+    the failed batches, for callers that retry them.
+    """
+    pk = TABLE_SPECS.get(table, {}).get('pk', [])
+    report, _, failed = _send_batches(
+        table, rows, label, batch_size, max_workers,
+        lambda batch: supabase.table(table).upsert(batch, on_conflict=",".join(pk)).execute(),
+        lambda batch: [batch[0].get(c) for c in pk])
+    if failed_rows is not None: failed_rows.extend(row for batch in failed for row in batch)
+    return report
+
+def flush_deletes(table, column, values, label, batch_size=100, max_workers=WRITE_MAX_WORKERS):
+    """Delete rows whose column is in values, in_() batches at a time (kept short for the URL).
+
+    Returns (report, deleted values); the report has the same shape as flush_upserts'.
+    """
+    report, ok, _ = _send_batches(
+        table, list(values), label, batch_size, max_workers,
+        lambda batch: supabase.table(table).delete().in_(column, batch).execute(),
+        lambda batch: batch[0])
+    return report, [v for batch in ok for v in batch]
+
+def _send_batches(table, items, label, batch_size, max_workers, send, first_key):
+    t0 = time.perf_counter()
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    def attempt(batch):
+        try:
+            send(batch)
+            return None
+        except Exception as e: return e
+    if len(batches) <= 1 or max_workers <= 1:
+        errors = [attempt(b) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(batches)), thread_name_prefix=f"write:{table}") as pool:
+            errors = list(pool.map(attempt, batches))
+    failed = [{"first_key": first_key(b), "rows": len(b), "error": str(e)} for b, e in zip(batches, errors) if e is not None]
+    report = {
+        "rows": len(items), "written": len(items) - sum(f["rows"] for f in failed),
+        "batches": len(batches), "failed": failed, "sec": round(time.perf_counter() - t0, 4),
+    }
+    WRITE_REPORTS[label] = report
+    return report, [b for b, e in zip(batches, errors) if e is None], [b for b, e in zip(batches, errors) if e is not None]
+
+def fetch_all_data():
+    try:
+        cache = get_table_cache()
+        names = ["bets", "odds", "result", "bm_log", "users", "config", "user_chips"]
+        # Only stale tables go to the pool; a fully warm cache costs no threads at all
+        stale = {t: (lambda t=t: cache.get(t)) for t in names if not cache.is_fresh(t)}
+        if stale: run_parallel(stale, "fetch_all_data")
+        bets, odds, results, bm_log, users, config, user_chips = [cache.get(t)[1].copy(deep=False) for t in names]
         return bets, odds, results, bm_log, users, config, user_chips
     except Exception as e:
         st.error(f"System Error: {e}")
         return [pd.DataFrame()]*7
 
+# --- V11.3 DATA REQUIREMENTS ---
+# 画面ごとに必要なテーブルと行スコープを宣言。ここに無いテーブルはその画面では読み込まない。
+# scope: "all" = 全行 / "gw" = target GW の試合 (match_id) に紐づく行のみ
+PAGE_REQUIREMENTS = {
+    "LOGIN": {"users": "all"},
+    # sidebar / budget / BM 判定。LIVE・HISTORY・DASHBOARD・CHIPS はこの範囲だけで描画できる
+    "BASE": {"bets": "all", "result": "all", "bm_log": "all", "users": "all", "user_chips": "all"},
+    # odds は OddsBook (get_odds_book) で match_id 引きするので全行
+    "MATCHES": {"result": "gw", "odds": "all", "bets": "gw"},
+    # ADMIN は BASE の result / config と get_odds_book() だけで足りるので宣言なし
+}
+
+def load_frames(tables):
+    """Load only the given tables from the shared cache (stale ones concurrently)."""
+    cache = get_table_cache()
+    stale = {t: (lambda t=t: cache.get(t)) for t in tables if not cache.is_fresh(t)}
+    if stale: run_parallel(stale, f"load:{','.join(sorted(stale))}")
+    return {t: cache.get(t)[1].copy(deep=False) for t in tables}
+
+def load_page_data(page, target_gw=None):
+    """Resolve PAGE_REQUIREMENTS[page] into {table: frame} with row scopes applied."""
+    reqs = PAGE_REQUIREMENTS[page]
+    needs_gw = any(scope == "gw" for scope in reqs.values())
+    frames = load_frames(list(reqs) + (["result"] if needs_gw and "result" not in reqs else []))
+    if needs_gw:
+        res = frames["result"]
+        gw_mids = res.loc[res['gw'] == target_gw, 'match_id']
+        for t, scope in reqs.items():
+            if scope != "gw": continue
+            df = frames[t]
+            frames[t] = df[df['gw'] == target_gw] if t == "result" else df[df['match_id'].isin(gw_mids)]
+    return {t: frames[t] for t in reqs}
+
+def check_login(username, password):
+    """users.password is never cached; it is read for the one user at login time only."""
+    try:
+        res = supabase.table("users").select("password").eq("username", username).execute()
+        return bool(res.data) and str(res.data[0]['password']) == password
+    except: return False
+
+# --- V11.10 BACKGROUND WORKER ---
+WORKER_HEARTBEAT_KEY = "WORKER_HEARTBEAT"  # config.value = {"at": iso, "next": iso} (worker.py が毎サイクル書き込む)
+WORKER_GRACE_SEC = 180  # 予定時刻を過ぎてもこの秒数以内なら worker は生きているとみなす
+WORKER_MAX_SILENCE_SEC = 900  # 予定 (next) に関わらず、最後の heartbeat からこれ以上経ったら停止とみなす (落ちた cron / kill されたループ)
+WORKER_STATE_KEY = "WORKER_STATE"  # config.value = export_worker_state() の JSON。cron (worker.py --once) の実行間で差分状態を引き継ぐ
+
+def worker_is_alive(config_df):
+    """True while worker.py keeps its heartbeat; the app then skips sync/settle in the request path.
+
+    The worker's own plan (next) can be hours away outside match windows, so the heartbeat also
+    expires WORKER_MAX_SILENCE_SEC after it was written (at); the looping worker refreshes it while idle.
+    """
+    raw = get_config_value(config_df, WORKER_HEARTBEAT_KEY, None)
+    if not raw: return False
+    try:
+        beat = json.loads(raw)
+        due = min(pd.Timestamp(beat["next"]), pd.Timestamp(beat["at"]) + pd.Timedelta(seconds=WORKER_MAX_SILENCE_SEC))
+        return pd.Timestamp.now(tz=JST) <= due + pd.Timedelta(seconds=WORKER_GRACE_SEC)
+    except: return False
+
+def export_worker_state():
+    """The process-local incremental state a fresh worker process would otherwise start without:
+    last full settlement rescan + queued match_ids, last maintenance run, sync_api validators."""
+    return {"settle": get_settle_queue().export(), "maintenance_last_run": get_maintenance_state().last_run,
+            "api_validators": get_api_sync_state().export()}
+
+def restore_worker_state(config_df):
+    """Load export_worker_state() from config (written by the previous worker run); newer in-process state wins."""
+    raw = get_config_value(config_df, WORKER_STATE_KEY, None)
+    if not raw: return False
+    try: saved = json.loads(raw)
+    except (TypeError, ValueError): return False
+    get_settle_queue().restore(saved.get("settle") or {})
+    m = get_maintenance_state()
+    m.last_run = max(m.last_run, float(saved.get("maintenance_last_run") or 0))
+    get_api_sync_state().restore(saved.get("api_validators") or {})
+    return True
+
 def get_api_token(config_df):
     token = st.secrets.get("api_token")
     if token: return token
@@ -198,374 +683,1088 @@ def get_config_value(config_df, key, default):
             return row.iloc[0]['value']
     return default
 
-def to_jst(iso_str):
-    if not iso_str: return None
-    try:
-        dt = pd.to_datetime(iso_str)
-        if dt.tz is None: dt = dt.tz_localize('UTC')
-        return dt.tz_convert(JST)
-    except: return None
+def kickoff_jst(utc_kickoff):
+    """utc_kickoff strings -> tz-aware JST timestamps in one vectorized parse (naive = UTC, unparsable = NaT)."""
+    return pd.to_datetime(utc_kickoff, utc=True, errors='coerce', format='ISO8601').dt.tz_convert(JST)
 
-def get_recent_form_html(team_name, results_df, current_kickoff_jst, target_season):
-    if results_df.empty: return "-"
-    if 'dt_jst' not in results_df.columns:
-        results_df['dt_jst'] = results_df['utc_kickoff'].apply(to_jst)
-    season_start = pd.Timestamp(f"{target_season}-07-01", tz=JST) 
-    past = results_df[
-        (results_df['dt_jst'] >= season_start) &
-        (results_df['status'] == 'FINISHED') & 
-        (results_df['dt_jst'] < current_kickoff_jst) &
-        ((results_df['home'] == team_name) | (results_df['away'] == team_name))
-    ].sort_values('dt_jst', ascending=False).head(5)
-    if past.empty: return '<span style="opacity:0.2">-</span>'
-    past = past.iloc[::-1]
+def lock_times(results_df, lock_minutes):
+    """lock_at per match: lock_minutes_before_earliest before the kickoff (NaT when the kickoff is unknown)."""
+    return results_df['dt_jst'] - pd.Timedelta(minutes=float(lock_minutes))
+
+# --- V11.16 TEAM FORM INDEX ---
+FORM_LAST_N = 5  # MATCHES のフォーム表示に並べる直近試合数
+FORM_MARKS = {'W': '<span style="color:#4ade80">●</span>', 'D': '<span style="color:#9ca3af">●</span>', 'L': '<span style="color:#f87171">●</span>'}
+
+class TeamFormIndex:
+    """Finished matches per team in kickoff order, as (kickoff ns, H/A, W/D/L) arrays.
+
+    "Last N before T in the season" is two searchsorted calls and a slice; the rendered HTML
+    is memoized per (team, kickoff, season). Built once per results version (get_team_form_index).
+    """
+    def __init__(self, results_df):
+        self._teams = {}
+        self._html = {}
+        if results_df.empty: return
+        fin = results_df[(results_df['status'] == 'FINISHED') & results_df['dt_jst'].notna()]
+        home, away = fin['home'].astype(object).to_numpy(), fin['away'].astype(object).to_numpy()
+        h = fin['home_score'].fillna(0).to_numpy(dtype='int64')
+        a = fin['away_score'].fillna(0).to_numpy(dtype='int64')
+        ko = pd.DatetimeIndex(fin['dt_jst']).as_unit('ns').asi8
+        home_res = np.where(h > a, 'W', np.where(h == a, 'D', 'L'))
+        away_res = np.where(a > h, 'W', np.where(h == a, 'D', 'L'))
+        not_self = home != away  # a team listed on both sides counts once, as home
+        rows = pd.DataFrame({
+            'team': np.concatenate([home, away[not_self]]), 'ko': np.concatenate([ko, ko[not_self]]),
+            'ha': np.concatenate([np.full(len(home), 'H'), np.full(int(not_self.sum()), 'A')]),
+            'res': np.concatenate([home_res, away_res[not_self]]),
+        }).sort_values(['team', 'ko'], kind='stable')
+        for team, g in rows.groupby('team', sort=False):
+            self._teams[team] = (g['ko'].to_numpy(), g['ha'].to_numpy(), g['res'].to_numpy())
+
+    def last(self, team_name, before, since, n=FORM_LAST_N):
+        """[(H/A, W/D/L), ...] oldest first: the team's last n finished matches with since <= kickoff < before."""
+        hit = self._teams.get(team_name)
+        if hit is None: return []
+        ko, ha, res = hit
+        lo = np.searchsorted(ko, pd.Timestamp(since).value, side='left')
+        hi = np.searchsorted(ko, pd.Timestamp(before).value, side='left')
+        start = max(lo, hi - n)
+        return list(zip(ha[start:hi].tolist(), res[start:hi].tolist()))
+
+    def html(self, team_name, kickoff_jst, target_season):
+        key = (team_name, kickoff_jst, target_season)
+        hit = self._html.get(key)
+        if hit is None:
+            hit = self._html[key] = render_form_html(self.last(team_name, kickoff_jst, pd.Timestamp(f"{target_season}-07-01", tz=JST)))
+        return hit
+
+def render_form_html(form):
+    if not form: return '<span style="opacity:0.2">-</span>'
     html_parts = ['<div class="form-container"><span class="form-arrow">OLD</span>']
-    for _, g in past.iterrows():
-        is_home = (g['home'] == team_name)
-        ha_label = "H" if is_home else "A"
-        h = int(g['home_score']) if pd.notna(g['home_score']) else 0
-        a = int(g['away_score']) if pd.notna(g['away_score']) else 0
-        icon = '<span style="color:#f87171">●</span>' 
-        if h == a: icon = '<span style="color:#9ca3af">●</span>'
-        elif (is_home and h > a) or (not is_home and a > h): icon = '<span style="color:#4ade80">●</span>'
-        html_parts.append(f'<div class="form-item"><span class="form-ha">{ha_label}</span><span class="form-mark">{icon}</span></div>')
+    for ha_label, res in form:
+        html_parts.append(f'<div class="form-item"><span class="form-ha">{ha_label}</span><span class="form-mark">{FORM_MARKS[res]}</span></div>')
     html_parts.append('<span class="form-arrow">NEW</span></div>')
     return "".join(html_parts)
 
+def get_team_form_index():
+    """TeamFormIndex of the cached results table, rebuilt only when a new results version is loaded."""
+    return get_table_cache().derived("result", "form_index", TeamFormIndex)
+
+def get_recent_form_html(team_name, results_df, current_kickoff_jst, target_season, form_index=None):
+    """Form badges (last FORM_LAST_N finished matches of the season before the kickoff).
+    form_index: a TeamFormIndex of results_df (get_team_form_index); built here when not given."""
+    if results_df.empty: return "-"
+    if form_index is None: form_index = TeamFormIndex(results_df)
+    return form_index.html(team_name, current_kickoff_jst, target_season)
+
+# --- V11.18 TEAM RATINGS ---
+# result の FINISHED 試合から Poisson の攻撃力 / 守備力を推定する (オッズ未入力の試合にも予想を出すため)
+RATINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "team_ratings.json")  # パラメータ保存先: 消しても次回フィットし直す
+RATING_HALF_LIFE_DAYS = 180  # 古い試合の重みが半分になる日数
+RATING_PRIOR_GOALS = 3.0  # 各レーティングを平均 (0) に引き寄せる擬似ゴール数。試合数の少ないチーム用
+RATING_MAX_ITER = 200
+RATING_TOL = 1e-7
+RATING_MAX_GOALS = 10  # 予想確率はこの得点数までのスコア表で計算
+
+class TeamRatings:
+    """Poisson attack / defence ratings per team, fitted on every finished match of the result table.
+
+    log E[home goals] = base + home + att[home] + dfn[away],  log E[away goals] = base + att[away] + dfn[home]
+    (dfn is defensive weakness: higher concedes more). Matches are weighted by age (RATING_HALF_LIFE_DAYS)
+    and each rating is shrunk towards the league average with RATING_PRIOR_GOALS pseudo goals.
+    fit() runs block coordinate updates (bincount sums over all matches per sweep); given the
+    previous fit it starts from those parameters, so a few new results converge in a few sweeps.
+    """
+    def __init__(self, teams=None, home=0.0, base=0.0, fitted=None, iterations=0, mode="empty", fitted_at=None):
+        self.teams = teams or {}  # team -> (att, dfn)
+        self.home = home
+        self.base = base
+        self.fitted = fitted or {}  # match_id -> (home_score, away_score) the parameters were fitted on
+        self.iterations = iterations
+        self.mode = mode
+        self.fitted_at = fitted_at
+
+    def __len__(self): return len(self.fitted)
+
+    @staticmethod
+    def finished(results_df):
+        """The finished matches with a score and a kickoff, in kickoff order."""
+        if results_df.empty: return results_df
+        fin = results_df[(results_df['status'] == 'FINISHED') & results_df['home_score'].notna()
+                         & results_df['away_score'].notna() & results_df['dt_jst'].notna()]
+        return fin.sort_values(['dt_jst', 'match_id'], kind='stable')
+
+    @classmethod
+    def fit(cls, results_df, prev=None):
+        """Ratings for results_df; prev (an earlier fit) is returned as is when the finished matches are unchanged."""
+        fin = cls.finished(results_df)
+        hs, as_ = fin['home_score'].to_numpy(dtype='float64'), fin['away_score'].to_numpy(dtype='float64')
+        fitted = dict(zip(fin['match_id'].astype('int64').tolist(), zip(hs.astype('int64').tolist(), as_.astype('int64').tolist())))
+        if prev is not None and prev.fitted == fitted: return prev
+        if fin.empty: return cls()
+
+        n = len(fin)
+        codes, teams = pd.factorize(np.concatenate([fin['home'].astype(object).to_numpy(), fin['away'].astype(object).to_numpy()]))
+        hi, ai, k = codes[:n], codes[n:], len(teams)
+        ko = pd.DatetimeIndex(fin['dt_jst']).as_unit('ns').asi8
+        w = 0.5 ** ((ko.max() - ko) / (86400e9 * RATING_HALF_LIFE_DAYS))
+        warm = prev is not None and bool(prev.teams)
+        start = np.array([(prev.teams if warm else {}).get(t, (0.0, 0.0)) for t in teams], dtype='float64').reshape(-1, 2)
+        att, dfn = start[:, 0].copy(), start[:, 1].copy()
+        home = prev.home if warm else 0.0
+        base = prev.base if warm else float(np.log((np.dot(w, as_) + RATING_PRIOR_GOALS) / (w.sum() + RATING_PRIOR_GOALS)))
+        wh, wa, p = w * hs, w * as_, RATING_PRIOR_GOALS
+
+        for it in range(1, RATING_MAX_ITER + 1):
+            old = np.concatenate([att, dfn, [home, base]])
+            # 各ブロックは他を固定したときの (擬似ゴール付き) 最尤解: 得点の重み付き合計 / 期待得点の重み付き合計
+            num = np.bincount(hi, wh, k) + np.bincount(ai, wa, k)
+            den = np.bincount(hi, w * np.exp(base + home + dfn[ai]), k) + np.bincount(ai, w * np.exp(base + dfn[hi]), k)
+            att = np.log((num + p) / (den + p))
+            num = np.bincount(ai, wh, k) + np.bincount(hi, wa, k)
+            den = np.bincount(ai, w * np.exp(base + home + att[hi]), k) + np.bincount(hi, w * np.exp(base + att[ai]), k)
+            dfn = np.log((num + p) / (den + p))
+            home = float(np.log((wh.sum() + p) / (np.dot(w, np.exp(base + att[hi] + dfn[ai])) + p)))
+            base += float(np.log((wh.sum() + wa.sum() + p) / (np.dot(w, np.exp(base + home + att[hi] + dfn[ai]) + np.exp(base + att[ai] + dfn[hi])) + p)))
+            # 平均 0 に正規化 (ずれは base に移す)
+            base += float(att.mean() + dfn.mean())
+            att -= att.mean()
+            dfn -= dfn.mean()
+            if np.abs(np.concatenate([att, dfn, [home, base]]) - old).max() < RATING_TOL: break
+
+        known = dict(prev.teams) if warm else {}  # 今回の試合に出てこないチームも残す
+        known.update({t: (float(x), float(y)) for t, x, y in zip(teams, att, dfn)})
+        return cls(known, home, base, fitted, it, "warm" if warm else "cold", datetime.datetime.now(JST).isoformat())
+
+    def predict(self, home_teams, away_teams):
+        """(picks, confidence %, expected home goals, expected away goals) arrays; picks are None before the first fit.
+
+        Probabilities come from the two Poisson score distributions up to RATING_MAX_GOALS (renormalized);
+        ties between the top outcomes go to DRAW, as with the odds-based prediction.
+        """
+        home_teams, away_teams = np.asarray(home_teams, dtype=object), np.asarray(away_teams, dtype=object)
+        n = len(home_teams)
+        if not self.fitted: return np.full(n, None, dtype=object), np.zeros(n, dtype='int64'), np.zeros(n), np.zeros(n)
+        rh = np.array([self.teams.get(t, (0.0, 0.0)) for t in home_teams], dtype='float64').reshape(-1, 2)
+        ra = np.array([self.teams.get(t, (0.0, 0.0)) for t in away_teams], dtype='float64').reshape(-1, 2)
+        lh = np.exp(self.base + self.home + rh[:, 0] + ra[:, 1])
+        la = np.exp(self.base + ra[:, 0] + rh[:, 1])
+        g = np.arange(RATING_MAX_GOALS + 1)
+        log_fact = np.concatenate([[0.0], np.cumsum(np.log(g[1:]))])
+        ph = np.exp(-lh[:, None] + g * np.log(lh[:, None]) - log_fact)
+        pa = np.exp(-la[:, None] + g * np.log(la[:, None]) - log_fact)
+        grid = ph[:, :, None] * pa[:, None, :]
+        p_h = grid[:, g[:, None] > g[None, :]].sum(axis=1)
+        p_d = grid[:, g[:, None] == g[None, :]].sum(axis=1)
+        p_a = grid[:, g[:, None] < g[None, :]].sum(axis=1)
+        total = p_h + p_d + p_a
+        pct = np.column_stack([p_h, p_d, p_a]) / total[:, None] * 100
+        col = np.select([(pct[:, 0] > pct[:, 2]) & (pct[:, 0] > pct[:, 1]), (pct[:, 2] > pct[:, 0]) & (pct[:, 2] > pct[:, 1])], [0, 2], 1)
+        picks = np.array(OddsBook.PICKS, dtype=object)[col]
+        return picks, pct[np.arange(n), col].astype('int64'), lh, la
+
+    def to_json(self):
+        return {"home": self.home, "base": self.base, "teams": {t: list(v) for t, v in self.teams.items()},
+                "fitted": [[m, h, a] for m, (h, a) in self.fitted.items()], "iterations": self.iterations, "fitted_at": self.fitted_at}
+
+    @classmethod
+    def from_json(cls, d):
+        return cls({t: tuple(v) for t, v in d["teams"].items()}, d["home"], d["base"],
+                   {int(m): (int(h), int(a)) for m, h, a in d["fitted"]}, d.get("iterations", 0), "stored", d.get("fitted_at"))
+
+    def stats(self):
+        return {"mode": self.mode, "matches": len(self.fitted), "teams": len(self.teams), "iterations": self.iterations,
+                "home_adv": round(float(np.exp(self.home)), 3) if self.fitted else None, "fitted_at": self.fitted_at}
+
+def load_team_ratings(path=RATINGS_PATH):
+    try:
+        with open(path, encoding="utf-8") as f: return TeamRatings.from_json(json.load(f))
+    except FileNotFoundError: return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Team Ratings Load Error ({path}): {e}")
+        return None
+
+def save_team_ratings(ratings, path=RATINGS_PATH):
+    """Written to a temp file and renamed, so the app and worker.py never read a half-written file."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(ratings.to_json(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError as e: print(f"Team Ratings Save Error ({path}): {e}")
+
+def update_team_ratings(results_df, path=RATINGS_PATH):
+    """Stored ratings brought up to date with results_df: no fit when the finished matches are unchanged,
+    a warm-started fit when sync_api brought new FINISHED results (or corrected a score)."""
+    prev = load_team_ratings(path)
+    ratings = TeamRatings.fit(results_df, prev)
+    if ratings is not prev and ratings.fitted: save_team_ratings(ratings, path)
+    return ratings
+
+def get_team_ratings():
+    """TeamRatings of the cached results table, brought up to date only when a new results version is loaded."""
+    return get_table_cache().derived("result", "ratings", update_team_ratings)
+
 def extract_gw_num(gw_str):
     try:
         return int(re.sub(r'\D', '', str(gw_str)))
     except: return 0
 
 # --- MATCH LOCK LOGIC ---
-def is_match_locked(kickoff_iso, lock_minutes):
-    if not kickoff_iso: return True
-    try:
-        ko_dt = pd.to_datetime(kickoff_iso)
-        if ko_dt.tz is None: ko_dt = ko_dt.tz_localize('UTC')
-        ko_dt = ko_dt.tz_convert(JST)
-        lock_time = ko_dt - timedelta(minutes=lock_minutes)
-        return datetime.datetime.now(JST) >= lock_time
-    except: return True
-
-def settle_bets_date_aware():
+def is_match_locked(lock_at, now=None):
+    """lock_at: the match's lock_times() value; a match without a valid kickoff stays locked."""
+    if pd.isna(lock_at): return True
+    return (now or datetime.datetime.now(JST)) >= lock_at
+
+# --- V11.8 VECTORIZED SETTLEMENT ---
+def compute_settlement(merged, book):
+    """Settle bets joined to their match rows as whole-column operations.
+
+    merged: bets + match_status / home_score / away_score / gw_num / bm_shield (one row per bet);
+    book: OddsBook of the current odds.
+    Rules: outcome from the final score; GW21+ pays the current odds row for the pick, earlier GWs
+    the odds stored on the bet (1.0 when missing/0); BOOST adds +1.0; bm_shield makes the bet VOID.
+    Returns only the bets whose result / net (or GW21+ odds) differ from what is stored, with
+    result_new / payout_new / net_new / odds_new / odds_changed columns added.
+    """
+    fin = merged[(merged['match_status'] == 'FINISHED') & merged['home_score'].notna() & merged['away_score'].notna()]
+    h = fin['home_score'].to_numpy(dtype='int64')
+    a = fin['away_score'].to_numpy(dtype='int64')
+    outcome = np.where(h > a, 'HOME', np.where(a > h, 'AWAY', 'DRAW'))
+    pick = fin['pick'].astype(object).to_numpy()
+    res = np.where(fin['bm_shield'].to_numpy(dtype=bool), 'VOID', np.where(pick == outcome, 'WIN', 'LOSE'))
+
+    stake = fin['stake'].to_numpy(dtype='float64')
+    stored = fin['odds'].to_numpy(dtype='float64')
+    stored_ok = ~np.isnan(stored) & (stored != 0)
+    live_rule = fin['gw_num'].to_numpy() >= 21
+    live = book.lookup(fin['match_id'], pick, default=1.0)
+    live = np.where(np.isnan(live), 1.0, live)  # no odds row (or an empty cell) -> 1.0
+    base = np.where(live_rule, live, np.where(stored_ok, stored, 1.0))
+    base = np.where(fin['chip_used'].astype(object).to_numpy() == 'BOOST', base + 1.0, base)
+
+    win_payout = np.trunc(stake * base)
+    payout = np.select([res == 'WIN', res == 'VOID'], [win_payout, np.trunc(stake)], 0.0).astype('int64')
+    net = np.select([res == 'WIN', res == 'VOID'], [np.trunc(win_payout - stake), 0.0], np.trunc(-stake)).astype('int64')
+
+    odds_changed = live_rule & (np.abs(np.where(stored_ok, stored, 0.0) - base) > 0.01)
+    changed = (fin['result'].astype(object).to_numpy() != res) | (fin['net'].to_numpy(dtype='int64') != net) | odds_changed
+    return fin[changed].assign(
+        result_new=res[changed], payout_new=payout[changed], net_new=net[changed],
+        odds_new=base[changed], odds_changed=odds_changed[changed])
+
+def build_auto_bets(finished, usernames, df_b, bm_map, book, placed_at):
+    """AUTO bets (HOME, ¥100, current home odds) as one anti-join:
+    users × finished matches, minus users who already bet on the match, minus that GW's bookmaker.
+    """
+    if finished.empty or not len(usernames): return []
+    grid = finished[['match_id', 'gw', 'home', 'away']].astype({'match_id': 'int64', 'gw': str, 'home': str, 'away': str}).merge(
+        pd.DataFrame({'user': pd.Series(usernames, dtype=str)}), how='cross')
+    placed = pd.DataFrame({'match_id': df_b['match_id'].astype('int64'), 'user': df_b['user'].astype(str)}).drop_duplicates()
+    grid = grid.merge(placed, on=['match_id', 'user'], how='left', indicator=True)
+    grid = grid[(grid['_merge'] == 'left_only') & (grid['user'] != grid['gw'].map(bm_map))]
+    odds = book.lookup(grid['match_id'], np.full(len(grid), 'HOME', dtype=object), default=1.0)
+    return [{
+        "key": f"{gw}:{u}:{mid}", "gw": gw, "user": u,
+        "match_id": int(mid), "match": f"{home} vs {away}",
+        "pick": "HOME", "stake": 100, "odds": float(o),
+        "placed_at": placed_at,
+        "status": "AUTO", "result": "", "payout": 0, "net": 0, "chip_used": None
+    } for mid, gw, home, away, u, o in zip(grid['match_id'], grid['gw'], grid['home'], grid['away'], grid['user'], odds)]
+
+# --- V11.9 INCREMENTAL SETTLEMENT ---
+SETTLE_FULL_RESCAN_SEC = 3600  # 差分だけでは拾えない変化 (BM 変更・手動 SQL) の保険として定期的に全件再評価
+SETTLE_MAX_SCOPED = 200  # これを超える変更は in_() で絞るより全件の方が速い
+
+class SettleQueue:
+    """match_ids waiting for settlement (from sync / override / shield / odds edits), shared per process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._last_full = 0.0
+
+    def add(self, match_ids):
+        with self._lock: self._pending.update(int(m) for m in match_ids)
+
+    def take(self):
+        with self._lock:
+            ids, self._pending = self._pending, set()
+            return ids
+
+    def full_due(self):
+        return time.time() - self._last_full > SETTLE_FULL_RESCAN_SEC
+
+    def mark_full(self):
+        with self._lock: self._last_full = time.time()
+
+    def export(self):
+        with self._lock: return {"last_full": self._last_full, "pending": sorted(self._pending)}
+
+    def restore(self, saved):
+        with self._lock:
+            self._last_full = max(self._last_full, float(saved.get("last_full") or 0))
+            self._pending.update(int(m) for m in saved.get("pending") or [])
+
+@st.cache_resource
+def get_settle_queue():
+    return SettleQueue()
+
+def settle_bets_date_aware(match_ids=None, full=False):
+    """Settle bets. match_ids: only bets on these matches (the changes reported by sync_api,
+    result override, shield toggles and odds edits). match_ids=None or full=True rescans the
+    whole 12-GW window (repair mode); a full rescan is also forced every SETTLE_FULL_RESCAN_SEC.
+    """
+    queue = get_settle_queue()
+    if match_ids: queue.add(match_ids)
+    full = full or match_ids is None or queue.full_due()
+    pending = queue.take()
+    if not full and not pending: return 0, "No changes"
+    if len(pending) > SETTLE_MAX_SCOPED: full = True
+    scope_ids = None if full else sorted(pending)
+    scoped = (lambda q: q.in_("match_id", scope_ids)) if scope_ids else None
+    def load_bets():
+        return normalize_table("bets", read_table_paged("bets", where=scoped))
     try:
-        b_res = supabase.table("bets").select("*").execute()
-        r_res = supabase.table("result").select("*").execute()
-        o_res = supabase.table("odds").select("*").execute()
-        u_res = supabase.table("users").select("username").execute()
-        bm_res = supabase.table("bm_log").select("*").execute()
+        loaded = run_parallel({
+            "bets": load_bets,
+            "result": lambda: normalize_table("result", read_table_paged("result", where=scoped)),
+            "odds": lambda: normalize_table("odds", read_table_paged("odds", where=scoped)),
+            "users": lambda: read_table_paged("users", "username"),
+            "bm_log": lambda: read_table_paged("bm_log"),
+        }, "settle_bets_date_aware")
+        df_b, df_r, df_o, df_u, df_bm = loaded["bets"], loaded["result"], loaded["odds"], loaded["users"], loaded["bm_log"]
         
-        if not b_res.data or not r_res.data: return 0, "No data"
+        # A changed match without any bets still needs its auto bets, so only a full rescan stops here
+        if df_r.empty or (full and df_b.empty):
+            queue.add(pending)  # an empty read may be transient: keep the changed ids for the next call
+            return 0, "No data"
         
-        df_b = pd.DataFrame(b_res.data)
-        df_r = pd.DataFrame(r_res.data)
-        df_o = pd.DataFrame(o_res.data) if o_res.data else pd.DataFrame(columns=['match_id','home_win','draw','away_win'])
+        book = OddsBook(df_o)
         
         # Build BM Map
         bm_map = {}
-        if bm_res.data:
-            for item in bm_res.data:
+        if not df_bm.empty:
+            for item in df_bm.to_dict('records'):
                 k = str(item['gw']).strip().upper()
                 bm_map[k] = item['bookmaker']
         
-        # Clean IDs
-        df_b['match_id'] = pd.to_numeric(df_b['match_id'], errors='coerce').fillna(0).astype(int).astype(str)
-        df_b = df_b[df_b['match_id'] != '999999'] 
-        
-        df_r['match_id'] = pd.to_numeric(df_r['match_id'], errors='coerce').fillna(0).astype(int).astype(str)
-        df_r['dt_jst'] = df_r['utc_kickoff'].apply(to_jst)
-        df_r['gw_num'] = df_r['gw'].apply(extract_gw_num)
-        
-        if 'bm_shield' not in df_r.columns: df_r['bm_shield'] = False
-        
-        # --- V10.3 CLEANUP (Self-Healing) ---
-        bad_keys = []
-        # 1. Bets where User == BM
-        for idx, row in df_b.iterrows():
-            g_key = str(row['gw']).strip().upper()
-            bm_user = bm_map.get(g_key)
-            if bm_user and row['user'] == bm_user:
-                bad_keys.append(row['key'])
+        # IDs / gw_num / dt_jst are typed at ingest (normalize_table)
+        df_b = df_b[df_b['match_id'] != 999999]
         
-        # 2. Bets where Status=AUTO and GW < 21
-        m_id_to_gw = dict(zip(df_r['match_id'], df_r['gw_num']))
-        for idx, row in df_b.iterrows():
-            if str(row.get('status','')) == 'AUTO':
-                mid = str(row['match_id'])
-                gn = m_id_to_gw.get(mid, 999)
-                if gn < 21:
-                    bad_keys.append(row['key'])
-        
-        if bad_keys:
-            bad_keys = list(set(bad_keys)) 
-            for i in range(0, len(bad_keys), 50):
-                batch = bad_keys[i:i+50]
-                supabase.table("bets").delete().in_("key", batch).execute()
-            
-            b_res = supabase.table("bets").select("*").execute()
-            df_b = pd.DataFrame(b_res.data)
-            df_b['match_id'] = pd.to_numeric(df_b['match_id'], errors='coerce').fillna(0).astype(int).astype(str)
-            df_b = df_b[df_b['match_id'] != '999999']
+        # V10.3 cleanup (BM's own bets / AUTO before GW21) runs as run_maintenance(), not per settlement
 
         # --- AUTO BET LOGIC (Only GW21+ AND Exclude BM) ---
-        current_gw = 38
-        now = datetime.datetime.now(JST)
-        past_matches = df_r[df_r['dt_jst'] < now].sort_values('dt_jst', ascending=False)
-        if not past_matches.empty: current_gw = past_matches.iloc[0]['gw_num']
-        target_gws = range(current_gw - 10, current_gw + 2)
-        
-        df_r_scoped = df_r[df_r['gw_num'].isin(target_gws)].copy()
+        if full:
+            # Queued changes ride along even outside the window (a late override of an old GW)
+            target_gws = FixtureCalendar(df_r).gw_window(datetime.datetime.now(JST), back=10, ahead=1)
+            df_r_scoped = df_r[df_r['gw_num'].isin(target_gws) | df_r['match_id'].isin(pending)].copy()
+            scope_msg = f"GW {min(target_gws)} to {max(target_gws)}"
+            if pending: scope_msg += f" + {len(pending)} changed matches"
+        else:
+            # Changed matches are settled wherever they are (a late override of an old GW included)
+            df_r_scoped = df_r.copy()
+            scope_msg = f"{len(scope_ids)} changed matches"
         finished_matches = df_r_scoped[(df_r_scoped['status'] == 'FINISHED') & (df_r_scoped['gw_num'] >= 21)]
         
-        new_auto_bets = []
-        if not finished_matches.empty and u_res.data:
-            all_users = [u['username'] for u in u_res.data]
-            for _, m in finished_matches.iterrows():
-                mid = str(m['match_id'])
-                g_key = str(m['gw']).strip().upper()
-                match_bm = bm_map.get(g_key)
-                bets_in_match = df_b[df_b['match_id'] == mid]['user'].unique().tolist()
-                
-                for u in all_users:
-                    if u == match_bm: continue # Skip BM
-                    
-                    if u not in bets_in_match:
-                        o_row = df_o[df_o['match_id'] == int(mid)]
-                        def_odd = 1.0
-                        if not o_row.empty: def_odd = float(o_row.iloc[0]['home_win'])
-                        
-                        new_auto_bets.append({
-                            "key": f"{m['gw']}:{u}:{mid}", "gw": m['gw'], "user": u, 
-                            "match_id": int(mid), "match": f"{m['home']} vs {m['away']}", 
-                            "pick": "HOME", "stake": 100, "odds": def_odd, 
-                            "placed_at": datetime.datetime.now(JST).isoformat(), 
-                            "status": "AUTO", "result": "", "payout": 0, "net": 0, "chip_used": None
-                        })
-        
+        retry_ids = set()  # match_ids whose writes failed: queued again for the next call
+        new_auto_bets = build_auto_bets(finished_matches, df_u['username'].tolist() if not df_u.empty else [], df_b, bm_map, book, datetime.datetime.now(JST).isoformat())
         if new_auto_bets:
-            for i in range(0, len(new_auto_bets), 50):
-                supabase.table("bets").upsert(new_auto_bets[i:i+50]).execute()
-            b_res = supabase.table("bets").select("*").execute()
-            df_b = pd.DataFrame(b_res.data)
-            df_b['match_id'] = pd.to_numeric(df_b['match_id'], errors='coerce').fillna(0).astype(int).astype(str)
-            df_b = df_b[df_b['match_id'] != '999999']
+            failed_rows = []
+            report = flush_upserts("bets", new_auto_bets, "settle:auto_bets", failed_rows=failed_rows)
+            # Written rows are appended in memory; only a partial failure needs a re-read
+            if report["failed"]:
+                retry_ids.update(r["match_id"] for r in failed_rows)
+                df_b = load_bets()
+            else: df_b = pd.concat([df_b, normalize_table("bets", pd.DataFrame(new_auto_bets))], ignore_index=True)
+            df_b = df_b[df_b['match_id'] != 999999]
 
         # --- SETTLEMENT ---
         df_r_scoped = df_r_scoped.rename(columns={'status': 'match_status'})
         merged = pd.merge(df_b, df_r_scoped[['match_id', 'match_status', 'home_score', 'away_score', 'gw_num', 'bm_shield']], on='match_id', how='inner')
         
+        # 変更分は write plan に積んで最後にまとめて upsert (1 bet = 1 リクエストにしない)
+        changes = compute_settlement(merged, book)
+        # Bulk upsert needs uniform columns: identity columns are sent as-is so the insert half
+        # of the upsert satisfies NOT NULL; odds keeps its stored value unless it changed.
+        write_plan = [{
+            "key": k, "gw": gw, "user": u, "match_id": int(mid), "pick": p, "stake": int(stake),
+            "result": res, "payout": int(pay), "net": int(net),
+            "odds": float(new_o) if chg else (None if pd.isna(old_o) else float(old_o)),
+        } for k, gw, u, mid, p, stake, res, pay, net, new_o, chg, old_o in zip(
+            changes['key'], changes['gw'], changes['user'], changes['match_id'], changes['pick'], changes['stake'],
+            changes['result_new'], changes['payout_new'], changes['net_new'], changes['odds_new'], changes['odds_changed'], changes['odds'])]
+
         updates_count = 0
-        for _, row in merged.iterrows():
-            m_status = str(row.get('match_status', '')).strip().upper()
-            if m_status == 'FINISHED':
-                h_s = int(row['home_score'])
-                a_s = int(row['away_score'])
-                is_void = bool(row.get('bm_shield', False))
-                outcome = "DRAW"
-                if h_s > a_s: outcome = "HOME"
-                elif a_s > h_s: outcome = "AWAY"
-                
-                bet_pick = str(row['pick']).strip().upper()
-                final_res = 'WIN' if bet_pick == outcome else 'LOSE'
-                if is_void: final_res = 'VOID'
-                stake = float(row['stake']) if row['stake'] else 0
-                
-                if row['gw_num'] >= 21:
-                    mid_int = int(row['match_id'])
-                    o_row = df_o[df_o['match_id'] == mid_int]
-                    base_odds = 1.0
-                    if not o_row.empty:
-                        if bet_pick == 'HOME': base_odds = float(o_row.iloc[0]['home_win'])
-                        elif bet_pick == 'DRAW': base_odds = float(o_row.iloc[0]['draw'])
-                        elif bet_pick == 'AWAY': base_odds = float(o_row.iloc[0]['away_win'])
-                else:
-                    base_odds = float(row['odds']) if row['odds'] else 1.0
-
-                chip_used = str(row.get('chip_used', '')).strip()
-                if chip_used == 'BOOST': base_odds += 1.0
-                
-                if final_res == 'WIN':
-                    payout = int(stake * base_odds)
-                    net = int(payout - stake)
-                elif final_res == 'VOID':
-                    payout = int(stake)
-                    net = 0
-                else:
-                    payout = 0
-                    net = int(-stake)
-                
-                curr_res = str(row.get('result', '')).strip().upper()
-                curr_net = float(row.get('net', 0)) if pd.notna(row.get('net')) else 0
-                curr_stored_odds = float(row['odds']) if row['odds'] else 0
-                
-                odds_diff = abs(curr_stored_odds - base_odds) > 0.01
-                should_update_odds = (row['gw_num'] >= 21) and odds_diff
-                
-                if (curr_res != final_res) or (int(curr_net) != net) or should_update_odds:
-                    upd_payload = {"result": final_res, "payout": payout, "net": net}
-                    if should_update_odds: upd_payload["odds"] = base_odds
-                    supabase.table("bets").update(upd_payload).eq("key", row['key']).execute()
-                    updates_count += 1
-                    
-        return updates_count, f"GW {min(target_gws)} to {max(target_gws)}"
+        msg = scope_msg
+        if write_plan:
+            failed_rows = []
+            report = flush_upserts("bets", write_plan, "settle:updates", failed_rows=failed_rows)
+            updates_count = report["written"]
+            if not report["failed"]: get_ledger().apply_settlement(changes)
+            msg += f" / {report['written']}/{report['rows']} rows in {report['sec']}s"
+            if report["failed"]:
+                print(f"Settlement Write Error: {report['failed']}")
+                retry_ids.update(r["match_id"] for r in failed_rows)
+                msg += f" ({len(report['failed'])} batch failed)"
+
+        # Settlement updates do not move placed_at -> full reload next fetch
+        if write_plan or new_auto_bets: invalidate_tables("bets", full=bool(write_plan))
+        if retry_ids: queue.add(retry_ids)
+        # A rescan with failed batches does not count: the next call rescans again
+        elif full: queue.mark_full()
+        return updates_count, msg
     except Exception as e:
         print(f"Settlement Error: {e}")
+        queue.add(pending)  # retried on the next call
         return 0, str(e)
 
+# --- V11.12 MAINTENANCE (V10.3 Self-Healing) ---
+MAINTENANCE_INTERVAL_SEC = 6 * 3600  # worker (無ければ最初のセッション) がこの間隔で実行
+
+def find_invalid_bets(bets_df, results_df, bm_log_df):
+    """Keys of bets that must not exist: placed by that GW's bookmaker, or AUTO bets before GW21."""
+    bets = bets_df[bets_df['match_id'] != 999999]
+    if bets.empty: return []
+    bad = []
+    if not bm_log_df.empty:
+        # later bm_log rows win, like the dict the loop used to build
+        bm = pd.DataFrame({'gw': bm_log_df['gw'].astype(str).str.strip().str.upper(), 'bookmaker': bm_log_df['bookmaker'].astype(str)}).drop_duplicates('gw', keep='last')
+        j = pd.DataFrame({'key': bets['key'], 'gw': bets['gw'].astype(str), 'user': bets['user'].astype(str)}).merge(bm, on='gw')
+        bad += j.loc[(j['bookmaker'] != '') & (j['user'] == j['bookmaker']), 'key'].tolist()
+    auto = bets[bets['status'] == 'AUTO']
+    if not auto.empty:
+        gw_of = pd.Series(results_df['gw_num'].to_numpy(), index=results_df['match_id'].to_numpy())
+        gw_of = gw_of[~gw_of.index.duplicated()]
+        gn = gw_of.reindex(auto['match_id'].to_numpy()).fillna(999).to_numpy()  # unknown match -> kept
+        bad += auto.loc[gn < 21, 'key'].tolist()
+    return sorted(set(bad))
+
+class MaintenanceState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_run = 0.0
+        self.last_report = None
+
+@st.cache_resource
+def get_maintenance_state():
+    return MaintenanceState()
+
+def run_maintenance(gw=None):
+    """Delete invalid bets (find_invalid_bets) from the cached frames in bulk and patch the cache.
+
+    gw: limit to one gameweek, e.g. right after its bookmaker was assigned.
+    """
+    frames = load_frames(["bets", "result", "bm_log"])
+    bets = frames["bets"]
+    if gw is not None: bets = bets[bets['gw'] == str(gw).strip().upper()]
+    bad = find_invalid_bets(bets, frames["result"], frames["bm_log"])
+    report, deleted = flush_deletes("bets", "key", bad, "maintenance")
+    # Deletes do not move the watermark: drop the rows from the shared frame instead of reloading it
+    if deleted: get_table_cache().drop_rows("bets", deleted)
+    state = get_maintenance_state()
+    state.last_report = dict(report, gw=gw, at=datetime.datetime.now(JST).isoformat())
+    return report
+
+def run_maintenance_if_due():
+    state = get_maintenance_state()
+    if not state.lock.acquire(blocking=False): return None  # another session is already running it
+    try:
+        if time.time() - state.last_run < MAINTENANCE_INTERVAL_SEC: return None
+        report = run_maintenance()
+        state.last_run = time.time()
+        return report
+    finally: state.lock.release()
+
 # --- AI CALCULATION ---
-def calculate_ai_prediction(match_row, odds_df):
-    mid = match_row['match_id']
-    o_row = odds_df[odds_df['match_id'] == mid]
-    if not o_row.empty:
-        h = float(o_row.iloc[0]['home_win'])
-        d = float(o_row.iloc[0]['draw'])
-        a = float(o_row.iloc[0]['away_win'])
-        if h > 0 and d > 0 and a > 0:
-            ip_h = 1/h; ip_d = 1/d; ip_a = 1/a
-            total_ip = ip_h + ip_d + ip_a
-            p_h = (ip_h / total_ip) * 100
-            p_a = (ip_a / total_ip) * 100
-            p_d = (ip_d / total_ip) * 100
-            if p_h > p_a and p_h > p_d: return "HOME", int(p_h)
-            elif p_a > p_h and p_a > p_d: return "AWAY", int(p_a)
-            else: return "DRAW", int(p_d)
-    return None, 0
+def calculate_ai_predictions(match_ids, book):
+    """Favourite by normalized implied probability for a batch of matches (e.g. one GW).
+    Returns (picks, confidences) arrays aligned with match_ids; (None, 0) where odds are missing."""
+    return book.predictions(match_ids)
+
+def calculate_ai_prediction(match_row, book):
+    picks, conf = calculate_ai_predictions([match_row['match_id']], book)
+    return picks[0], int(conf[0])
 
 def calculate_stats_db_only(bets_df, results_df, bm_log_df, users_df):
+    """Per-user settled balance / wins / total and open potential, plus the bm_map.
+
+    A GW's bookmaker takes the opposite of every settled non-VOID bet of that GW (their own bets
+    there are ignored). Grouped sums over the bets; results_df is not needed for the figures.
+    """
     if users_df.empty: return {}, {}
-    stats = {u: {'balance': 0, 'wins': 0, 'total': 0, 'potential': 0} for u in users_df['username'].unique()}
-    bm_map = {}
-    if not bm_log_df.empty:
-        for _, r in bm_log_df.iterrows():
-            nums = "".join([c for c in str(r['gw']) if c.isdigit()])
-            if nums: bm_map[f"GW{nums}"] = r['bookmaker']
+    names = users_df['username'].unique()
+    stats = {u: {'balance': 0, 'wins': 0, 'total': 0, 'potential': 0} for u in names}
+    bm_map = build_bm_map(bm_log_df)
     if bets_df.empty: return stats, bm_map
-    
-    bets_clean = bets_df[bets_df['match_id'] != '999999'].copy()
-    results_safe = results_df.rename(columns={'status': 'match_status'})
-    merged = pd.merge(bets_clean, results_safe[['match_id', 'match_status', 'home_score', 'away_score', 'bm_shield']], on='match_id', how='left')
-    for _, b in merged.iterrows():
-        user = b['user']
-        if user not in stats: continue
-        
-        gw_key = f"GW{''.join([c for c in str(b['gw']) if c.isdigit()])}"
-        bm = bm_map.get(gw_key)
-        
-        # V10.2: Ignore BM own bets (Safety)
-        if bm and user == bm: continue
 
-        db_res = str(b.get('result', '')).strip().upper()
-        db_net = float(b['net']) if pd.notna(b['net']) and str(b['net']).strip() != '' else 0
-        stake = float(b['stake']) if b['stake'] else 0
-        
-        raw_odds = float(b['odds']) if b['odds'] else 1.0
-        if str(b.get('chip_used', '')) == 'BOOST': raw_odds += 1.0
-
-        if db_res in ['WIN', 'LOSE', 'VOID']:
-            stats[user]['total'] += 1
-            stats[user]['balance'] += int(db_net)
-            if db_res == 'WIN': stats[user]['wins'] += 1
-            if db_res != 'VOID' and bm and bm in stats: 
-                stats[bm]['balance'] -= int(db_net)
-        else:
-            stats[user]['potential'] += int((stake * raw_odds) - stake)
+    b = bets_df[bets_df['match_id'] != 999999]
+    # bm_log normalized to one row per GW<n>, joined on the same key derived from bets.gw
+    bm_log_norm = pd.DataFrame({'gw_key': list(bm_map), 'bm': [m if isinstance(m, str) else '' for m in bm_map.values()]})
+    df = pd.DataFrame({
+        'user': b['user'].astype(object).to_numpy(),
+        'gw_key': ("GW" + b['gw'].astype(str).str.replace(r'\D', '', regex=True)).to_numpy(dtype=object),
+        'result': b['result'].astype(object).to_numpy(),
+        'net': b['net'].to_numpy(dtype='int64'),
+        'stake': b['stake'].to_numpy(dtype='float64'),
+        'odds': b['odds'].to_numpy(dtype='float64'),
+        'boost': (b['chip_used'].astype(object) == 'BOOST').to_numpy(),
+    }).merge(bm_log_norm, on='gw_key', how='left')
+    df['bm'] = df['bm'].fillna('')
+    df = df[df['user'].isin(names) & ~((df['bm'] != '') & (df['user'] == df['bm']))]  # V10.2: ignore BM own bets
+
+    settled = df['result'].isin(['WIN', 'LOSE', 'VOID']).to_numpy()
+    odds = df['odds'].to_numpy()
+    odds = np.where(~np.isnan(odds) & (odds != 0), odds, 1.0) + np.where(df['boost'].to_numpy(), 1.0, 0.0)
+    stake = df['stake'].to_numpy()
+    per_user = pd.DataFrame({
+        'user': df['user'].to_numpy(),
+        'balance': np.where(settled, df['net'].to_numpy(), 0),
+        'wins': (df['result'] == 'WIN').to_numpy().astype('int64'),
+        'total': settled.astype('int64'),
+        'potential': np.where(settled, 0, np.trunc(stake * odds - stake)).astype('int64'),
+    }).groupby('user', sort=False).sum()
+    mirror = df[settled & (df['result'] != 'VOID').to_numpy() & df['bm'].isin(names).to_numpy()]
+    bm_balance = (-mirror['net']).groupby(mirror['bm'], sort=False).sum()
+
+    for u, bal, w, n, pot in zip(per_user.index, per_user['balance'], per_user['wins'], per_user['total'], per_user['potential']):
+        stats[u].update(balance=int(bal), wins=int(w), total=int(n), potential=int(pot))
+    for u, off in bm_balance.items(): stats[u]['balance'] += int(off)
     return stats, bm_map
 
-def calculate_profitable_clubs_fixed(bets_df, results_df):
-    if bets_df.empty or results_df.empty: return {}
-    bets_clean = bets_df[bets_df['match_id'] != '999999'].copy()
-    results_safe = results_df.rename(columns={'status': 'match_status'})
-    merged = pd.merge(bets_clean, results_safe, on='match_id', how='inner')
-    user_club_pnl = {}
-    for _, row in merged.iterrows():
-        if str(row.get('result', '')).strip().upper() == 'WIN':
-            user = row['user']
-            pick = row['pick']
-            team = row['home'] if pick == 'HOME' else (row['away'] if pick == 'AWAY' else None)
-            net = float(row['net']) if pd.notna(row['net']) else 0
-            if team:
-                if user not in user_club_pnl: user_club_pnl[user] = {}
-                user_club_pnl[user][team] = user_club_pnl[user].get(team, 0) + int(net)
+def club_pnl(bets_df, results_df):
+    """Net of WIN bets per (user, club picked), in order of first appearance."""
+    b = bets_df[(bets_df['match_id'] != 999999) & (bets_df['result'] == 'WIN')]
+    m = b[['user', 'match_id', 'pick', 'net']].merge(results_df[['match_id', 'home', 'away']], on='match_id', how='inner')
+    pick = m['pick'].astype(object).to_numpy()
+    team = np.where(pick == 'HOME', m['home'].astype(object).to_numpy(), np.where(pick == 'AWAY', m['away'].astype(object).to_numpy(), None))
+    df = pd.DataFrame({'user': m['user'].astype(object).to_numpy(), 'team': team, 'net': m['net'].to_numpy(dtype='int64')})
+    df = df[df['team'].notna() & (df['team'] != '')]
+    return df.groupby(['user', 'team'], sort=False)['net'].sum().reset_index()
+
+def calculate_profitable_clubs_fixed(bets_df, results_df, frozen_clubs=None):
+    """Top 3 clubs by WIN net per user. frozen_clubs: club_pnl rows of snapshotted GWs (GwSnapshots.clubs)."""
+    has_frozen = frozen_clubs is not None and not frozen_clubs.empty
+    if (bets_df.empty or results_df.empty) and not has_frozen: return {}
+    pnl = club_pnl(bets_df, results_df) if not (bets_df.empty or results_df.empty) else frozen_clubs.iloc[:0][['user', 'team', 'net']]
+    if has_frozen:
+        pnl = pd.concat([frozen_clubs[['user', 'team', 'net']], pnl], ignore_index=True).groupby(['user', 'team'], sort=False)['net'].sum().reset_index()
     final_ranking = {}
-    for u, clubs in user_club_pnl.items():
-        sorted_clubs = sorted(clubs.items(), key=lambda x: x[1], reverse=True)[:3]
-        final_ranking[u] = sorted_clubs
+    for u, grp in pnl.groupby('user', sort=False):
+        final_ranking[u] = sorted(zip(grp['team'].tolist(), grp['net'].astype(int).tolist()), key=lambda x: x[1], reverse=True)[:3]
     return final_ranking
 
-def calculate_live_leaderboard_data(bets_df, results_df, bm_map, users_df, target_gw):
-    base_stats, _ = calculate_stats_db_only(bets_df, results_df, pd.DataFrame(list(bm_map.items()), columns=['gw','bookmaker']), users_df)
-    gw_total_pnl = {u: 0 for u in users_df['username'].unique()} 
-    dream_profit = {u: 0 for u in users_df['username'].unique()}
-    inplay_sim_only = {u: 0 for u in users_df['username'].unique()}
-    
-    bets_clean = bets_df[bets_df['match_id'] != '999999'].copy()
-    gw_bets = bets_clean[bets_clean['gw'] == target_gw].copy() if not bets_clean.empty else pd.DataFrame()
-    
-    if not gw_bets.empty:
-        results_safe = results_df.rename(columns={'status': 'match_status'})
-        gw_bets = pd.merge(gw_bets, results_safe[['match_id', 'match_status', 'home_score', 'away_score', 'bm_shield']], on='match_id', how='left')
-        current_bm = bm_map.get(target_gw)
-        for _, b in gw_bets.iterrows():
-            user = b['user']
-            if user not in base_stats: continue
-            
-            if current_bm and user == current_bm: continue
+# HISTORY に並べる列 (bets と BM の HOUSE 行を同じ形にそろえる)
+HISTORY_COLS = ['key', 'user', 'match_id', 'match', 'gw', 'pick', 'stake', 'odds', 'result', 'net', 'placed_at', 'chip_used', 'status', 'home', 'away', 'match_status']
 
-            db_res = str(b.get('result', '')).strip().upper()
-            db_net = float(b['net']) if pd.notna(b['net']) and str(b['net']).strip() != '' else 0
-            stake = float(b['stake'])
-            
-            c_odds = float(b['odds'])
-            if str(b.get('chip_used', '')) == 'BOOST': c_odds += 1.0
+def history_rows(bets_df, results_df, bm_log_df):
+    """HISTORY cards as one frame: the bets (LIMIT rows excluded) plus a HOUSE row per match of each
+    bm_log GW (finished, or with stakes on it) carrying the bookmaker's P&L, joined to home / away / status.
+    Pass bm_log rows only for the GWs whose bets are passed."""
+    hist = bets_df[bets_df['match_id'] != 999999]
+    parts = [pd.DataFrame({c: hist[c].astype(object) if isinstance(hist[c].dtype, pd.CategoricalDtype) else hist[c] for c in HISTORY_COLS[:13]})]
+    if not bm_log_df.empty and not results_df.empty:
+        sums = hist.groupby('match_id')[['net', 'stake']].sum()
+        house = pd.DataFrame({'gw': bm_log_df['gw'].astype(str), 'user': bm_log_df['bookmaker']}).merge(
+            pd.DataFrame({'gw': results_df['gw'].astype(str), 'match_id': results_df['match_id'].astype('int64'),
+                          'm_status': results_df['status'].astype(object), 'placed_at': results_df['utc_kickoff']}), on='gw')
+        handle = sums['stake'].reindex(house['match_id']).fillna(0).astype('int64').to_numpy()
+        bm_pnl = -sums['net'].reindex(house['match_id']).fillna(0).astype('int64').to_numpy()
+        keep = ((house['m_status'] == 'FINISHED').to_numpy() | (handle > 0))
+        house = house[keep]
+        parts.append(pd.DataFrame({
+            'key': "BM_" + house['match_id'].astype(str), 'user': house['user'], 'match_id': house['match_id'], 'match': None,
+            'gw': house['gw'], 'pick': 'HOUSE', 'stake': handle[keep], 'odds': np.nan,
+            'result': np.where(bm_pnl[keep] >= 0, 'WIN', 'LOSE'), 'net': bm_pnl[keep], 'placed_at': house['placed_at'],
+            'chip_used': '', 'status': 'FINISHED',
+        }))
+    hist = pd.concat([p for p in parts if not p.empty], ignore_index=True) if any(not p.empty for p in parts) else parts[0]
+    names = pd.DataFrame({'match_id': results_df['match_id'].astype('int64'), 'home': results_df['home'].astype(object),
+                          'away': results_df['away'].astype(object), 'match_status': results_df['status'].astype(object)})
+    return hist.astype({'match_id': 'int64'}).merge(names, on='match_id', how='left')[HISTORY_COLS]
 
-            pot_win = (stake * c_odds) - stake
-            dream_profit[user] += int(pot_win)
-            pnl = 0
-            is_inplay = False
-            is_shielded = bool(b.get('bm_shield', False))
+# --- V11.14 LIVE LEADERBOARD ---
+# GW の bets から決まる部分 (確定 net / dream) は bets のバージョンごとに1回だけ作り、refresh では試合中の行だけ再計算する
+LIVE_IDLE_STATUSES = ['SCHEDULED', 'TIMED', 'POSTPONED', 'FINISHED']
 
-            if db_res in ['WIN', 'LOSE', 'VOID']: pnl = db_net
-            elif is_shielded: pnl = 0
-            else:
-                status = str(b.get('match_status', 'SCHEDULED')).strip().upper()
-                if status not in ['SCHEDULED', 'TIMED', 'POSTPONED', 'FINISHED']:
-                    h_sc = int(b['home_score']) if pd.notna(b['home_score']) else 0
-                    a_sc = int(b['away_score']) if pd.notna(b['away_score']) else 0
-                    curr_outcome = "DRAW"
-                    if h_sc > a_sc: curr_outcome = "HOME"
-                    elif a_sc > h_sc: curr_outcome = "AWAY"
-                    if b['pick'] == curr_outcome: pnl = pot_win
-                    else: pnl = -stake
-                    is_inplay = True
-            
-            gw_total_pnl[user] += int(pnl)
-            if not is_shielded and current_bm and current_bm in gw_total_pnl:
-                gw_total_pnl[current_bm] -= int(pnl)
-            
-            if is_inplay and not is_shielded:
-                inplay_sim_only[user] += int(pnl)
-                if current_bm and current_bm in inplay_sim_only:
-                    inplay_sim_only[current_bm] -= int(pnl)
+def live_gw_bets(bets_df, target_gw):
+    """The GW's bets reduced to the LIVE board inputs: settled flag / net, pot_win and dream (int(pot_win))."""
+    b = bets_df[(bets_df['gw'] == target_gw) & (bets_df['match_id'] != 999999)]
+    stake = b['stake'].to_numpy(dtype='float64')
+    odds = b['odds'].to_numpy(dtype='float64') + np.where(b['chip_used'].astype(object).to_numpy() == 'BOOST', 1.0, 0.0)
+    pot_win = stake * odds - stake
+    return pd.DataFrame({
+        'user': b['user'].astype(object).to_numpy(), 'match_id': b['match_id'].to_numpy(dtype='int64'),
+        'pick': b['pick'].astype(object).to_numpy(), 'stake': stake, 'pot_win': pot_win,
+        'dream': np.nan_to_num(np.trunc(pot_win)).astype('int64'),  # missing odds -> 0 instead of an error
+        'settled': b['result'].isin(['WIN', 'LOSE', 'VOID']).to_numpy(), 'net': b['net'].to_numpy(dtype='int64'),
+    })
+
+def get_live_gw_bets(target_gw):
+    """live_gw_bets of the cached bets table, rebuilt only when a new bets version is loaded."""
+    return get_table_cache().derived("bets", f"live:{target_gw}", lambda df: live_gw_bets(df, target_gw))
+
+def calculate_live_leaderboard_data(bets_df, results_df, bm_map, users_df, target_gw, base_stats=None, gw_bets=None):
+    """Total (settled balance + in-play simulation), Diff (GW P&L) and Dream per user, sorted by Total.
+
+    base_stats: the settled stats (ledger_stats) when the caller has them; recomputed otherwise.
+    gw_bets: live_gw_bets of the GW (get_live_gw_bets); only the match states are read per call.
+    """
+    if base_stats is None: base_stats, _ = calculate_stats_db_only(bets_df, results_df, pd.DataFrame(list(bm_map.items()), columns=['gw','bookmaker']), users_df)
+    if gw_bets is None: gw_bets = live_gw_bets(bets_df, target_gw)
+    names = users_df['username'].unique()
+    current_bm = bm_map.get(target_gw)
+    g = gw_bets[gw_bets['user'].isin(list(base_stats))]
+    if current_bm: g = g[g['user'] != current_bm]
+
+    # Current match state by match_id (a bet without a result row counts as shielded, as the row loop did)
+    res = results_df.drop_duplicates('match_id')
+    pos = pd.Index(res['match_id'].to_numpy(dtype='int64')).get_indexer(g['match_id'].to_numpy())
+    found = pos >= 0
+    shielded = np.where(found, res['bm_shield'].to_numpy(dtype=bool)[pos], True)
+    status = np.where(found, res['status'].astype(object).to_numpy()[pos], None)
+    h = np.where(found, res['home_score'].fillna(0).to_numpy(dtype='int64')[pos], 0)
+    a = np.where(found, res['away_score'].fillna(0).to_numpy(dtype='int64')[pos], 0)
+
+    settled = g['settled'].to_numpy()
+    inplay = ~settled & ~shielded & ~pd.Series(status, dtype=object).isin(LIVE_IDLE_STATUSES).to_numpy()
+    outcome = np.where(h > a, 'HOME', np.where(a > h, 'AWAY', 'DRAW'))
+    sim = np.where(g['pick'].to_numpy() == outcome, g['pot_win'].to_numpy(), -g['stake'].to_numpy())
+    pnl = np.select([settled, inplay], [g['net'].to_numpy(), np.nan_to_num(np.trunc(sim))], 0).astype('int64')
+
+    user = g['user'].to_numpy()
+    gw_total = pd.Series(pnl, dtype='int64').groupby(user).sum()
+    inplay_sim = pd.Series(pnl[inplay], dtype='int64').groupby(user[inplay]).sum()
+    dream = g['dream'].groupby(user).sum()
+    gw_total_pnl = {u: int(gw_total.get(u, 0)) for u in names}
+    inplay_sim_only = {u: int(inplay_sim.get(u, 0)) for u in names}
+    if current_bm and current_bm in gw_total_pnl:
+        gw_total_pnl[current_bm] -= int(pnl[~shielded].sum())
+        inplay_sim_only[current_bm] -= int(pnl[inplay].sum())
     live_data = []
     for u, s in base_stats.items():
         total_val = s['balance'] + inplay_sim_only.get(u, 0)
         diff_val = gw_total_pnl.get(u, 0)
-        live_data.append({'User': u, 'Total': total_val, 'Diff': diff_val, 'Dream': dream_profit.get(u, 0)})
+        live_data.append({'User': u, 'Total': total_val, 'Diff': diff_val, 'Dream': int(dream.get(u, 0))})
     return pd.DataFrame(live_data).sort_values('Total', ascending=False)
 
-def get_strict_target_gw(results_df, target_season):
+# --- V11.13 BALANCE LEDGER ---
+# bets 1行ごとの寄与を key で保持し、結果が変わった行の差分だけを (user, gw) 集計に足し引きする
+LEDGER_COLS = ['balance', 'wins', 'total', 'potential', 'bm_offset']
+
+def build_bm_map(bm_log_df):
+    """{'GW<n>': bookmaker} keyed by the digits of bm_log.gw (later rows win)."""
+    bm_map = {}
+    if bm_log_df.empty: return bm_map
+    for gw, bm in zip(bm_log_df['gw'], bm_log_df['bookmaker']):
+        nums = "".join([c for c in str(gw) if c.isdigit()])
+        if nums: bm_map[f"GW{nums}"] = bm
+    return bm_map
+
+def ledger_rows(bets_df, bm_map, usernames):
+    """Each bet's contribution under the calculate_stats_db_only rules, indexed by bet key.
+
+    res: -1 not counted (unknown user / that GW's bookmaker), 0 open, 1 WIN, 2 LOSE, 3 VOID.
+    net: settled net; pot: int(stake * odds - stake) while open (odds 1.0 when missing/0, BOOST +1.0);
+    bm_net: -net charged to the GW's bookmaker for a settled non-VOID bet (known bookmakers only).
+    """
+    b = bets_df[bets_df['match_id'] != 999999].drop_duplicates('key', keep='last')
+    known = set(usernames)
+    user = b['user'].astype(object).astype(str).to_numpy()
+    gw = ("GW" + b['gw'].astype(str).str.replace(r'\D', '', regex=True)).to_numpy(dtype=object)
+    bm = pd.Series(gw).map(bm_map).fillna('').astype(str).to_numpy(dtype=object)
+    counted = np.isin(user, list(known)) & ~((bm != '') & (user == bm))
+    result = b['result'].astype(object).to_numpy()
+    res = np.select([result == 'WIN', result == 'LOSE', result == 'VOID'], [1, 2, 3], 0)
+    res = np.where(counted, res, -1).astype('int8')
+    settled = res > 0
+
+    net = b['net'].to_numpy(dtype='int64')
+    stake = b['stake'].to_numpy(dtype='float64')
+    odds = b['odds'].to_numpy(dtype='float64')
+    odds = np.where(~np.isnan(odds) & (odds != 0), odds, 1.0)
+    odds = np.where(b['chip_used'].astype(object).to_numpy() == 'BOOST', odds + 1.0, odds)
+    bm_ok = counted & (bm != '') & np.isin(bm, list(known))
+    return pd.DataFrame({
+        'user': user, 'gw': gw, 'bm': bm, 'res': res,
+        'net': np.where(settled, net, 0),
+        'pot': np.where(res == 0, np.trunc(stake * odds - stake), 0).astype('int64'),
+        'bm_net': np.where(settled & (res != 3) & bm_ok, -net, 0),
+        'bm_ok': bm_ok,
+    }, index=pd.Index(b['key'].astype(str).to_numpy(), name='key'))
+
+def ledger_aggregate(rows):
+    """(user, gw) -> balance (own settled net) / wins / total / potential / bm_offset."""
+    own = rows[rows['res'] >= 0]
+    own = pd.DataFrame({
+        'user': own['user'], 'gw': own['gw'], 'balance': own['net'], 'wins': (own['res'] == 1).astype('int64'),
+        'total': (own['res'] > 0).astype('int64'), 'potential': own['pot'],
+    }).groupby(['user', 'gw']).sum()
+    bm = rows[rows['bm_net'] != 0]
+    off = pd.DataFrame({'user': bm['bm'], 'gw': bm['gw'], 'bm_offset': bm['bm_net']}).groupby(['user', 'gw']).sum()
+    agg = own.join(off, how='outer').reindex(columns=LEDGER_COLS).fillna(0).astype('int64')
+    agg.index = agg.index.set_names(['user', 'gw'])
+    return agg
+
+class BalanceLedger:
+    """Per-user / per-GW balance aggregates, shared per process and kept in step with the bets table.
+
+    sync() diffs the per-bet contributions of a new bets / bm_log version against the ones it holds
+    and applies only the changed rows; apply_settlement() patches the rows settlement just wrote.
+    Reads (user_stats) are O(users). A change of the user list rebuilds from scratch.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tag = None  # (bets version, bm_log version) the rows reflect
+        self._users = None
+        self._rows = None
+        self._by_gw = None
+        self._by_user = None
+        self.last_sync = None
+
+    def sync(self, tag, bets_df, bm_map, usernames, exclude_gws=()):
+        """exclude_gws: frozen GWs (GwSnapshots.gws), whose totals are added from the snapshot instead."""
+        usernames = tuple(usernames)
+        with self._lock:
+            if tag is not None and tag == self._tag and usernames == self._users: return
+            t0 = time.perf_counter()
+            if exclude_gws: bets_df = bets_df[~bets_df['gw'].isin(list(exclude_gws))]
+            rows = ledger_rows(bets_df, bm_map, usernames)
+            if self._rows is None or usernames != self._users:
+                self._rows, self._users = rows, usernames
+                self._by_gw = ledger_aggregate(rows)
+                self._by_user = self._by_gw.groupby(level='user').sum()
+                mode, n = "rebuild", len(rows)
+            else:
+                old = self._rows
+                common = rows.index.intersection(old.index)
+                diff = (rows.loc[common] != old.loc[common]).any(axis=1)
+                gone, new = old.index.difference(rows.index), rows.index.difference(old.index)
+                minus = old.loc[common[diff.to_numpy()].append(gone)]
+                plus = rows.loc[common[diff.to_numpy()].append(new)]
+                self._rows = rows
+                self._apply(minus, plus)
+                mode, n = "delta", len(plus) + len(gone)
+            self._tag = tag
+            self.last_sync = {"mode": mode, "rows": n, "sec": round(time.perf_counter() - t0, 4), "tag": tag}
+
+    def apply_settlement(self, changes):
+        """Fold settled rows (compute_settlement output, already written) into the ledger."""
+        with self._lock:
+            if self._rows is None or changes.empty: return
+            keys = pd.Index(changes['key'].astype(str).to_numpy())
+            hit = keys.isin(self._rows.index)  # new AUTO bets arrive with the next bets version
+            if not hit.any(): return
+            ch = changes[hit]
+            minus = self._rows.loc[keys[hit]]
+            result = ch['result_new'].astype(object).to_numpy()
+            res = np.select([result == 'WIN', result == 'LOSE', result == 'VOID'], [1, 2, 3], 0)
+            res = np.where(minus['res'].to_numpy() >= 0, res, -1).astype('int8')
+            net = ch['net_new'].to_numpy(dtype='int64')
+            plus = minus.assign(
+                res=res, net=np.where(res > 0, net, 0), pot=np.where(res == 0, minus['pot'].to_numpy(), 0),
+                bm_net=np.where((res > 0) & (res != 3) & minus['bm_ok'].to_numpy(), -net, 0))
+            self._rows.loc[plus.index, plus.columns] = plus
+            self._apply(minus, plus)
+
+    def user_stats(self, usernames):
+        """{user: {'balance', 'wins', 'total', 'potential'}}, the shape calculate_stats_db_only returns."""
+        with self._lock:
+            t = self._by_user.reindex(list(usernames), fill_value=0)
+        return {u: {'balance': int(b + o), 'wins': int(w), 'total': int(n), 'potential': int(p)}
+                for u, b, w, n, p, o in zip(t.index, t['balance'], t['wins'], t['total'], t['potential'], t['bm_offset'])}
+
+    def table(self):
+        """Copy of the (user, gw) aggregates without all-zero rows."""
+        with self._lock:
+            t = self._by_gw.copy()
+        return t[(t != 0).any(axis=1)]
+
+    def stats(self):
+        with self._lock:
+            return {"bets": 0 if self._rows is None else len(self._rows), "cells": 0 if self._by_gw is None else len(self._by_gw), "last_sync": self.last_sync}
+
+    def _apply(self, minus, plus):
+        if minus.empty and plus.empty: return
+        delta = ledger_aggregate(plus).sub(ledger_aggregate(minus), fill_value=0)
+        self._by_gw = self._by_gw.add(delta, fill_value=0).astype('int64')
+        self._by_user = self._by_user.add(delta.groupby(level='user').sum(), fill_value=0).astype('int64')
+
+@st.cache_resource
+def get_ledger():
+    return BalanceLedger()
+
+def ledger_stats(users_df, snap=None):
+    """(stats, bm_map) as calculate_stats_db_only returns them, read from the ledger of the cached tables.
+    snap: GwSnapshots; its GWs are left out of the ledger and their frozen totals added."""
+    if users_df.empty: return {}, {}
+    cache = get_table_cache()
+    bets_v, bets = cache.get("bets")
+    bm_v, bm_log = cache.get("bm_log")
+    bm_map = build_bm_map(bm_log)
+    usernames = users_df['username'].unique().tolist()
+    ledger = get_ledger()
+    ledger.sync((bets_v, bm_v, snap.tag if snap else None), bets, bm_map, usernames, exclude_gws=snap.gws if snap else ())
+    stats = ledger.user_stats(usernames)
+    return (snap.add_to(stats) if snap else stats), bm_map
+
+def verify_ledger(snap=None):
+    """Rebuild the ledger from scratch and diff it against the incremental one, then check the
+    per-user figures against calculate_stats_db_only. Returns a report (ok / mismatches)."""
+    t0 = time.perf_counter()
+    cache = get_table_cache()
+    users = cache.get("users")[1]
+    stats, bm_map = ledger_stats(users, snap)
+    bets, bm_log, results = cache.get("bets")[1], cache.get("bm_log")[1], cache.get("result")[1]
+    fresh = BalanceLedger()
+    fresh.sync(None, bets, bm_map, users['username'].unique().tolist() if not users.empty else [], exclude_gws=snap.gws if snap else ())
+    cells = []
+    if fresh._rows is not None:
+        d = get_ledger().table().sub(fresh.table(), fill_value=0)
+        cells = [{"user": u, "gw": g, **{c: int(v) for c, v in r.items() if v}} for (u, g), r in d[(d != 0).any(axis=1)].iterrows()]
+    ref, _ = calculate_stats_db_only(bets, results, bm_log, users)
+    users_bad = [{"user": u, "ledger": stats.get(u), "reference": s} for u, s in ref.items() if stats.get(u) != s]
+    return {
+        "ok": not cells and not users_bad, "users": len(ref), "cell_mismatches": cells[:20], "user_mismatches": users_bad[:20],
+        "sec": round(time.perf_counter() - t0, 4), "at": datetime.datetime.now(JST).isoformat(),
+    }
+
+# --- V11.15 GW SNAPSHOTS ---
+# 全試合 FINISHED かつ SHIELD 期限 (次 GW の最初のキックオフ) を過ぎた GW は結果が動かないので、集計済みの形でローカルに凍結する
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "gw_snapshots.sqlite")  # ただのキャッシュ: 消しても次回作り直す
+SNAPSHOT_FINAL_GRACE_DAYS = 7  # 次の GW が無い (最終節) 場合は最後の試合からこの日数で確定扱い
+
+def completed_gws(calendar, now=None):
+    """GW labels of the calendar's season whose matches are all FINISHED and whose shield deadline has passed."""
+    g = calendar.gws[calendar.gws.index > 0]
+    if g.empty: return []
+    now = now or datetime.datetime.now(JST)
+    deadline = g['first'].reindex(g.index + 1).set_axis(g.index)
+    deadline = deadline.fillna(g['last'] + pd.Timedelta(days=SNAPSHOT_FINAL_GRACE_DAYS))
+    return [str(gw) for gw in g.loc[g['done'] & (deadline < now), 'gw']]
+
+def gw_fingerprints(bets_df):
+    """rows / settled / net / stake per bets.gw; a frozen GW whose numbers moved is refrozen."""
+    df = pd.DataFrame({'gw': bets_df['gw'].astype(str), 'settled': bets_df['result'].isin(['WIN', 'LOSE', 'VOID']).astype('int64'),
+                       'net': bets_df['net'].astype('int64'), 'stake': bets_df['stake'].astype('int64')})
+    return df.groupby('gw').agg(bets=('net', 'size'), settled=('settled', 'sum'), net=('net', 'sum'), stake=('stake', 'sum'))
+
+class GwSnapshots:
+    """Read-only view of one season's frozen GWs: their ledger cells, HISTORY rows and club P&L."""
+    def __init__(self, tag, meta, cells, history, clubs):
+        self.tag = tag
+        self.meta = meta
+        self.gws = frozenset(meta['snap_gw'])
+        self.totals = cells.groupby('user')[LEDGER_COLS].sum()
+        self.history = history[HISTORY_COLS]
+        self.clubs = clubs
+
+    def add_to(self, stats):
+        """Add the frozen totals to a {user: stats} dict from the ledger (in place, O(users))."""
+        for u, s in stats.items():
+            if u not in self.totals.index: continue
+            t = self.totals.loc[u]
+            s['balance'] += int(t['balance'] + t['bm_offset'])
+            s['wins'] += int(t['wins']); s['total'] += int(t['total']); s['potential'] += int(t['potential'])
+        return stats
+
+class SnapshotStore:
+    """Frozen GWs in a local SQLite file, loaded once per process; writes go to memory and disk together.
+
+    Another process writing the same file is noticed by its mtime and triggers a reload.
+    """
+    SCHEMA = {
+        "meta": {"season": "INTEGER", "snap_gw": "TEXT", "bookmaker": "TEXT", "users": "TEXT", "bets": "INTEGER",
+                 "settled": "INTEGER", "net": "INTEGER", "stake": "INTEGER", "frozen_at": "TEXT"},
+        "cells": {"season": "INTEGER", "snap_gw": "TEXT", "user": "TEXT", "gw": "TEXT", **{c: "INTEGER" for c in LEDGER_COLS}},
+        "history": {"season": "INTEGER", "snap_gw": "TEXT", **{c: ("INTEGER" if c in ('match_id', 'stake', 'net') else "REAL" if c == 'odds' else "TEXT") for c in HISTORY_COLS}},
+        "clubs": {"season": "INTEGER", "snap_gw": "TEXT", "user": "TEXT", "team": "TEXT", "net": "INTEGER"},
+    }
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self._lock = threading.Lock()
+        self.path = path
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._con = sqlite3.connect(path, check_same_thread=False)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Snapshot Store Error ({path}): {e} -> in-memory only")
+            self.path = None
+            self._con = sqlite3.connect(":memory:", check_same_thread=False)
+        for t, cols in self.SCHEMA.items():
+            self._con.execute(f'CREATE TABLE IF NOT EXISTS {t} ({", ".join(f"{json.dumps(c)} {ty}" for c, ty in cols.items())})')
+        self._con.commit()
+        self._gen = 0
+        self._views = {}
+        self._load()
+
+    def view(self, season):
+        with self._lock:
+            if self.path and self._mtime != os.path.getmtime(self.path): self._load()
+            hit = self._views.get(season)
+            if hit and hit.tag == self._gen: return hit
+            sel = {t: df[df['season'] == season] for t, df in self._frames.items()}
+            v = GwSnapshots(self._gen, sel["meta"], sel["cells"], sel["history"], sel["clubs"])
+            self._views[season] = v
+            return v
+
+    def freeze(self, season, parts):
+        """parts: [(meta dict, cells df, history df, clubs df)] for GWs of one season, written in one transaction."""
+        if not parts: return
+        with self._lock:
+            new = {"meta": [pd.DataFrame([m for m, _, _, _ in parts])], "cells": [], "history": [], "clubs": []}
+            for m, cells, history, clubs in parts:
+                for t, df in (("cells", cells), ("history", history), ("clubs", clubs)):
+                    new[t].append(df.assign(season=season, snap_gw=m['snap_gw']))
+            with self._con:
+                for t, dfs in new.items():
+                    df = pd.concat(dfs, ignore_index=True).assign(season=season)[list(self.SCHEMA[t])]
+                    df.to_sql(t, self._con, if_exists="append", index=False)
+                    self._frames[t] = pd.concat([self._frames[t], df], ignore_index=True) if not self._frames[t].empty else df
+            self._touch()
+
+    def thaw(self, season=None, gws=None):
+        """Drop frozen GWs (all of them when season/gws are None); they are refrozen on the next refresh."""
+        with self._lock:
+            with self._con:
+                for t in self.SCHEMA:
+                    df = self._frames[t]
+                    hit = pd.Series(True, index=df.index)
+                    if season is not None: hit &= df['season'] == season
+                    if gws is not None: hit &= df['snap_gw'].isin(list(gws))
+                    where, args = [], []
+                    if season is not None: where.append("season = ?"); args.append(int(season))
+                    if gws is not None: where.append(f"snap_gw IN ({','.join('?' * len(gws))})"); args += list(gws)
+                    self._con.execute(f"DELETE FROM {t}" + (" WHERE " + " AND ".join(where) if where else ""), args)
+                    self._frames[t] = df[~hit].reset_index(drop=True)
+            self._touch()
+
+    def stats(self):
+        with self._lock:
+            m = self._frames["meta"]
+            return {"path": self.path, "gws": {str(s): sorted(g, key=extract_gw_num) for s, g in m.groupby('season')['snap_gw']},
+                    "rows": {t: len(df) for t, df in self._frames.items()}}
+
+    def _load(self):
+        self._frames = {t: pd.read_sql_query(f"SELECT * FROM {t}", self._con) for t in self.SCHEMA}
+        self._touch()
+
+    def _touch(self):
+        self._gen += 1
+        self._views = {}
+        self._mtime = os.path.getmtime(self.path) if self.path else None
+
+@st.cache_resource
+def get_snapshot_store():
+    return SnapshotStore()
+
+def build_gw_snapshot(gw, bets_df, results_df, bm_log_df, bm_map, usernames):
+    """(cells, history, clubs) of one GW, from the same functions the live path uses."""
+    b = bets_df[bets_df['gw'] == gw]
+    cells = ledger_aggregate(ledger_rows(b, bm_map, usernames)).reset_index()
+    history = history_rows(b, results_df, bm_log_df[bm_log_df['gw'].astype(str) == gw] if not bm_log_df.empty else bm_log_df)
+    return cells, history, club_pnl(b, results_df)
+
+def refresh_snapshots(target_season, bets_df, results_df, bm_log_df, users_df, calendar=None):
+    """Freeze newly completed GWs and refreeze frozen ones whose bets / bookmaker / user list moved.
+    Returns the season's GwSnapshots. calendar: the season's FixtureCalendar, built from results_df when omitted."""
+    store = get_snapshot_store()
+    season = int(target_season)
+    usernames = users_df['username'].unique().tolist() if not users_df.empty else []
+    digest = hashlib.sha1("\n".join(sorted(map(str, usernames))).encode()).hexdigest()[:12]
+    bm_map = build_bm_map(bm_log_df)
+    fp = get_table_cache().derived("bets", "gw_fingerprints", gw_fingerprints)
+    done = completed_gws(calendar or FixtureCalendar(results_df, season))
+    view = store.view(season)
+
+    stale = []
+    for m in view.meta.to_dict('records'):
+        gw = m['snap_gw']
+        cur = fp.loc[gw].tolist() if gw in fp.index else [0, 0, 0, 0]
+        bm = bm_map.get(f"GW{extract_gw_num(gw)}")
+        if (gw not in done or m['users'] != digest or m['bookmaker'] != (bm if isinstance(bm, str) else '')
+                or [m['bets'], m['settled'], m['net'], m['stake']] != [int(x) for x in cur]):
+            stale.append(gw)
+    if stale: store.thaw(season, stale)
+
+    frozen = view.gws - set(stale)
+    parts = []
+    for gw in done:
+        if gw in frozen: continue
+        cur = fp.loc[gw].tolist() if gw in fp.index else [0, 0, 0, 0]
+        bm = bm_map.get(f"GW{extract_gw_num(gw)}")
+        meta = {"snap_gw": gw, "bookmaker": bm if isinstance(bm, str) else '', "users": digest,
+                "bets": int(cur[0]), "settled": int(cur[1]), "net": int(cur[2]), "stake": int(cur[3]),
+                "frozen_at": datetime.datetime.now(JST).isoformat()}
+        parts.append((meta, *build_gw_snapshot(gw, bets_df, results_df, bm_log_df, bm_map, usernames)))
+    store.freeze(season, parts)
+    return store.view(season)
+
+# --- V11.17 FIXTURE CALENDAR ---
+TARGET_GW_GRACE_HOURS = 3  # キックオフ後この時間までは、その試合の GW を「今の GW」として扱う
+
+class FixtureCalendar:
+    """Kickoff-sorted view of the result table for GW resolution, built once per results version.
+
+    season: only fixtures from {season}-07-01 on (None = every fixture with a kickoff).
+    Time lookups are a searchsorted on the kickoff array; per-GW lookups read the `gws` table
+    (per gw_num: gw label, first / last kickoff, matches, done = all FINISHED, then one count column per status).
+    """
+    def __init__(self, results_df, season=None):
+        df = results_df
+        if 'dt_jst' not in df.columns: df = df.assign(dt_jst=kickoff_jst(df['utc_kickoff']))
+        if season is not None: df = df[df['dt_jst'] >= pd.Timestamp(f"{season}-07-01", tz=JST)]
+        else: df = df[df['dt_jst'].notna()]
+        df = df.sort_values('dt_jst', kind='stable')
+        self._ko = pd.DatetimeIndex(df['dt_jst']).as_unit('ns').asi8
+        self._gw = df['gw'].astype(object).to_numpy()
+        self._gw_num = df['gw_num'].to_numpy() if 'gw_num' in df.columns else np.array([extract_gw_num(g) for g in self._gw])
+        if df.empty:
+            self.gws = pd.DataFrame(columns=['gw', 'first', 'last', 'matches', 'done'])
+            return
+        df = df.assign(gw_num=self._gw_num, status=df['status'].astype(object).fillna(''))
+        g = df.assign(fin=df['status'] == 'FINISHED').groupby('gw_num').agg(
+            gw=('gw', 'first'), first=('dt_jst', 'min'), last=('dt_jst', 'max'), matches=('match_id', 'size'), done=('fin', 'all'))
+        self.gws = g.join(df.groupby(['gw_num', 'status']).size().unstack(fill_value=0))
+
+    def __len__(self): return len(self._ko)
+
+    def _pos(self, when, side):
+        return int(np.searchsorted(self._ko, pd.Timestamp(when).value, side=side))
+
+    def next_after(self, when):
+        """gw label of the first fixture kicking off after `when` (None when there is none)."""
+        i = self._pos(when, 'right')
+        return self._gw[i] if i < len(self._ko) else None
+
+    def started_gw_num(self, when):
+        """gw_num of the latest fixture that kicked off before `when` (None when there is none)."""
+        i = self._pos(when, 'left') - 1
+        return int(self._gw_num[i]) if i >= 0 else None
+
+    def target_gw(self, now=None):
+        """The GW the app works on: the next fixture's GW, counting matches kicked off in the last
+        TARGET_GW_GRACE_HOURS, or the last GW once the season is over."""
+        if not len(self): return "GW1"
+        now = now or datetime.datetime.now(JST)
+        nxt = self.next_after(now - timedelta(hours=TARGET_GW_GRACE_HOURS))
+        return nxt if nxt is not None else self._gw[-1]
+
+    def gw_window(self, now, back, ahead, default=38):
+        """gw_num range from `back` GWs before the current (latest started) GW to `ahead` GWs after it."""
+        cur = self.started_gw_num(now)
+        cur = default if cur is None else cur
+        return range(cur - back, cur + ahead + 1)
+
+    def first_kickoff(self, gw_num):
+        return self.gws['first'].get(gw_num) if len(self.gws) else None
+
+def get_fixture_calendar(target_season):
+    return get_table_cache().derived("result", f"calendar:{target_season}", lambda df: FixtureCalendar(df, target_season))
+
+def get_strict_target_gw(results_df, target_season, calendar=None):
+    """calendar: the season's FixtureCalendar when the caller has it (get_fixture_calendar); built from results_df otherwise."""
     if results_df.empty: return "GW1"
-    now_jst = datetime.datetime.now(JST)
-    if 'dt_jst' not in results_df.columns: results_df['dt_jst'] = results_df['utc_kickoff'].apply(to_jst)
-    season_start = pd.Timestamp(f"{target_season}-07-01", tz=JST)
-    current_season = results_df[results_df['dt_jst'] >= season_start]
-    if current_season.empty: return "GW1"
-    future = current_season[current_season['dt_jst'] > (now_jst - timedelta(hours=3))].sort_values('dt_jst')
-    if not future.empty: return future.iloc[0]['gw']
-    past = current_season.sort_values('dt_jst', ascending=False)
-    if not past.empty: return past.iloc[0]['gw']
-    return "GW1"
+    return (calendar or FixtureCalendar(results_df, target_season)).target_gw()
 
 def check_and_assign_bm(target_gw, bm_log_df, users_df):
     if users_df.empty: return
@@ -592,16 +1791,104 @@ def check_and_assign_bm(target_gw, bm_log_df, users_df):
         if next_candidates: candidates = next_candidates
     new_bm = random.choice(candidates)
     supabase.table("bm_log").upsert({"gw": target_gw, "bookmaker": new_bm}).execute()
+    invalidate_tables("bm_log")
+    run_maintenance(gw=target_gw)  # bets the new BM already placed on this GW
     return new_bm
 
 # --- CLEAN SYNC LOGIC ---
+# --- V11.7 API SYNC ---
+API_TIMEOUT = (3.05, 15)  # (connect, read) 秒。無応答の API でセッション開始が固まらないように
+
+class ApiSyncState:
+    """Per-process validators (ETag / Last-Modified / body hash) and no-op counters for sync_api."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._validators = {}  # url -> {"etag", "last_modified", "digest"}
+        self._stats = {"calls": 0, "not_modified": 0, "unchanged": 0, "changed": 0, "errors": 0, "rows_upserted": 0, "last_sec": None}
+
+    def validators(self, url):
+        with self._lock: return dict(self._validators.get(url, {}))
+
+    def remember(self, url, etag, last_modified, digest):
+        # Only called after the upsert succeeded, so a failed write is retried on the next sync
+        with self._lock: self._validators[url] = {"etag": etag, "last_modified": last_modified, "digest": digest}
+
+    def export(self):
+        with self._lock: return {url: dict(v) for url, v in self._validators.items()}
+
+    def restore(self, saved):
+        with self._lock:
+            for url, v in saved.items(): self._validators.setdefault(url, dict(v))
+
+    def record(self, outcome, sec, rows=0):
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats[outcome] += 1
+            self._stats["rows_upserted"] += rows
+            self._stats["last_sec"] = round(sec, 4)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["noop_ratio"] = round((s["not_modified"] + s["unchanged"]) / s["calls"], 3) if s["calls"] else None
+            return s
+
+@st.cache_resource
+def get_http_session():
+    """Keep-alive session shared by all sessions (gzip is requested by default, retries only on 5xx)."""
+    s = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=frozenset(["GET"]))
+    s.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry))
+    s.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+    return s
+
+@st.cache_resource
+def get_api_sync_state():
+    return ApiSyncState()
+
+def diff_api_matches(upserts, known):
+    """Split API rows against the cached result table: (rows that differ, match_ids whose status/score changed)."""
+    prev = {}
+    if not known.empty:
+        for mid, gw, home, away, ko, status, hs, as_ in zip(known['match_id'], known['gw'], known['home'], known['away'], known['dt_jst'], known['status'], known['home_score'], known['away_score']):
+            prev[int(mid)] = ((gw, home, away, ko), (status, None if pd.isna(hs) else int(hs), None if pd.isna(as_) else int(as_)))
+    rows, changed = [], set()
+    for u in upserts:
+        old = prev.get(u['match_id'])
+        # kickoff is compared as a timestamp: the DB may echo it back as +00:00 instead of Z
+        meta = (u['gw'], u['home'], u['away'], pd.Timestamp(u['utc_kickoff']) if u['utc_kickoff'] else pd.NaT)
+        state = (u['status'], u['home_score'], u['away_score'])
+        if old is None or old[1] != state: changed.add(u['match_id'])
+        if old is None or old[1] != state or old[0] != meta: rows.append(u)
+    return rows, changed
+
 def sync_api(api_token, season):
-    if not api_token: return False
+    """Pull the season from football-data.org and upsert the rows that differ from the DB.
+
+    Returns the set of match_ids whose status or score changed (empty when nothing changed,
+    so it can go straight into settle_bets_date_aware), or None when the API call failed.
+    """
+    if not api_token: return None
     url = f"https://api.football-data.org/v4/competitions/PL/matches?season={season}"
     headers = {'X-Auth-Token': api_token}
+    state = get_api_sync_state()
+    seen = state.validators(url)
+    if seen.get("etag"): headers['If-None-Match'] = seen["etag"]
+    if seen.get("last_modified"): headers['If-Modified-Since'] = seen["last_modified"]
+    t0 = time.perf_counter()
     try:
-        r = requests.get(url, headers=headers)
-        if r.status_code != 200: return False
+        r = get_http_session().get(url, headers=headers, timeout=API_TIMEOUT)
+        if r.status_code == 304:
+            state.record("not_modified", time.perf_counter() - t0)
+            return set()
+        if r.status_code != 200:
+            state.record("errors", time.perf_counter() - t0)
+            return None
+        # The API does not always send validators, so an identical body is detected by hash
+        digest = hashlib.sha1(r.content).hexdigest()
+        if digest == seen.get("digest"):
+            state.record("unchanged", time.perf_counter() - t0)
+            return set()
         data = r.json().get('matches', [])
         upserts = []
         for m in data:
@@ -611,12 +1898,21 @@ def sync_api(api_token, season):
                 "home": m['homeTeam']['name'], "away": m['awayTeam']['name'],
                 "utc_kickoff": m['utcDate'], "status": m['status'],
                 "home_score": m['score']['fullTime']['home'], "away_score": m['score']['fullTime']['away'],
-                "updated_at": datetime.datetime.now().isoformat()
+                "updated_at": utc_now_iso()
             })
-        for i in range(0, len(upserts), 100):
-            supabase.table("result").upsert(upserts[i:i+100]).execute()
-        return True
-    except: return False
+        upserts, changed = diff_api_matches(upserts, get_table("result"))
+        report = flush_upserts("result", upserts, "sync_api", batch_size=100)
+        if upserts: invalidate_tables("result")
+        if report["failed"]:
+            # Settling a match whose write failed only re-reads it, so the ids are still returned
+            state.record("errors", time.perf_counter() - t0, report["written"])
+            return changed
+        state.remember(url, r.headers.get('ETag'), r.headers.get('Last-Modified'), digest)
+        state.record("changed" if upserts else "unchanged", time.perf_counter() - t0, report["written"])
+        return changed
+    except:
+        state.record("errors", time.perf_counter() - t0)
+        return None
 
 def clean_old_data(season):
     """V8.2: Delete data older than target season start to fix pollution."""
@@ -624,6 +1920,7 @@ def clean_old_data(season):
         season_start = f"{season}-07-01T00:00:00Z"
         # Delete matches where utc_kickoff < season_start
         supabase.table("result").delete().lt("utc_kickoff", season_start).execute()
+        invalidate_tables("result", full=True)
         return True
     except: return False
 
@@ -633,19 +1930,20 @@ def clean_old_data(season):
 def main():
     if not supabase: st.error("DB Error"); st.stop()
     
-    res_conf = supabase.table("config").select("*").execute()
-    config = pd.DataFrame(res_conf.data) if res_conf.data else pd.DataFrame(columns=['key','value'])
+    config = get_table("config")
     token = get_api_token(config)
     
     target_season = get_config_value(config, "API_FOOTBALL_SEASON", 2024)
 
     if 'v83_api_synced' not in st.session_state:
-        with st.spinner(f"Syncing Schedule ({target_season}) & Auto-Settling..."): 
-            sync_api(token, target_season)
-            settle_bets_date_aware()
-            st.session_state['v83_api_synced'] = True
+        # worker.py が動いていれば同期・精算は裏で済んでいるので、ここでは読むだけ
+        if not worker_is_alive(config):
+            with st.spinner(f"Syncing Schedule ({target_season}) & Auto-Settling..."): 
+                run_maintenance_if_due()
+                settle_bets_date_aware(sync_api(token, target_season) or set())
+        st.session_state['v83_api_synced'] = True
     
-    bets, odds, results, bm_log, users, config, user_chips = fetch_all_data()
+    users = load_page_data("LOGIN")["users"]
     if users.empty: st.warning("User data missing."); st.stop()
 
     if 'user' not in st.session_state or not st.session_state['user']:
@@ -656,7 +1954,7 @@ def main():
             p = st.text_input("Password", type="password", label_visibility="collapsed", placeholder="Password")
             if st.button("ENTER", use_container_width=True):
                 row = users[users['username'] == u]
-                if not row.empty and str(row.iloc[0]['password']) == p:
+                if not row.empty and check_login(u, p):
                     st.session_state['user'] = u
                     st.session_state['role'] = row.iloc[0]['role']
                     st.session_state['team'] = row.iloc[0]['team']
@@ -666,6 +1964,9 @@ def main():
 
     me = st.session_state['user']
     role = st.session_state.get('role', 'user')
+
+    base = load_page_data("BASE")
+    bets, results, bm_log, user_chips = base["bets"], base["result"], base["bm_log"], base["user_chips"]
     
     if user_chips.empty or user_chips[user_chips['user_name'] == me].empty:
         init_chips = [
@@ -674,15 +1975,19 @@ def main():
             {"user_name": me, "chip_type": "SHIELD", "amount": 2}
         ]
         supabase.table("user_chips").upsert(init_chips).execute()
-        user_chips = fetch_all_data()[-1] 
+        invalidate_tables("user_chips")
+        user_chips = get_table("user_chips")
 
-    target_gw = get_strict_target_gw(results, target_season)
+    calendar = get_fixture_calendar(target_season)
+    target_gw = get_strict_target_gw(results, target_season, calendar)
     check_and_assign_bm(target_gw, bm_log, users)
     
-    bm_log_refresh = supabase.table("bm_log").select("*").execute()
-    bm_log = pd.DataFrame(bm_log_refresh.data) if bm_log_refresh.data else bm_log
+    bm_log = get_table("bm_log")
 
-    stats, bm_map = calculate_stats_db_only(bets, results, bm_log, users)
+    # V11.15: 確定済み GW はスナップショットから、未確定 GW だけを ledger で集計する
+    snap = refresh_snapshots(target_season, bets, results, bm_log, users, calendar)
+    # V11.13: 残高は全 bets の再集計ではなく ledger から O(users) で読む
+    stats, bm_map = ledger_stats(users, snap)
     
     nums = "".join([c for c in target_gw if c.isdigit()])
     current_bm = bm_map.get(f"GW{nums}", "Undecided")
@@ -696,10 +2001,10 @@ def main():
     my_gw_bets = pd.DataFrame()
     active_breakers = []
     if not bets.empty:
-        lb_bets = bets[(bets['gw'] == target_gw) & (bets['chip_used'] == 'LIMIT') & (bets['match_id'] == '999999')]
+        lb_bets = bets[(bets['gw'] == target_gw) & (bets['chip_used'] == 'LIMIT') & (bets['match_id'] == 999999)]
         if not lb_bets.empty:
             active_breakers = lb_bets['user'].unique().tolist()
-        my_gw_bets = bets[(bets['user'] == me) & (bets['gw'] == target_gw) & (bets['match_id'] != '999999')]
+        my_gw_bets = bets[(bets['user'] == me) & (bets['gw'] == target_gw) & (bets['match_id'] != 999999)]
     
     has_limit_breaker = (me in active_breakers)
     budget_limit = 20000 if has_limit_breaker else base_budget
@@ -723,578 +2028,571 @@ def main():
 
     if st.sidebar.button("Logout"): st.session_state['user'] = None; st.rerun()
 
-    t1, t2, t3, t4, t5, t6 = st.tabs(["MATCHES", "LIVE", "HISTORY", "DASHBOARD", "ADMIN", "CHIPS"])
+    # V11.3: on_change="rerun" -> 選択中のタブだけ実行 (.open が None の場合は従来どおり全タブ実行)
+    t1, t2, t3, t4, t5, t6 = st.tabs(["MATCHES", "LIVE", "HISTORY", "DASHBOARD", "ADMIN", "CHIPS"], key="main_tab", on_change="rerun")
 
     # --- TAB 1: MATCHES ---
     with t1:
-        c_h1, c_h2 = st.columns([3, 1])
-        c_h1.markdown(f"### {target_gw}")
-        if is_bm: c_h2.markdown(f"<span class='bm-badge'>YOU ARE BM</span>", unsafe_allow_html=True)
-        else: c_h2.markdown(f"<span class='bm-badge'>BM: {current_bm}</span>", unsafe_allow_html=True)
+        if t1.open is not False:
+            tab_data = load_page_data("MATCHES", target_gw)
+            gw_bets = tab_data["bets"]
+            odds_book = get_odds_book()
+            c_h1, c_h2 = st.columns([3, 1])
+            c_h1.markdown(f"### {target_gw}")
+            if is_bm: c_h2.markdown(f"<span class='bm-badge'>YOU ARE BM</span>", unsafe_allow_html=True)
+            else: c_h2.markdown(f"<span class='bm-badge'>BM: {current_bm}</span>", unsafe_allow_html=True)
         
-        if active_breakers:
-            breakers_str = ", ".join(active_breakers)
-            st.markdown(f"<div class='high-roller-banner'>🔥 HIGH ROLLERS (LIMIT 20k): {breakers_str}</div>", unsafe_allow_html=True)
-
-        b_col = "#4ade80" if current_spend <= budget_limit else "#f87171"
-        limit_label = "20,000 (BROKEN)" if has_limit_breaker else f"{budget_limit:,}"
-        st.markdown(f"""<div class="budget-header">USED: <span style="color:{b_col}">¥{current_spend:,}</span> / LIMIT: ¥{limit_label}</div>""", unsafe_allow_html=True)
-
-        if not results.empty:
-            matches = results[results['gw'] == target_gw].copy()
-            if not matches.empty:
-                matches['dt_jst'] = matches['utc_kickoff'].apply(to_jst)
-                matches = matches[matches['dt_jst'] >= pd.Timestamp(f"{target_season}-07-01", tz=JST)].sort_values('dt_jst')
+            if active_breakers:
+                breakers_str = ", ".join(active_breakers)
+                st.markdown(f"<div class='high-roller-banner'>🔥 HIGH ROLLERS (LIMIT 20k): {breakers_str}</div>", unsafe_allow_html=True)
+
+            b_col = "#4ade80" if current_spend <= budget_limit else "#f87171"
+            limit_label = "20,000 (BROKEN)" if has_limit_breaker else f"{budget_limit:,}"
+            st.markdown(f"""<div class="budget-header">USED: <span style="color:{b_col}">¥{current_spend:,}</span> / LIMIT: ¥{limit_label}</div>""", unsafe_allow_html=True)
+
+            if not results.empty:
+                matches = tab_data["result"].copy()
+                if not matches.empty:
+                    # dt_jst は ingest 時に変換済み。lock_at もページ単位で一括計算し、カードごとに文字列を解釈しない
+                    matches = matches[matches['dt_jst'] >= pd.Timestamp(f"{target_season}-07-01", tz=JST)].sort_values('dt_jst')
+                    matches['lock_at'] = lock_times(matches, lock_mins)
+                    # AI バッジはレーティングモデルの予想。まだフィットできない (FINISHED が無い) 間はオッズから
+                    ai_pick, ai_conf, _, _ = get_team_ratings().predict(matches['home'], matches['away'])
+                    odds_pick, odds_conf = calculate_ai_predictions(matches['match_id'], odds_book)
+                    no_model = pd.isna(ai_pick)
+                    matches['ai_pick'] = np.where(no_model, odds_pick, ai_pick)
+                    matches['ai_conf'] = np.where(no_model, odds_conf, ai_conf)
+                    page_now = datetime.datetime.now(JST)
+                    form_index = get_team_form_index()
                 
-                for _, m in matches.iterrows():
-                    mid = m['match_id']
-                    dt_str = m['dt_jst'].strftime('%m/%d %H:%M')
-                    is_locked = is_match_locked(m['utc_kickoff'], lock_mins)
+                    for _, m in matches.iterrows():
+                        mid = m['match_id']
+                        dt_str = m['dt_jst'].strftime('%m/%d %H:%M')
+                        is_locked = is_match_locked(m['lock_at'], page_now)
                     
-                    o_row = odds[odds['match_id'] == mid]
-                    oh = o_row.iloc[0]['home_win'] if not o_row.empty else 0
-                    od = o_row.iloc[0]['draw'] if not o_row.empty else 0
-                    oa = o_row.iloc[0]['away_win'] if not o_row.empty else 0
+                        oh, od, oa = odds_book.row(mid) or (0, 0, 0)
                     
-                    form_h = get_recent_form_html(m['home'], results, m['dt_jst'], target_season)
-                    form_a = get_recent_form_html(m['away'], results, m['dt_jst'], target_season)
+                        form_h = get_recent_form_html(m['home'], results, m['dt_jst'], target_season, form_index)
+                        form_a = get_recent_form_html(m['away'], results, m['dt_jst'], target_season, form_index)
                     
-                    match_bets = bets[bets['match_id'] == mid] if not bets.empty else pd.DataFrame()
-                    my_bet = match_bets[match_bets['user'] == me] if not match_bets.empty else pd.DataFrame()
+                        match_bets = gw_bets[gw_bets['match_id'] == mid] if not gw_bets.empty else pd.DataFrame()
+                        my_bet = match_bets[match_bets['user'] == me] if not match_bets.empty else pd.DataFrame()
                     
-                    h_s = int(m['home_score']) if pd.notna(m['home_score']) else 0
-                    a_s = int(m['away_score']) if pd.notna(m['away_score']) else 0
-                    score_disp = f"{h_s}-{a_s}" if m['status'] != 'SCHEDULED' else "vs"
+                        h_s = int(m['home_score']) if pd.notna(m['home_score']) else 0
+                        a_s = int(m['away_score']) if pd.notna(m['away_score']) else 0
+                        score_disp = f"{h_s}-{a_s}" if m['status'] != 'SCHEDULED' else "vs"
 
-                    card_html = f"""<div class="app-card-top"><div class="card-header"><span>⏱ {dt_str}</span><span>{m['status']}</span></div><div class="matchup-flex"><div class="team-col"><span class="team-name">{m['home']}</span>{form_h}</div><div class="score-col"><span class="score-box">{score_disp}</span></div><div class="team-col"><span class="team-name">{m['away']}</span>{form_a}</div></div><div class="info-row"><div class="odds-label">HOME <span class="odds-value">{oh if oh else '-'}</span></div><div class="odds-label">DRAW <span class="odds-value">{od if od else '-'}</span></div><div class="odds-label">AWAY <span class="odds-value">{oa if oa else '-'}</span></div></div>"""
+                        card_html = f"""<div class="app-card-top"><div class="card-header"><span>⏱ {dt_str}</span><span>{m['status']}</span></div><div class="matchup-flex"><div class="team-col"><span class="team-name">{m['home']}</span>{form_h}</div><div class="score-col"><span class="score-box">{score_disp}</span></div><div class="team-col"><span class="team-name">{m['away']}</span>{form_a}</div></div><div class="info-row"><div class="odds-label">HOME <span class="odds-value">{oh if oh else '-'}</span></div><div class="odds-label">DRAW <span class="odds-value">{od if od else '-'}</span></div><div class="odds-label">AWAY <span class="odds-value">{oa if oa else '-'}</span></div></div>"""
                     
-                    badges = ""
-                    ai_pick, ai_conf = calculate_ai_prediction(m, odds)
-                    if ai_pick:
-                        badges += f"""<div class="bet-badge ai"><span>🤖 AI:</span><span class="bb-pick">{ai_pick}</span> ({ai_conf}%)</div>"""
-                    if not match_bets.empty:
-                        for _, b in match_bets.iterrows():
-                            me_cls = "me" if b['user'] == me else ""
-                            pick_txt = b['pick'][:4]
+                        badges = ""
+                        ai_pick, ai_conf = m['ai_pick'], m['ai_conf']
+                        if ai_pick:
+                            badges += f"""<div class="bet-badge ai"><span>🤖 AI:</span><span class="bb-pick">{ai_pick}</span> ({ai_conf}%)</div>"""
+                        if not match_bets.empty:
+                            for _, b in match_bets.iterrows():
+                                me_cls = "me" if b['user'] == me else ""
+                                pick_txt = b['pick'][:4]
                             
-                            c_u = str(b.get('chip_used', '')).strip()
-                            c_html = ""
-                            if c_u == 'BOOST': c_html = "<span class='chip-tag chip-boost'>⚡BOOST</span>"
+                                c_u = b['chip_used']
+                                c_html = ""
+                                if c_u == 'BOOST': c_html = "<span class='chip-tag chip-boost'>⚡BOOST</span>"
                             
-                            pnl_span = ""
-                            db_res = str(b.get('result', '')).strip().upper()
-                            db_net = float(b.get('net', 0)) if pd.notna(b.get('net')) else 0
+                                pnl_span = ""
+                                db_res = b['result']
+                                db_net = float(b.get('net', 0)) if pd.notna(b.get('net')) else 0
                             
-                            if db_res == 'WIN': pnl_span = f"<span class='bb-res-win'>+¥{int(db_net):,}</span>"
-                            elif db_res == 'LOSE': pnl_span = f"<span class='bb-res-lose'>-¥{int(abs(db_net)):,}</span>"
-                            elif db_res == 'VOID': pnl_span = f"<span class='bb-void'>VOID</span>"
+                                if db_res == 'WIN': pnl_span = f"<span class='bb-res-win'>+¥{int(db_net):,}</span>"
+                                elif db_res == 'LOSE': pnl_span = f"<span class='bb-res-lose'>-¥{int(abs(db_net)):,}</span>"
+                                elif db_res == 'VOID': pnl_span = f"<span class='bb-void'>VOID</span>"
                             
-                            badges += f"""<div class="bet-badge {me_cls}"><span>{b['user']}:</span><span class="bb-pick">{pick_txt}</span> (¥{int(b['stake']):,}){c_html}{pnl_span}</div>"""
-                    if badges: card_html += f"""<div class="social-bets-container">{badges}</div>"""
-                    card_html += "</div>"
-                    st.markdown(card_html, unsafe_allow_html=True)
+                                badges += f"""<div class="bet-badge {me_cls}"><span>{b['user']}:</span><span class="bb-pick">{pick_txt}</span> (¥{int(b['stake']):,}){c_html}{pnl_span}</div>"""
+                        if badges: card_html += f"""<div class="social-bets-container">{badges}</div>"""
+                        card_html += "</div>"
+                        st.markdown(card_html, unsafe_allow_html=True)
 
-                    is_finished = m['status'] in ['IN_PLAY', 'FINISHED', 'PAUSED']
+                        is_finished = m['status'] in ['IN_PLAY', 'FINISHED', 'PAUSED']
                     
-                    if is_finished or is_locked:
-                        msg = "CLOSED"
-                        if is_locked and not is_finished: msg = "🔒 LOCKED"
-                        st.markdown(f"<div class='status-msg'>{msg}</div><div style='margin-bottom:16px'></div>", unsafe_allow_html=True)
-                    elif is_bm: st.markdown("<div style='margin-bottom:16px'></div>", unsafe_allow_html=True)
-                    elif oh == 0:
-                        st.markdown(f"<div class='status-msg'>WAITING ODDS</div><div style='margin-bottom:16px'></div>", unsafe_allow_html=True)
-                    else:
-                        with st.form(key=f"bf_{mid}"):
-                            c_p, c_s, c_b = st.columns([3, 2, 2])
-                            cur_p = my_bet.iloc[0]['pick'] if not my_bet.empty else "HOME"
-                            cur_s = int(my_bet.iloc[0]['stake']) if not my_bet.empty else 1000
-                            pick = c_p.selectbox("Pick", ["HOME", "DRAW", "AWAY"], index=["HOME", "DRAW", "AWAY"].index(cur_p), label_visibility="collapsed")
-                            stake = c_s.number_input("Stake", 100, 20000, cur_s, 100, label_visibility="collapsed")
+                        if is_finished or is_locked:
+                            msg = "CLOSED"
+                            if is_locked and not is_finished: msg = "🔒 LOCKED"
+                            st.markdown(f"<div class='status-msg'>{msg}</div><div style='margin-bottom:16px'></div>", unsafe_allow_html=True)
+                        elif is_bm: st.markdown("<div style='margin-bottom:16px'></div>", unsafe_allow_html=True)
+                        elif oh == 0:
+                            st.markdown(f"<div class='status-msg'>WAITING ODDS</div><div style='margin-bottom:16px'></div>", unsafe_allow_html=True)
+                        else:
+                            with st.form(key=f"bf_{mid}"):
+                                c_p, c_s, c_b = st.columns([3, 2, 2])
+                                cur_p = my_bet.iloc[0]['pick'] if not my_bet.empty else "HOME"
+                                cur_s = int(my_bet.iloc[0]['stake']) if not my_bet.empty else 1000
+                                pick = c_p.selectbox("Pick", ["HOME", "DRAW", "AWAY"], index=["HOME", "DRAW", "AWAY"].index(cur_p), label_visibility="collapsed")
+                                stake = c_s.number_input("Stake", 100, 20000, cur_s, 100, label_visibility="collapsed")
                             
-                            # --- Chip Selector (Boost Only, Clean UI with Undo Logic) ---
-                            my_chip_inv = user_chips[user_chips['user_name'] == me]
-                            inv = {r['chip_type']: r['amount'] for _, r in my_chip_inv.iterrows()}
+                                # --- Chip Selector (Boost Only, Clean UI with Undo Logic) ---
+                                my_chip_inv = user_chips[user_chips['user_name'] == me]
+                                inv = {r['chip_type']: r['amount'] for _, r in my_chip_inv.iterrows()}
                             
-                            current_chip_used = str(my_bet.iloc[0]['chip_used']).strip() if not my_bet.empty else ""
+                                current_chip_used = str(my_bet.iloc[0]['chip_used']).strip() if not my_bet.empty else ""
                             
-                            # LOGIC CHANGE: COMBO PREVENTION
-                            if has_limit_breaker:
-                                chip_opts = ["通常"]
-                                if current_chip_used == 'BOOST': chip_opts.append("ODDS BOOST (Active)") 
-                            else:
-                                chip_opts = ["通常"]
-                                if inv.get('BOOST', 0) > 0 or current_chip_used == 'BOOST': chip_opts.append("ODDS BOOST")
+                                # LOGIC CHANGE: COMBO PREVENTION
+                                if has_limit_breaker:
+                                    chip_opts = ["通常"]
+                                    if current_chip_used == 'BOOST': chip_opts.append("ODDS BOOST (Active)") 
+                                else:
+                                    chip_opts = ["通常"]
+                                    if inv.get('BOOST', 0) > 0 or current_chip_used == 'BOOST': chip_opts.append("ODDS BOOST")
                             
-                            default_idx = 0
-                            if current_chip_used == 'BOOST' and "ODDS BOOST" in chip_opts: default_idx = 1
-                            elif current_chip_used == 'BOOST' and "ODDS BOOST (Active)" in chip_opts: default_idx = 1
+                                default_idx = 0
+                                if current_chip_used == 'BOOST' and "ODDS BOOST" in chip_opts: default_idx = 1
+                                elif current_chip_used == 'BOOST' and "ODDS BOOST (Active)" in chip_opts: default_idx = 1
                             
-                            sel_chip_str = st.radio("オプション", chip_opts, index=default_idx, horizontal=True, key=f"chp_{mid}", label_visibility="collapsed")
+                                sel_chip_str = st.radio("オプション", chip_opts, index=default_idx, horizontal=True, key=f"chp_{mid}", label_visibility="collapsed")
                             
-                            if "BOOST" in sel_chip_str: st.caption("⚡ **効果:** オッズ+1.0倍 / **コスト:** 1枚")
-                            if has_limit_breaker and current_chip_used != 'BOOST':
-                                st.caption("🔒 Limit Breaker発動中はODDS BOOSTを使用できません (コンボ不可)")
+                                if "BOOST" in sel_chip_str: st.caption("⚡ **効果:** オッズ+1.0倍 / **コスト:** 1枚")
+                                if has_limit_breaker and current_chip_used != 'BOOST':
+                                    st.caption("🔒 Limit Breaker発動中はODDS BOOSTを使用できません (コンボ不可)")
                             
-                            new_total = current_spend - (int(my_bet.iloc[0]['stake']) if not my_bet.empty else 0) + stake
-                            over_budget = new_total > budget_limit
+                                new_total = current_spend - (int(my_bet.iloc[0]['stake']) if not my_bet.empty else 0) + stake
+                                over_budget = new_total > budget_limit
                             
-                            if c_b.form_submit_button("BET", use_container_width=True):
-                                if over_budget: st.error(f"予算オーバーです！ 上限: ¥{budget_limit:,}")
-                                else:
-                                    to = oh if pick=="HOME" else (od if pick=="DRAW" else oa)
-                                    final_chip = "BOOST" if "BOOST" in sel_chip_str else ""
+                                if c_b.form_submit_button("BET", use_container_width=True):
+                                    if over_budget: st.error(f"予算オーバーです！ 上限: ¥{budget_limit:,}")
+                                    else:
+                                        to = oh if pick=="HOME" else (od if pick=="DRAW" else oa)
+                                        final_chip = "BOOST" if "BOOST" in sel_chip_str else ""
                                     
-                                    # --- UNDO / CONSUME LOGIC ---
-                                    if current_chip_used == 'BOOST' and final_chip == "":
-                                        supabase.table("user_chips").update({"amount": inv.get('BOOST', 0) + 1}).match({"user_name": me, "chip_type": "BOOST"}).execute()
-                                        st.toast("Boost Removed. Chip Refunded.")
-                                    elif current_chip_used == "" and final_chip == 'BOOST':
-                                        curr_amt = inv.get('BOOST', 0)
-                                        if curr_amt > 0:
-                                            supabase.table("user_chips").update({"amount": curr_amt - 1}).match({"user_name": me, "chip_type": "BOOST"}).execute()
-                                        else:
-                                            st.error("チップが足りません！"); st.stop()
+                                        # --- UNDO / CONSUME LOGIC ---
+                                        if current_chip_used == 'BOOST' and final_chip == "":
+                                            supabase.table("user_chips").update({"amount": inv.get('BOOST', 0) + 1}).match({"user_name": me, "chip_type": "BOOST"}).execute()
+                                            invalidate_tables("user_chips")
+                                            st.toast("Boost Removed. Chip Refunded.")
+                                        elif current_chip_used == "" and final_chip == 'BOOST':
+                                            curr_amt = inv.get('BOOST', 0)
+                                            if curr_amt > 0:
+                                                supabase.table("user_chips").update({"amount": curr_amt - 1}).match({"user_name": me, "chip_type": "BOOST"}).execute()
+                                                invalidate_tables("user_chips")
+                                            else:
+                                                st.error("チップが足りません！"); st.stop()
                                     
-                                    pl = {
-                                        "key": f"{m['gw']}:{me}:{mid}", "gw": m['gw'], "user": me, 
-                                        "match_id": int(mid), "match": f"{m['home']} vs {m['away']}", 
-                                        "pick": pick, "stake": stake, "odds": to, 
-                                        "placed_at": datetime.datetime.now(JST).isoformat(), 
-                                        "status": "OPEN", "result": "", "payout": 0, "net": 0,
-                                        "chip_used": final_chip
-                                    }
-                                    supabase.table("bets").upsert(pl).execute()
-                                    st.toast(f"Bet Placed!", icon="✅"); time.sleep(1); st.rerun()
-            else: st.info(f"No matches for {target_gw}")
-        else: st.info("Loading...")
+                                        pl = {
+                                            "key": f"{m['gw']}:{me}:{mid}", "gw": m['gw'], "user": me, 
+                                            "match_id": int(mid), "match": f"{m['home']} vs {m['away']}", 
+                                            "pick": pick, "stake": stake, "odds": to, 
+                                            "placed_at": datetime.datetime.now(JST).isoformat(), 
+                                            "status": "OPEN", "result": "", "payout": 0, "net": 0,
+                                            "chip_used": final_chip
+                                        }
+                                        supabase.table("bets").upsert(pl).execute()
+                                        invalidate_tables("bets")
+                                        st.toast(f"Bet Placed!", icon="✅"); time.sleep(1); st.rerun()
+                else: st.info(f"No matches for {target_gw}")
+            else: st.info("Loading...")
 
     # --- TAB 2: LIVE ---
     with t2:
-        st.markdown(f"### ⚡ LIVE: {target_gw}")
-        if st.button("🔄 REFRESH & SMART SETTLE", use_container_width=True): 
-            sync_api(token, target_season)
-            settle_bets_date_aware()
-            st.rerun()
-        live_df = calculate_live_leaderboard_data(bets, results, bm_map, users, target_gw)
-        st.markdown("#### LEADERBOARD")
-        if not live_df.empty:
-            rank = 1
-            for _, r in live_df.iterrows():
-                diff = r['Diff']
-                diff_str = f"+¥{diff:,}" if diff > 0 else (f"¥{diff:,}" if diff < 0 else "-")
-                col = "#4ade80" if diff > 0 else ("#f87171" if diff < 0 else "#666")
-                dream_val = r['Dream']
-                st.markdown(f"""<div style="display:flex; flex-direction:column; padding:12px; background:rgba(255,255,255,0.03); margin-bottom:8px; border-radius:6px;"><div style="display:flex; justify-content:space-between; align-items:center;"><div style="font-weight:bold; font-size:1.1rem; color:#fbbf24; width:30px">#{rank}</div><div style="flex:1; font-weight:bold;">{r['User']}</div><div style="text-align:right;"><div style="font-weight:bold; font-family:monospace">¥{int(r['Total']):,}</div><div style="font-size:0.8rem; color:{col}; font-family:monospace">({diff_str})</div></div></div><div style="text-align:right; font-size:0.7rem; opacity:0.6; margin-top:4px;">THEORETICAL GW PROFIT: <span style="color:#a5b4fc">¥{int(dream_val):,}</span></div></div>""", unsafe_allow_html=True)
-                rank += 1
-        st.markdown("#### SCOREBOARD")
-        if not results.empty:
-            lm = results[results['gw'] == target_gw].copy()
-            lm['dt_jst'] = lm['utc_kickoff'].apply(to_jst)
-            lm = lm.sort_values('dt_jst')
-            for _, m in lm.iterrows():
-                sts_disp = m['status']
-                if m['status'] in ['IN_PLAY', 'PAUSED']: sts_disp = f"<span class='live-dot'>●</span> {m['status']}"
-                is_shielded = bool(m.get('bm_shield', False))
-                if is_shielded: sts_disp += " <span style='color:#aaa; font-weight:bold'>[🛡️VOIDED]</span>"
-                mb = bets[bets['match_id'] == m['match_id']] if not bets.empty else pd.DataFrame()
-                stake_str = ""
-                if not mb.empty:
-                    badges_html = []
-                    for _, b in mb.iterrows():
-                        if str(b['match_id']) == '999999': continue
-                        u_name = b['user']
-                        pick = b['pick']
-                        stake = int(b['stake'])
-                        pnl_display = ""
-                        pnl_col = "#aaa"
-                        db_res = str(b.get('result', '')).strip().upper()
-                        db_net = float(b.get('net', 0)) if pd.notna(b.get('net')) else 0
-                        c_u = str(b.get('chip_used', '')).strip()
-                        c_icon = "⚡" if c_u == 'BOOST' else ""
+        if t2.open is not False:
+            st.markdown(f"### ⚡ LIVE: {target_gw}")
+            if st.button("🔄 REFRESH & SMART SETTLE", use_container_width=True): 
+                if worker_is_alive(config): invalidate_tables("result", "bets")
+                else: settle_bets_date_aware(sync_api(token, target_season) or set())
+                st.rerun()
+            live_df = calculate_live_leaderboard_data(bets, results, bm_map, users, target_gw, base_stats=stats, gw_bets=get_live_gw_bets(target_gw))
+            st.markdown("#### LEADERBOARD")
+            if not live_df.empty:
+                rank = 1
+                for _, r in live_df.iterrows():
+                    diff = r['Diff']
+                    diff_str = f"+¥{diff:,}" if diff > 0 else (f"¥{diff:,}" if diff < 0 else "-")
+                    col = "#4ade80" if diff > 0 else ("#f87171" if diff < 0 else "#666")
+                    dream_val = r['Dream']
+                    st.markdown(f"""<div style="display:flex; flex-direction:column; padding:12px; background:rgba(255,255,255,0.03); margin-bottom:8px; border-radius:6px;"><div style="display:flex; justify-content:space-between; align-items:center;"><div style="font-weight:bold; font-size:1.1rem; color:#fbbf24; width:30px">#{rank}</div><div style="flex:1; font-weight:bold;">{r['User']}</div><div style="text-align:right;"><div style="font-weight:bold; font-family:monospace">¥{int(r['Total']):,}</div><div style="font-size:0.8rem; color:{col}; font-family:monospace">({diff_str})</div></div></div><div style="text-align:right; font-size:0.7rem; opacity:0.6; margin-top:4px;">THEORETICAL GW PROFIT: <span style="color:#a5b4fc">¥{int(dream_val):,}</span></div></div>""", unsafe_allow_html=True)
+                    rank += 1
+            st.markdown("#### SCOREBOARD")
+            if not results.empty:
+                lm = results[results['gw'] == target_gw].sort_values('dt_jst')
+                # one pass over bets for the whole scoreboard instead of a scan per match
+                lm_bets = bets[bets['match_id'].isin(lm['match_id'])] if not bets.empty else bets
+                bets_by_match = {mid: grp for mid, grp in lm_bets.groupby('match_id', sort=False)} if not lm_bets.empty else {}
+                for _, m in lm.iterrows():
+                    sts_disp = m['status']
+                    if m['status'] in ['IN_PLAY', 'PAUSED']: sts_disp = f"<span class='live-dot'>●</span> {m['status']}"
+                    is_shielded = bool(m.get('bm_shield', False))
+                    if is_shielded: sts_disp += " <span style='color:#aaa; font-weight:bold'>[🛡️VOIDED]</span>"
+                    mb = bets_by_match.get(m['match_id'], pd.DataFrame())
+                    stake_str = ""
+                    if not mb.empty:
+                        badges_html = []
+                        for _, b in mb.iterrows():
+                            if b['match_id'] == 999999: continue
+                            u_name = b['user']
+                            pick = b['pick']
+                            stake = int(b['stake'])
+                            pnl_display = ""
+                            pnl_col = "#aaa"
+                            db_res = b['result']
+                            db_net = float(b.get('net', 0)) if pd.notna(b.get('net')) else 0
+                            c_u = b['chip_used']
+                            c_icon = "⚡" if c_u == 'BOOST' else ""
                         
-                        # V10.6 Fix: Display Effective Odds
-                        base_o = float(b['odds'])
-                        eff_o = base_o + 1.0 if c_u == 'BOOST' else base_o
+                            # V10.6 Fix: Display Effective Odds
+                            base_o = float(b['odds'])
+                            eff_o = base_o + 1.0 if c_u == 'BOOST' else base_o
                         
-                        if db_res in ['WIN', 'LOSE']:
-                            sign = "+" if db_net > 0 else ""
-                            pnl_col = "#4ade80" if db_net > 0 else "#f87171"
-                            pnl_display = f"→ <span style='color:{pnl_col}'>{sign}¥{int(db_net):,}</span>"
-                        elif db_res == 'VOID':
-                             pnl_display = f"→ <span style='color:#aaa'>REFUND</span>"
-                        elif m['status'] in ['IN_PLAY', 'PAUSED'] and not is_shielded:
-                            h_s = int(m['home_score']) if pd.notna(m['home_score']) else 0
-                            a_s = int(m['away_score']) if pd.notna(m['away_score']) else 0
-                            curr = "DRAW"
-                            if h_s > a_s: curr = "HOME"
-                            elif a_s > h_s: curr = "AWAY"
-                            is_winning = (pick == curr)
-                            pot_net = (stake * eff_o) - stake if is_winning else -stake
-                            sign = "+" if pot_net > 0 else ""
-                            pnl_col = "#4ade80" if pot_net > 0 else "#f87171"
-                            pnl_display = f"→ <span style='color:{pnl_col}'>{sign}¥{int(pot_net):,}</span>"
-                        else:
-                            pot_win = (stake * eff_o) - stake
-                            pnl_display = f"→ <span style='color:#666; font-size:0.7rem'>+¥{int(pot_win):,}?</span>"
-                        badges_html.append(f"<div><span style='font-weight:bold'>{u_name}:</span> {pick} <span style='font-size:0.8em; color:#bbb'>@{eff_o:.2f}</span> <span style='font-family:monospace; opacity:0.7'>(¥{stake:,}){c_icon}</span> {pnl_display}</div>")
-                    stake_str = "<div style='display:flex; flex-direction:column; align-items:flex-end; font-size:0.75rem; gap:2px;'>" + "".join(badges_html) + "</div>"
-                st.markdown(f"""<div style="padding:15px; background:rgba(255,255,255,0.02); margin-bottom:10px; border-radius:8px; border:1px solid rgba(255,255,255,0.05);"><div style="display:flex; justify-content:space-between; align-items:center;"><div style="flex:1; text-align:right; font-size:0.9rem; opacity:0.8">{m['home']}</div><div style="padding:0 15px; font-weight:800; font-family:monospace; font-size:1.4rem">{int(m['home_score']) if pd.notna(m['home_score']) else 0}-{int(m['away_score']) if pd.notna(m['away_score']) else 0}</div><div style="flex:1; font-size:0.9rem; opacity:0.8">{m['away']}</div></div><div style="display:flex; justify-content:space-between; margin-top:8px; font-size:0.75rem; opacity:0.6; text-transform:uppercase"><div style='display:flex; align-items:center'>{sts_disp}</div>{stake_str}</div></div>""", unsafe_allow_html=True)
+                            if db_res in ['WIN', 'LOSE']:
+                                sign = "+" if db_net > 0 else ""
+                                pnl_col = "#4ade80" if db_net > 0 else "#f87171"
+                                pnl_display = f"→ <span style='color:{pnl_col}'>{sign}¥{int(db_net):,}</span>"
+                            elif db_res == 'VOID':
+                                 pnl_display = f"→ <span style='color:#aaa'>REFUND</span>"
+                            elif m['status'] in ['IN_PLAY', 'PAUSED'] and not is_shielded:
+                                h_s = int(m['home_score']) if pd.notna(m['home_score']) else 0
+                                a_s = int(m['away_score']) if pd.notna(m['away_score']) else 0
+                                curr = "DRAW"
+                                if h_s > a_s: curr = "HOME"
+                                elif a_s > h_s: curr = "AWAY"
+                                is_winning = (pick == curr)
+                                pot_net = (stake * eff_o) - stake if is_winning else -stake
+                                sign = "+" if pot_net > 0 else ""
+                                pnl_col = "#4ade80" if pot_net > 0 else "#f87171"
+                                pnl_display = f"→ <span style='color:{pnl_col}'>{sign}¥{int(pot_net):,}</span>"
+                            else:
+                                pot_win = (stake * eff_o) - stake
+                                pnl_display = f"→ <span style='color:#666; font-size:0.7rem'>+¥{int(pot_win):,}?</span>"
+                            badges_html.append(f"<div><span style='font-weight:bold'>{u_name}:</span> {pick} <span style='font-size:0.8em; color:#bbb'>@{eff_o:.2f}</span> <span style='font-family:monospace; opacity:0.7'>(¥{stake:,}){c_icon}</span> {pnl_display}</div>")
+                        stake_str = "<div style='display:flex; flex-direction:column; align-items:flex-end; font-size:0.75rem; gap:2px;'>" + "".join(badges_html) + "</div>"
+                    st.markdown(f"""<div style="padding:15px; background:rgba(255,255,255,0.02); margin-bottom:10px; border-radius:8px; border:1px solid rgba(255,255,255,0.05);"><div style="display:flex; justify-content:space-between; align-items:center;"><div style="flex:1; text-align:right; font-size:0.9rem; opacity:0.8">{m['home']}</div><div style="padding:0 15px; font-weight:800; font-family:monospace; font-size:1.4rem">{int(m['home_score']) if pd.notna(m['home_score']) else 0}-{int(m['away_score']) if pd.notna(m['away_score']) else 0}</div><div style="flex:1; font-size:0.9rem; opacity:0.8">{m['away']}</div></div><div style="display:flex; justify-content:space-between; margin-top:8px; font-size:0.75rem; opacity:0.6; text-transform:uppercase"><div style='display:flex; align-items:center'>{sts_disp}</div>{stake_str}</div></div>""", unsafe_allow_html=True)
 
     # --- TAB 3: HISTORY ---
     with t3:
-        if not bets.empty:
-            c1, c2 = st.columns(2)
-            all_gws = sorted(list(bets['gw'].unique()), key=lambda x: int("".join([c for c in str(x) if c.isdigit()] or 0)), reverse=True)
-            users_list = sorted(list(users['username'].unique()))
-            
-            def_u_idx = 0
-            if me in users_list: def_u_idx = users_list.index(me) + 1 
-            sel_u = c1.selectbox("User", ["All"] + users_list, index=def_u_idx)
-            sel_g = c2.selectbox("GW", ["All"] + all_gws, index=1 if len(all_gws)>0 else 0) 
+        if t3.open is not False:
+            if not bets.empty:
+                c1, c2 = st.columns(2)
+                all_gws = sorted(list(bets['gw'].unique()), key=lambda x: int("".join([c for c in str(x) if c.isdigit()] or 0)), reverse=True)
+                users_list = sorted(list(users['username'].unique()))
             
-            hist = bets[bets['match_id'] != '999999'].copy()
+                def_u_idx = 0
+                if me in users_list: def_u_idx = users_list.index(me) + 1 
+                sel_u = c1.selectbox("User", ["All"] + users_list, index=def_u_idx)
+                sel_g = c2.selectbox("GW", ["All"] + all_gws, index=1 if len(all_gws)>0 else 0) 
             
-            bm_rows = []
-            if not bm_log.empty:
-                match_net_sum = hist.groupby('match_id')['net'].sum()
-                match_stake_sum = hist.groupby('match_id')['stake'].sum()
-                
-                for _, bm_r in bm_log.iterrows():
-                    target_gw = bm_r['gw']
-                    target_bm = bm_r['bookmaker']
-                    
-                    if sel_u != "All" and sel_u != target_bm: continue
-                    if sel_g != "All" and sel_g != target_gw: continue
-                    
-                    gw_matches = results[results['gw'] == target_gw]
-                    for _, m in gw_matches.iterrows():
-                        mid = str(m['match_id'])
-                        p_net = match_net_sum.get(mid, 0) # Try string first
-                        if p_net == 0 and int(mid) in match_net_sum.index: p_net = match_net_sum.get(int(mid), 0)
-                            
-                        bm_pnl = -1 * p_net
-                        bm_handle = match_stake_sum.get(int(mid), 0)
-                        
-                        if m['status'] == 'FINISHED' or bm_handle > 0:
-                            bm_rows.append({
-                                'key': f"BM_{mid}",
-                                'user': target_bm,
-                                'match_id': str(mid), # Ensure String
-                                'gw': target_gw,
-                                'pick': 'HOUSE',
-                                'stake': bm_handle,
-                                'odds': '-',
-                                'result': 'WIN' if bm_pnl >= 0 else 'LOSE',
-                                'net': bm_pnl,
-                                'placed_at': m['utc_kickoff'],
-                                'chip_used': '',
-                                'status': 'FINISHED'
-                            })
-
-            if bm_rows:
-                bm_df = pd.DataFrame(bm_rows)
-                hist['match_id'] = hist['match_id'].astype(str) # Ensure Base String
-                hist = pd.concat([hist, bm_df], ignore_index=True)
-            else:
-                hist['match_id'] = hist['match_id'].astype(str)
+                # 確定 GW は凍結済みの行を使い、未確定 GW の行だけここで組み立てる
+                open_bets = bets[~bets['gw'].isin(list(snap.gws))] if snap.gws else bets
+                open_bm = bm_log[~bm_log['gw'].isin(list(snap.gws))] if not bm_log.empty else bm_log
+                hist = history_rows(open_bets, results, open_bm)
+                if not snap.history.empty: hist = pd.concat([snap.history, hist], ignore_index=True)
 
-            if sel_u != "All": hist = hist[hist['user'] == sel_u]
-            if sel_g != "All": hist = hist[hist['gw'] == sel_g]
-            
-            results_safe = results.rename(columns={'status': 'match_status'})
-            results_safe['match_id'] = results_safe['match_id'].astype(str)
-            hist = pd.merge(hist, results_safe[['match_id', 'home', 'away', 'match_status']], on='match_id', how='left')
-            
-            hist['placed_at'] = hist['placed_at'].fillna('')
-            hist = hist.sort_values('placed_at', ascending=False)
+                if sel_u != "All": hist = hist[hist['user'] == sel_u]
+                if sel_g != "All": hist = hist[hist['gw'] == sel_g]
+
+                hist['placed_at'] = hist['placed_at'].fillna('')
+                hist = hist.sort_values('placed_at', ascending=False)
             
-            if not hist.empty:
-                total_net = hist['net'].sum()
-                col_str = "#4ade80" if total_net >= 0 else "#f87171"
-                st.markdown(f"""<div class="summary-box"><div class="summary-title">{sel_u} / {sel_g}</div><div class="summary-val" style="color:{col_str}">¥{int(total_net):,}</div></div>""", unsafe_allow_html=True)
-            st.markdown("---") 
+                if not hist.empty:
+                    total_net = hist['net'].sum()
+                    col_str = "#4ade80" if total_net >= 0 else "#f87171"
+                    st.markdown(f"""<div class="summary-box"><div class="summary-title">{sel_u} / {sel_g}</div><div class="summary-val" style="color:{col_str}">¥{int(total_net):,}</div></div>""", unsafe_allow_html=True)
+                st.markdown("---") 
             
-            for _, b in hist.iterrows():
-                is_bm_row = (b.get('pick') == 'HOUSE')
-                db_res = str(b.get('result', '')).strip().upper()
-                if db_res not in ['WIN', 'LOSE', 'VOID']: db_res = 'PENDING'
+                for _, b in hist.iterrows():
+                    is_bm_row = (b.get('pick') == 'HOUSE')
+                    db_res = b['result']
+                    if db_res not in ['WIN', 'LOSE', 'VOID']: db_res = 'PENDING'
                 
-                db_net = float(b.get('net', 0)) if pd.notna(b.get('net')) else 0
-                match_name = f"{b['home']} vs {b['away']}" if pd.notna(b['home']) else b.get('match', 'Unknown')
+                    db_net = float(b.get('net', 0)) if pd.notna(b.get('net')) else 0
+                    match_name = f"{b['home']} vs {b['away']}" if pd.notna(b['home']) else b.get('match', 'Unknown')
                 
-                if is_bm_row:
-                    cls = "h-win h-bm" if db_net >= 0 else "h-lose h-bm"
-                    pnl_txt = f"+¥{int(db_net):,}" if db_net >= 0 else f"-¥{int(abs(db_net)) :,}"
-                    st.markdown(f"""
-                    <div class="hist-card {cls}">
-                        <div style="display:flex; justify-content:space-between; font-size:0.75rem; opacity:0.8; margin-bottom:4px; text-transform:uppercase; font-family:'Courier New', monospace; font-weight:bold;">
-                            <span>{b['user']} | {b['gw']} (BM)</span>
-                            <span>{pnl_txt}</span>
-                        </div>
-                        <div style="font-weight:800; font-size:0.95rem; margin-bottom:4px; color:#fff;">{match_name}</div>
-                        <div style="font-size:0.8rem; opacity:0.8">
-                            <span style="color:#fbbf24; font-weight:bold">HOUSE</span> 
-                            <span style="opacity:0.7; margin-left:8px">HANDLE: ¥{int(b['stake']):,}</span>
-                        </div>
-                    </div>""", unsafe_allow_html=True)
-                else:
-                    cls = "h-win" if db_res == 'WIN' else ("h-lose" if db_res == 'LOSE' else "")
-                    pnl = f"+¥{int(db_net):,}" if db_res == 'WIN' else (f"-¥{int(abs(db_net)):,}" if db_res == 'LOSE' else "REFUND")
-                    c_u = str(b.get('chip_used', '')).strip()
-                    c_icon = "⚡" if c_u == 'BOOST' else ""
-                    st.markdown(f"""<div class="hist-card {cls}"><div style="display:flex; justify-content:space-between; font-size:0.75rem; opacity:0.6; margin-bottom:4px; text-transform:uppercase; font-family:'Courier New', monospace"><span>{b['user']} | {b['gw']}</span><span style="font-weight:bold;">{pnl}</span></div><div style="font-weight:bold; font-size:0.95rem; margin-bottom:4px">{match_name}</div><div style="font-size:0.8rem; opacity:0.8"><span style="color:#a5b4fc; font-weight:bold">{b['pick']}</span> <span style="opacity:0.6">(@{b['odds']}){c_icon}</span><span style="margin-left:8px; font-family:monospace">¥{int(b['stake']):,}</span></div></div>""", unsafe_allow_html=True)
-        else: st.info("No history.")
+                    if is_bm_row:
+                        cls = "h-win h-bm" if db_net >= 0 else "h-lose h-bm"
+                        pnl_txt = f"+¥{int(db_net):,}" if db_net >= 0 else f"-¥{int(abs(db_net)) :,}"
+                        st.markdown(f"""
+                        <div class="hist-card {cls}">
+                            <div style="display:flex; justify-content:space-between; font-size:0.75rem; opacity:0.8; margin-bottom:4px; text-transform:uppercase; font-family:'Courier New', monospace; font-weight:bold;">
+                                <span>{b['user']} | {b['gw']} (BM)</span>
+                                <span>{pnl_txt}</span>
+                            </div>
+                            <div style="font-weight:800; font-size:0.95rem; margin-bottom:4px; color:#fff;">{match_name}</div>
+                            <div style="font-size:0.8rem; opacity:0.8">
+                                <span style="color:#fbbf24; font-weight:bold">HOUSE</span> 
+                                <span style="opacity:0.7; margin-left:8px">HANDLE: ¥{int(b['stake']):,}</span>
+                            </div>
+                        </div>""", unsafe_allow_html=True)
+                    else:
+                        cls = "h-win" if db_res == 'WIN' else ("h-lose" if db_res == 'LOSE' else "")
+                        pnl = f"+¥{int(db_net):,}" if db_res == 'WIN' else (f"-¥{int(abs(db_net)):,}" if db_res == 'LOSE' else "REFUND")
+                        c_u = b['chip_used']
+                        c_icon = "⚡" if c_u == 'BOOST' else ""
+                        st.markdown(f"""<div class="hist-card {cls}"><div style="display:flex; justify-content:space-between; font-size:0.75rem; opacity:0.6; margin-bottom:4px; text-transform:uppercase; font-family:'Courier New', monospace"><span>{b['user']} | {b['gw']}</span><span style="font-weight:bold;">{pnl}</span></div><div style="font-weight:bold; font-size:0.95rem; margin-bottom:4px">{match_name}</div><div style="font-size:0.8rem; opacity:0.8"><span style="color:#a5b4fc; font-weight:bold">{b['pick']}</span> <span style="opacity:0.6">(@{b['odds']}){c_icon}</span><span style="margin-left:8px; font-family:monospace">¥{int(b['stake']):,}</span></div></div>""", unsafe_allow_html=True)
+            else: st.info("No history.")
 
     with t4:
-        st.markdown("### 🏆 DASHBOARD")
-        my_s = stats.get(me, {'balance':0, 'wins':0, 'total':0})
-        win_rate = (my_s['wins']/my_s['total']*100) if my_s['total'] else 0
-        c1, c2, c3 = st.columns(3)
-        with c1: st.markdown(f"<div class='kpi-box'><div class='kpi-label'>WIN RATE</div><div class='kpi-val'>{win_rate:.1f}%</div></div>", unsafe_allow_html=True)
-        with c2: st.markdown(f"<div class='kpi-box'><div class='kpi-label'>PROFIT</div><div class='kpi-val'>¥{my_s['balance']:,}</div></div>", unsafe_allow_html=True)
-        with c3: st.markdown(f"<div class='kpi-box'><div class='kpi-label'>GW</div><div class='kpi-val'>{target_gw}</div></div>", unsafe_allow_html=True)
-        st.markdown("---")
-        st.markdown("#### 💰 PROFITABLE CLUBS")
-        prof_data = calculate_profitable_clubs_fixed(bets, results)
-        if prof_data:
-            c_cols = st.columns(len(prof_data))
-            for i, (u, clubs) in enumerate(prof_data.items()):
-                with c_cols[i]:
-                    st.markdown(f"**{u}**")
-                    if clubs:
-                        for j, (team, amt) in enumerate(clubs): st.markdown(f"<div class='rank-list-item'><span class='rank-pos'>{j+1}.</span> <span style='flex:1'>{team}</span> <span class='prof-amt'>+¥{amt:,}</span></div>", unsafe_allow_html=True)
-                    else: st.caption("No wins yet.")
-        st.markdown("---")
-        st.markdown("#### ⚖️ BM STATS")
-        if not bm_log.empty:
-            bm_counts = bm_log['bookmaker'].value_counts().reset_index()
-            bm_counts.columns = ['User', 'Count']
-            for _, r in bm_counts.iterrows(): st.markdown(f"<div class='rank-list-item'><span style='flex:1'>{r['User']}</span> <span style='font-weight:bold'>{r['Count']} times</span></div>", unsafe_allow_html=True)
+        if t4.open is not False:
+            st.markdown("### 🏆 DASHBOARD")
+            my_s = stats.get(me, {'balance':0, 'wins':0, 'total':0})
+            win_rate = (my_s['wins']/my_s['total']*100) if my_s['total'] else 0
+            c1, c2, c3 = st.columns(3)
+            with c1: st.markdown(f"<div class='kpi-box'><div class='kpi-label'>WIN RATE</div><div class='kpi-val'>{win_rate:.1f}%</div></div>", unsafe_allow_html=True)
+            with c2: st.markdown(f"<div class='kpi-box'><div class='kpi-label'>PROFIT</div><div class='kpi-val'>¥{my_s['balance']:,}</div></div>", unsafe_allow_html=True)
+            with c3: st.markdown(f"<div class='kpi-box'><div class='kpi-label'>GW</div><div class='kpi-val'>{target_gw}</div></div>", unsafe_allow_html=True)
+            st.markdown("---")
+            st.markdown("#### 💰 PROFITABLE CLUBS")
+            prof_data = calculate_profitable_clubs_fixed(bets[~bets['gw'].isin(list(snap.gws))] if snap.gws else bets, results, frozen_clubs=snap.clubs)
+            if prof_data:
+                c_cols = st.columns(len(prof_data))
+                for i, (u, clubs) in enumerate(prof_data.items()):
+                    with c_cols[i]:
+                        st.markdown(f"**{u}**")
+                        if clubs:
+                            for j, (team, amt) in enumerate(clubs): st.markdown(f"<div class='rank-list-item'><span class='rank-pos'>{j+1}.</span> <span style='flex:1'>{team}</span> <span class='prof-amt'>+¥{amt:,}</span></div>", unsafe_allow_html=True)
+                        else: st.caption("No wins yet.")
+            st.markdown("---")
+            st.markdown("#### ⚖️ BM STATS")
+            if not bm_log.empty:
+                bm_counts = bm_log['bookmaker'].value_counts().reset_index()
+                bm_counts.columns = ['User', 'Count']
+                for _, r in bm_counts.iterrows(): st.markdown(f"<div class='rank-list-item'><span style='flex:1'>{r['User']}</span> <span style='font-weight:bold'>{r['Count']} times</span></div>", unsafe_allow_html=True)
 
     with t5:
-        if role == 'admin':
-            st.markdown("<div class='admin-section'><div class='admin-header'>⚙️ CONFIG MANAGER</div>", unsafe_allow_html=True)
-            c_cfg1, c_cfg2 = st.columns([3, 1])
-            curr_s = get_config_value(config, "API_FOOTBALL_SEASON", 2024)
-            new_s = c_cfg1.number_input("API Season", 2023, 2030, int(curr_s))
-            if c_cfg2.button("💾 SAVE CONFIG", use_container_width=True):
-                supabase.table("config").upsert({"key": "API_FOOTBALL_SEASON", "value": str(new_s)}).execute()
-                st.success("Saved!"); time.sleep(1); st.rerun()
-            st.markdown("</div>", unsafe_allow_html=True)
+        if t5.open is not False:
+            if role == 'admin':
+                odds_book = get_odds_book()
+                st.markdown("<div class='admin-section'><div class='admin-header'>⚙️ CONFIG MANAGER</div>", unsafe_allow_html=True)
+                c_cfg1, c_cfg2 = st.columns([3, 1])
+                curr_s = get_config_value(config, "API_FOOTBALL_SEASON", 2024)
+                new_s = c_cfg1.number_input("API Season", 2023, 2030, int(curr_s))
+                if c_cfg2.button("💾 SAVE CONFIG", use_container_width=True):
+                    supabase.table("config").upsert({"key": "API_FOOTBALL_SEASON", "value": str(new_s)}).execute()
+                    invalidate_tables("config")
+                    st.success("Saved!"); time.sleep(1); st.rerun()
+                st.markdown("</div>", unsafe_allow_html=True)
+
+                with st.expander("🩺 PERF (Load Timings / Cache)", expanded=False):
+                    c_fix1, c_fix2, c_fix3, c_fix4 = st.columns(4)
+                    if c_fix1.button("🔁 FULL RE-SETTLE (repair)", use_container_width=True):
+                        n, settle_msg = settle_bets_date_aware(full=True)
+                        st.success(f"{n} bets updated ({settle_msg})")
+                    if c_fix2.button("🧹 RUN CLEANUP", use_container_width=True):
+                        rep = run_maintenance()
+                        st.success(f"{rep['written']} invalid bets deleted")
+                    if c_fix3.button("🧮 VERIFY LEDGER", use_container_width=True):
+                        st.session_state['ledger_verify'] = verify_ledger(snap)
+                        if st.session_state['ledger_verify']['ok']: st.success("Ledger OK")
+                        else: st.error("Ledger mismatch (see ledger.verify)")
+                    if c_fix4.button("🧊 REBUILD SNAPSHOTS", use_container_width=True):
+                        get_snapshot_store().thaw()
+                        st.rerun()
+                    st.json({"timings_sec": FETCH_TIMINGS, "writes": WRITE_REPORTS, "api_sync": get_api_sync_state().stats(), "maintenance": get_maintenance_state().last_report, "ledger": dict(get_ledger().stats(), verify=st.session_state.get('ledger_verify')), "snapshots": get_snapshot_store().stats(), "ratings": get_team_ratings().stats(), "cache": get_table_cache().stats()}, expanded=False)
             
-            st.markdown("#### ODDS EDITOR (Manual)")
-            with st.expander("📝 Update Odds", expanded=False):
-                if not results.empty:
-                    matches = results[results['gw'] == target_gw].copy()
-                    if not matches.empty:
-                        matches['dt_jst'] = matches['utc_kickoff'].apply(to_jst)
-                        m_opts = {f"{m['home']} vs {m['away']}": m['match_id'] for _, m in matches.iterrows()}
-                        sel_m_name = st.selectbox("Match", list(m_opts.keys()))
-                        sel_m_id = m_opts[sel_m_name]
-                        curr_o = odds[odds['match_id'] == sel_m_id]
-                        def_h = float(curr_o.iloc[0]['home_win']) if not curr_o.empty else 0.0
-                        def_d = float(curr_o.iloc[0]['draw']) if not curr_o.empty else 0.0
-                        def_a = float(curr_o.iloc[0]['away_win']) if not curr_o.empty else 0.0
-                        c1, c2, c3 = st.columns(3)
-                        new_h = c1.number_input("H", 0.0, 100.0, def_h, 0.01)
-                        new_d = c2.number_input("D", 0.0, 100.0, def_d, 0.01)
-                        new_a = c3.number_input("A", 0.0, 100.0, def_a, 0.01)
-                        if st.button("SAVE ODDS", use_container_width=True):
-                            supabase.table("odds").upsert({"match_id": int(sel_m_id), "home_win": new_h, "draw": new_d, "away_win": new_a}).execute()
-                            st.success("Updated"); time.sleep(1); st.rerun()
+                st.markdown("#### ODDS EDITOR (Manual)")
+                with st.expander("📝 Update Odds", expanded=False):
+                    if not results.empty:
+                        matches = results[results['gw'] == target_gw]
+                        if not matches.empty:
+                            m_opts = {f"{m['home']} vs {m['away']}": m['match_id'] for _, m in matches.iterrows()}
+                            sel_m_name = st.selectbox("Match", list(m_opts.keys()))
+                            sel_m_id = m_opts[sel_m_name]
+                            def_h, def_d, def_a = odds_book.row(sel_m_id) or (0.0, 0.0, 0.0)
+                            c1, c2, c3 = st.columns(3)
+                            new_h = c1.number_input("H", 0.0, 100.0, def_h, 0.01)
+                            new_d = c2.number_input("D", 0.0, 100.0, def_d, 0.01)
+                            new_a = c3.number_input("A", 0.0, 100.0, def_a, 0.01)
+                            if st.button("SAVE ODDS", use_container_width=True):
+                                supabase.table("odds").upsert({"match_id": int(sel_m_id), "home_win": new_h, "draw": new_d, "away_win": new_a}).execute()
+                                invalidate_tables("odds")
+                                settle_bets_date_aware({sel_m_id})  # GW21+ pays the current odds
+                                st.success("Updated"); time.sleep(1); st.rerun()
             
-            st.markdown("#### 👑 RESULT OVERRIDE (Emergency)")
-            with st.expander("🚨 Manual Score/Status Fix", expanded=False):
-                if not results.empty:
-                    all_gws = sorted(results['gw'].unique(), key=lambda x: int(re.sub(r'\D', '', str(x)) or 0))
-                    def_gw_idx = len(all_gws) - 1 if all_gws else 0
-                    sel_gw_ovr = st.selectbox("Select GW", all_gws, index=def_gw_idx, key="ovr_gw_sel")
-                    gw_matches = results[results['gw'] == sel_gw_ovr].copy()
-                    match_map = {f"{r['home']} vs {r['away']}": r for _, r in gw_matches.iterrows()}
-                    sel_match_name = st.selectbox("Select Match", list(match_map.keys()), key="ovr_match_sel")
-                    if sel_match_name:
-                        target_m = match_map[sel_match_name]
-                        curr_status = target_m['status']
-                        curr_h = int(target_m['home_score']) if pd.notna(target_m['home_score']) else 0
-                        curr_a = int(target_m['away_score']) if pd.notna(target_m['away_score']) else 0
-                        st.markdown(f"**Current DB State:** Status: `{curr_status}` | Score: `{curr_h} - {curr_a}`")
-                        c1, c2, c3 = st.columns(3)
-                        st_opts = ['FINISHED', 'IN_PLAY', 'SCHEDULED', 'POSTPONED']
-                        st_idx = st_opts.index(curr_status) if curr_status in st_opts else 0
-                        new_status = c1.selectbox("Status", st_opts, index=st_idx, key="ovr_status")
-                        score_opts = list(range(11))
-                        new_h = c2.selectbox("Home Score", score_opts, index=curr_h if curr_h<=10 else 0, key="ovr_h")
-                        new_a = c3.selectbox("Away Score", score_opts, index=curr_a if curr_a<=10 else 0, key="ovr_a")
-                        if st.button("FORCE UPDATE & SETTLE", type="primary", use_container_width=True):
-                            supabase.table("result").update({
-                                "status": new_status,
-                                "home_score": new_h,
-                                "away_score": new_a,
-                                "updated_at": datetime.datetime.now().isoformat()
-                            }).eq("match_id", target_m['match_id']).execute()
-                            settle_bets_date_aware()
-                            st.success(f"Updated Match & Settled!"); time.sleep(1.5); st.rerun()
-
-            with st.expander("👑 BM Manual Override"):
-                 with st.form("bm_manual"):
-                    t_gw = st.selectbox("GW", sorted(results['gw'].unique()) if not results.empty else ["GW1"])
-                    t_u = st.selectbox("User", users['username'].tolist())
-                    if st.form_submit_button("Assign"):
-                        supabase.table("bm_log").upsert({"gw": t_gw, "bookmaker": t_u}).execute()
-                        st.success("Assigned"); time.sleep(1); st.rerun()
+                st.markdown("#### 👑 RESULT OVERRIDE (Emergency)")
+                with st.expander("🚨 Manual Score/Status Fix", expanded=False):
+                    if not results.empty:
+                        all_gws = sorted(results['gw'].unique(), key=lambda x: int(re.sub(r'\D', '', str(x)) or 0))
+                        def_gw_idx = len(all_gws) - 1 if all_gws else 0
+                        sel_gw_ovr = st.selectbox("Select GW", all_gws, index=def_gw_idx, key="ovr_gw_sel")
+                        gw_matches = results[results['gw'] == sel_gw_ovr].copy()
+                        match_map = {f"{r['home']} vs {r['away']}": r for _, r in gw_matches.iterrows()}
+                        sel_match_name = st.selectbox("Select Match", list(match_map.keys()), key="ovr_match_sel")
+                        if sel_match_name:
+                            target_m = match_map[sel_match_name]
+                            curr_status = target_m['status']
+                            curr_h = int(target_m['home_score']) if pd.notna(target_m['home_score']) else 0
+                            curr_a = int(target_m['away_score']) if pd.notna(target_m['away_score']) else 0
+                            st.markdown(f"**Current DB State:** Status: `{curr_status}` | Score: `{curr_h} - {curr_a}`")
+                            c1, c2, c3 = st.columns(3)
+                            st_opts = ['FINISHED', 'IN_PLAY', 'SCHEDULED', 'POSTPONED']
+                            st_idx = st_opts.index(curr_status) if curr_status in st_opts else 0
+                            new_status = c1.selectbox("Status", st_opts, index=st_idx, key="ovr_status")
+                            score_opts = list(range(11))
+                            new_h = c2.selectbox("Home Score", score_opts, index=curr_h if curr_h<=10 else 0, key="ovr_h")
+                            new_a = c3.selectbox("Away Score", score_opts, index=curr_a if curr_a<=10 else 0, key="ovr_a")
+                            if st.button("FORCE UPDATE & SETTLE", type="primary", use_container_width=True):
+                                supabase.table("result").update({
+                                    "status": new_status,
+                                    "home_score": new_h,
+                                    "away_score": new_a,
+                                    "updated_at": utc_now_iso()
+                                }).eq("match_id", target_m['match_id']).execute()
+                                invalidate_tables("result")
+                                _, settle_msg = settle_bets_date_aware({target_m['match_id']})
+                                st.success(f"Updated Match & Settled! ({settle_msg})"); time.sleep(1.5); st.rerun()
+
+                with st.expander("👑 BM Manual Override"):
+                     with st.form("bm_manual"):
+                        t_gw = st.selectbox("GW", sorted(results['gw'].unique()) if not results.empty else ["GW1"])
+                        t_u = st.selectbox("User", users['username'].tolist())
+                        if st.form_submit_button("Assign"):
+                            supabase.table("bm_log").upsert({"gw": t_gw, "bookmaker": t_u}).execute()
+                            invalidate_tables("bm_log")
+                            run_maintenance(gw=t_gw)
+                            st.success("Assigned"); time.sleep(1); st.rerun()
 
     with t6:
-        st.markdown("<div class='section-header'>ARMORY (チップ管理)</div>", unsafe_allow_html=True)
-        if not user_chips.empty:
-            my_chips = user_chips[user_chips['user_name'] == me]
-            inv_map = {r['chip_type']: r['amount'] for _, r in my_chips.iterrows()} if not my_chips.empty else {}
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                with st.container(border=True):
-                    st.markdown(f"""
-                    <div class="chip-inventory-card">
-                        <div class="chip-header-row"><span class="chip-inv-icon">⚡</span><span class="chip-inv-name">ODDS BOOST</span></div>
-                        <div class="chip-inv-count">x{inv_map.get('BOOST', 0)}</div>
-                        <div class="chip-inv-desc">的中時のオッズを+1.0倍にする。<br>※MATCHESタブで使用</div>
-                    </div>""", unsafe_allow_html=True)
-            with c2:
-                with st.container(border=True):
-                    st.markdown(f"""
-                    <div class="chip-inventory-card">
-                        <div class="chip-header-row"><span class="chip-inv-icon">💎</span><span class="chip-inv-name">LIMIT BREAKER</span></div>
-                        <div class="chip-inv-count">x{inv_map.get('LIMIT', 0)}</div>
-                        <div class="chip-inv-desc">このGWの予算上限を20,000円に拡張する。</div>
-                    </div>""", unsafe_allow_html=True)
-                    # LIMIT BREAKER ACTION (Undo Logic + Combo Check)
-                    is_active = has_limit_breaker
-                    btn_disabled = False
+        if t6.open is not False:
+            st.markdown("<div class='section-header'>ARMORY (チップ管理)</div>", unsafe_allow_html=True)
+            if not user_chips.empty:
+                my_chips = user_chips[user_chips['user_name'] == me]
+                inv_map = {r['chip_type']: r['amount'] for _, r in my_chips.iterrows()} if not my_chips.empty else {}
+                c1, c2, c3 = st.columns(3)
+                with c1:
+                    with st.container(border=True):
+                        st.markdown(f"""
+                        <div class="chip-inventory-card">
+                            <div class="chip-header-row"><span class="chip-inv-icon">⚡</span><span class="chip-inv-name">ODDS BOOST</span></div>
+                            <div class="chip-inv-count">x{inv_map.get('BOOST', 0)}</div>
+                            <div class="chip-inv-desc">的中時のオッズを+1.0倍にする。<br>※MATCHESタブで使用</div>
+                        </div>""", unsafe_allow_html=True)
+                with c2:
+                    with st.container(border=True):
+                        st.markdown(f"""
+                        <div class="chip-inventory-card">
+                            <div class="chip-header-row"><span class="chip-inv-icon">💎</span><span class="chip-inv-name">LIMIT BREAKER</span></div>
+                            <div class="chip-inv-count">x{inv_map.get('LIMIT', 0)}</div>
+                            <div class="chip-inv-desc">このGWの予算上限を20,000円に拡張する。</div>
+                        </div>""", unsafe_allow_html=True)
+                        # LIMIT BREAKER ACTION (Undo Logic + Combo Check)
+                        is_active = has_limit_breaker
+                        btn_disabled = False
                     
-                    if is_active:
-                        can_undo = (current_spend <= 8000)
-                        if st.button("❌ 解除する (Undo)", disabled=not can_undo, use_container_width=True):
-                            supabase.table("bets").delete().eq("key", f"{target_gw}:{me}:LIMIT").execute()
-                            supabase.table("user_chips").update({"amount": inv_map.get('LIMIT') + 1}).match({"user_name": me, "chip_type": "LIMIT"}).execute()
-                            st.success("LIMIT BREAKER DEACTIVATED"); time.sleep(1.0); st.rerun()
-                        if not can_undo:
-                            st.caption("⚠️ 使用額が8,000円超のため解除不可")
-                    else:
-                        if inv_map.get('LIMIT', 0) > 0:
-                            if st.button("発動する", use_container_width=True):
-                                # LOGIC CHANGE: COMBO PREVENTION
-                                already_boosted = False
-                                if not bets.empty:
-                                    boost_bets = bets[(bets['user'] == me) & (bets['gw'] == target_gw) & (bets['chip_used'] == 'BOOST')]
-                                    if not boost_bets.empty: already_boosted = True
-                                
-                                if already_boosted:
-                                    st.error("禁止事項: このGWですでにODDS BOOSTを使用しています。コンボはできません。")
-                                else:
-                                    pl = {"key": f"{target_gw}:{me}:LIMIT", "gw": target_gw, "user": me, "match_id": 999999, "pick": "LIMIT_BREAKER", "stake": 0, "chip_used": "LIMIT"}
-                                    supabase.table("bets").upsert(pl).execute()
-                                    supabase.table("user_chips").update({"amount": inv_map.get('LIMIT') - 1}).match({"user_name": me, "chip_type": "LIMIT"}).execute()
-                                    st.success("ACTIVATED!"); time.sleep(1.0); st.rerun()
+                        if is_active:
+                            can_undo = (current_spend <= 8000)
+                            if st.button("❌ 解除する (Undo)", disabled=not can_undo, use_container_width=True):
+                                supabase.table("bets").delete().eq("key", f"{target_gw}:{me}:LIMIT").execute()
+                                supabase.table("user_chips").update({"amount": inv_map.get('LIMIT') + 1}).match({"user_name": me, "chip_type": "LIMIT"}).execute()
+                                invalidate_tables("bets", full=True); invalidate_tables("user_chips")
+                                st.success("LIMIT BREAKER DEACTIVATED"); time.sleep(1.0); st.rerun()
+                            if not can_undo:
+                                st.caption("⚠️ 使用額が8,000円超のため解除不可")
                         else:
-                            st.button("在庫なし", disabled=True, use_container_width=True)
+                            if inv_map.get('LIMIT', 0) > 0:
+                                if st.button("発動する", use_container_width=True):
+                                    # LOGIC CHANGE: COMBO PREVENTION
+                                    already_boosted = False
+                                    if not bets.empty:
+                                        boost_bets = bets[(bets['user'] == me) & (bets['gw'] == target_gw) & (bets['chip_used'] == 'BOOST')]
+                                        if not boost_bets.empty: already_boosted = True
+                                
+                                    if already_boosted:
+                                        st.error("禁止事項: このGWですでにODDS BOOSTを使用しています。コンボはできません。")
+                                    else:
+                                        pl = {"key": f"{target_gw}:{me}:LIMIT", "gw": target_gw, "user": me, "match_id": 999999, "pick": "LIMIT_BREAKER", "stake": 0, "chip_used": "LIMIT", "placed_at": datetime.datetime.now(JST).isoformat()}
+                                        supabase.table("bets").upsert(pl).execute()
+                                        supabase.table("user_chips").update({"amount": inv_map.get('LIMIT') - 1}).match({"user_name": me, "chip_type": "LIMIT"}).execute()
+                                        invalidate_tables("bets", "user_chips")
+                                        st.success("ACTIVATED!"); time.sleep(1.0); st.rerun()
+                            else:
+                                st.button("在庫なし", disabled=True, use_container_width=True)
 
-            with c3:
-                with st.container(border=True):
-                    st.markdown(f"""
-                    <div class="chip-inventory-card">
-                        <div class="chip-header-row"><span class="chip-inv-icon">🛡️</span><span class="chip-inv-name">BM SHIELD</span></div>
-                        <div class="chip-inv-count">x{inv_map.get('SHIELD', 0)}</div>
-                        <div class="chip-inv-desc">自分がBMの試合を無効試合（返金）にする。<br>※期限: 次節開始前まで</div>
-                    </div>""", unsafe_allow_html=True)
+                with c3:
+                    with st.container(border=True):
+                        st.markdown(f"""
+                        <div class="chip-inventory-card">
+                            <div class="chip-header-row"><span class="chip-inv-icon">🛡️</span><span class="chip-inv-name">BM SHIELD</span></div>
+                            <div class="chip-inv-count">x{inv_map.get('SHIELD', 0)}</div>
+                            <div class="chip-inv-desc">自分がBMの試合を無効試合（返金）にする。<br>※期限: 次節開始前まで</div>
+                        </div>""", unsafe_allow_html=True)
         
-        st.markdown("<div class='section-header'>全員のチップ保有状況</div>", unsafe_allow_html=True)
-        if not user_chips.empty:
-            all_users_list = sorted(users['username'].unique())
-            for u in all_users_list:
-                u_chips = user_chips[user_chips['user_name'] == u]
-                u_map = {r['chip_type']: r['amount'] for _, r in u_chips.iterrows()} if not u_chips.empty else {}
-                st.markdown(f"""
-                <div class="intel-row">
-                    <div class="intel-user">{u}</div>
-                    <div class="intel-chips">
-                        <span class="ic-box">⚡ {u_map.get('BOOST', 0)}</span>
-                        <span class="ic-box">💎 {u_map.get('LIMIT', 0)}</span>
-                        <span class="ic-box">🛡️ {u_map.get('SHIELD', 0)}</span>
+            st.markdown("<div class='section-header'>全員のチップ保有状況</div>", unsafe_allow_html=True)
+            if not user_chips.empty:
+                all_users_list = sorted(users['username'].unique())
+                for u in all_users_list:
+                    u_chips = user_chips[user_chips['user_name'] == u]
+                    u_map = {r['chip_type']: r['amount'] for _, r in u_chips.iterrows()} if not u_chips.empty else {}
+                    st.markdown(f"""
+                    <div class="intel-row">
+                        <div class="intel-user">{u}</div>
+                        <div class="intel-chips">
+                            <span class="ic-box">⚡ {u_map.get('BOOST', 0)}</span>
+                            <span class="ic-box">💎 {u_map.get('LIMIT', 0)}</span>
+                            <span class="ic-box">🛡️ {u_map.get('SHIELD', 0)}</span>
+                        </div>
                     </div>
-                </div>
-                """, unsafe_allow_html=True)
+                    """, unsafe_allow_html=True)
 
-        st.markdown("<div class='section-header'>SHIELD CONSOLE</div>", unsafe_allow_html=True)
-        my_bm_gws = bm_log[bm_log['bookmaker'] == me]['gw'].tolist() if not bm_log.empty else []
+            st.markdown("<div class='section-header'>SHIELD CONSOLE</div>", unsafe_allow_html=True)
+            my_bm_gws = bm_log[bm_log['bookmaker'] == me]['gw'].tolist() if not bm_log.empty else []
         
-        if my_bm_gws and not results.empty:
-            candidates_all = results[(results['gw'].isin(my_bm_gws)) & (results['status'] == 'FINISHED')].copy()
-            if not candidates_all.empty:
-                candidates_all['gw_num'] = candidates_all['gw'].apply(extract_gw_num)
-                latest_gw_num = candidates_all['gw_num'].max()
-                candidates = candidates_all[candidates_all['gw_num'] == latest_gw_num].copy()
+            if my_bm_gws and not results.empty:
+                candidates_all = results[(results['gw'].isin(my_bm_gws)) & (results['status'] == 'FINISHED')].copy()
+                if not candidates_all.empty:
+                    latest_gw_num = candidates_all['gw_num'].max()
+                    candidates = candidates_all[candidates_all['gw_num'] == latest_gw_num].copy()
                 
-                if not candidates.empty:
-                    candidates['dt_jst'] = candidates['utc_kickoff'].apply(to_jst)
-                    next_gw_str = f"GW{latest_gw_num + 1}"
-                    next_matches = results[results['gw'] == next_gw_str]
-                    deadline = None
-                    if not next_matches.empty:
-                        next_matches['dt'] = next_matches['utc_kickoff'].apply(to_jst)
-                        deadline = next_matches['dt'].min()
+                    if not candidates.empty:
+                        deadline = calendar.first_kickoff(latest_gw_num + 1)
                     
-                    is_expired = False
-                    if deadline and datetime.datetime.now(JST) > deadline: is_expired = True
+                        is_expired = False
+                        if deadline and datetime.datetime.now(JST) > deadline: is_expired = True
                     
-                    st.caption(f"対象: GW{latest_gw_num} | 期限: {deadline.strftime('%m/%d %H:%M') if deadline else '未定'}")
+                        st.caption(f"対象: GW{latest_gw_num} | 期限: {deadline.strftime('%m/%d %H:%M') if deadline else '未定'}")
 
-                    for _, m in candidates.iterrows():
-                        mid = m['match_id']
-                        m_bets = bets[bets['match_id'] == mid]
-                        chips_used = m_bets[m_bets['chip_used'] != ""].shape[0] if not m_bets.empty else 0
-                        bm_pnl = 0
-                        if not m_bets.empty:
-                            valid_bets = m_bets[m_bets['result'].isin(['WIN', 'LOSE'])]
-                            bm_pnl = -valid_bets['net'].sum()
+                        for _, m in candidates.iterrows():
+                            mid = m['match_id']
+                            m_bets = bets[bets['match_id'] == mid]
+                            chips_used = m_bets[m_bets['chip_used'] != ""].shape[0] if not m_bets.empty else 0
+                            bm_pnl = 0
+                            if not m_bets.empty:
+                                valid_bets = m_bets[m_bets['result'].isin(['WIN', 'LOSE'])]
+                                bm_pnl = -valid_bets['net'].sum()
                         
-                        is_dirty = (chips_used > 0)
-                        is_shielded = bool(m.get('bm_shield', False))
+                            is_dirty = (chips_used > 0)
+                            is_shielded = bool(m.get('bm_shield', False))
                         
-                        with st.expander(f"{m['gw']}: {m['home']} vs {m['away']} ({m['home_score']}-{m['away_score']})", expanded=True):
-                            c1, c2, c3 = st.columns([2, 2, 1])
-                            with c1:
-                                pnl_col = "#f87171" if bm_pnl < 0 else "#4ade80"
-                                st.markdown(f"BM収支: <span style='color:{pnl_col}; font-weight:bold; font-family:monospace'>¥{int(bm_pnl):,}</span>", unsafe_allow_html=True)
-                                if is_shielded: st.caption("🛡️ 発動済み (VOIDED)")
-                                elif is_expired: st.caption("⛔ 期限切れ (Time Over)")
-                                elif is_dirty: st.caption("⛔ ロック中 (チップ使用あり)")
-                                else: st.caption("✅ 発動可能")
+                            with st.expander(f"{m['gw']}: {m['home']} vs {m['away']} ({m['home_score']}-{m['away_score']})", expanded=True):
+                                c1, c2, c3 = st.columns([2, 2, 1])
+                                with c1:
+                                    pnl_col = "#f87171" if bm_pnl < 0 else "#4ade80"
+                                    st.markdown(f"BM収支: <span style='color:{pnl_col}; font-weight:bold; font-family:monospace'>¥{int(bm_pnl):,}</span>", unsafe_allow_html=True)
+                                    if is_shielded: st.caption("🛡️ 発動済み (VOIDED)")
+                                    elif is_expired: st.caption("⛔ 期限切れ (Time Over)")
+                                    elif is_dirty: st.caption("⛔ ロック中 (チップ使用あり)")
+                                    else: st.caption("✅ 発動可能")
                             
-                            with c2:
-                                shield_count = 0
-                                if not user_chips.empty:
-                                    u_row = user_chips[(user_chips['user_name'] == me) & (user_chips['chip_type'] == 'SHIELD')]
-                                    if not u_row.empty: shield_count = int(u_row.iloc[0]['amount'])
-                                st.caption(f"残数: {shield_count}")
-
-                            with c3:
-                                if is_shielded:
-                                    if st.button("↩️ 解除", key=f"sh_undo_{mid}", type="secondary", use_container_width=True):
-                                        supabase.table("result").update({"bm_shield": False}).eq("match_id", mid).execute()
-                                        supabase.table("user_chips").update({"amount": shield_count + 1}).match({"user_name": me, "chip_type": "SHIELD"}).execute()
-                                        settle_bets_date_aware()
-                                        st.success("解除しました。"); time.sleep(1.0); st.rerun()
-                                elif is_dirty or is_expired:
-                                    st.button("🔒", key=f"sh_lk_{mid}", disabled=True)
-                                elif shield_count <= 0:
-                                    st.button("🚫", key=f"sh_nc_{mid}", disabled=True)
-                                else:
-                                    if st.button("🛡️ 無効化", key=f"sh_act_{mid}", type="primary", use_container_width=True):
-                                        supabase.table("result").update({"bm_shield": True}).eq("match_id", mid).execute()
-                                        supabase.table("user_chips").update({"amount": shield_count - 1}).match({"user_name": me, "chip_type": "SHIELD"}).execute()
-                                        settle_bets_date_aware()
-                                        st.success("無効化完了！"); time.sleep(1.5); st.rerun()
-                else: st.info(f"GW{latest_gw_num} に終了済みの試合はありません。")
-            else: st.info("BM履歴がありません。")
-        else: st.info("BM履歴なし")
+                                with c2:
+                                    shield_count = 0
+                                    if not user_chips.empty:
+                                        u_row = user_chips[(user_chips['user_name'] == me) & (user_chips['chip_type'] == 'SHIELD')]
+                                        if not u_row.empty: shield_count = int(u_row.iloc[0]['amount'])
+                                    st.caption(f"残数: {shield_count}")
+
+                                with c3:
+                                    if is_shielded:
+                                        if st.button("↩️ 解除", key=f"sh_undo_{mid}", type="secondary", use_container_width=True):
+                                            supabase.table("result").update({"bm_shield": False, "updated_at": utc_now_iso()}).eq("match_id", mid).execute()
+                                            supabase.table("user_chips").update({"amount": shield_count + 1}).match({"user_name": me, "chip_type": "SHIELD"}).execute()
+                                            invalidate_tables("result", "user_chips")
+                                            settle_bets_date_aware({mid})
+                                            st.success("解除しました。"); time.sleep(1.0); st.rerun()
+                                    elif is_dirty or is_expired:
+                                        st.button("🔒", key=f"sh_lk_{mid}", disabled=True)
+                                    elif shield_count <= 0:
+                                        st.button("🚫", key=f"sh_nc_{mid}", disabled=True)
+                                    else:
+                                        if st.button("🛡️ 無効化", key=f"sh_act_{mid}", type="primary", use_container_width=True):
+                                            supabase.table("result").update({"bm_shield": True, "updated_at": utc_now_iso()}).eq("match_id", mid).execute()
+                                            supabase.table("user_chips").update({"amount": shield_count - 1}).match({"user_name": me, "chip_type": "SHIELD"}).execute()
+                                            invalidate_tables("result", "user_chips")
+                                            settle_bets_date_aware({mid})
+                                            st.success("無効化完了！"); time.sleep(1.5); st.rerun()
+                    else: st.info(f"GW{latest_gw_num} に終了済みの試合はありません。")
+                else: st.info("BM履歴がありません。")
+            else: st.info("BM履歴なし")
 
 if __name__ == "__main__":
     main()
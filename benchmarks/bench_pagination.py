@@ -0,0 +1,65 @@
+# benchmarks/bench_pagination.py
+"""Paged reader benchmark: read_table_paged() vs. naive page-by-page concat at 100k+ bet rows.
+
+    python benchmarks/bench_pagination.py --rows 100000 250000 --page-size 1000 --latency 0.02
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import pandas as pd
+import app
+from local_supabase import LocalSupabase
+
+
+def make_bets(n):
+    return [{
+        "key": f"GW{i % 38 + 1}:u{i % 50}:{100000 + i}", "user": f"u{i % 50}", "match_id": 100000 + i // 50,
+        "match": "Home FC vs Away FC", "pick": ("HOME", "DRAW", "AWAY")[i % 3], "stake": 1000, "odds": 2.1,
+        "result": ("WIN", "LOSE", "")[i % 3], "payout": 0, "net": 0, "gw": f"GW{i % 38 + 1}",
+        "placed_at": "2025-01-01T12:00:00+09:00", "chip_used": "", "status": "OPEN",
+    } for i in range(n)]
+
+
+def naive_concat(page_size):
+    df, start = pd.DataFrame(), 0
+    while True:
+        res = app.supabase.table("bets").select("*").range(start, start + page_size - 1).execute()
+        if not res.data: break
+        df = pd.concat([df, pd.DataFrame(res.data)], ignore_index=True)
+        start += len(res.data)
+    return df
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, nargs="+", default=[100000, 250000])
+    ap.add_argument("--page-size", type=int, default=1000)
+    ap.add_argument("--max-rows", type=int, default=1000, help="server-side page cap")
+    ap.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+    args = ap.parse_args()
+
+    print(f"{'rows':>8} {'variant':<22} {'sec':>8} {'calls':>6} {'got':>8}")
+    for n in args.rows:
+        db = LocalSupabase({"bets": make_bets(n)}, latency=args.latency, max_rows=args.max_rows)
+        app.supabase = db
+        variants = {
+            "single select(*)": lambda: pd.DataFrame(db.table("bets").select("*").execute().data),
+            "naive concat": lambda: naive_concat(args.page_size),
+            "paged": lambda: app.read_table_paged("bets", page_size=args.page_size, prefetch=False),
+            "paged + prefetch": lambda: app.read_table_paged("bets", page_size=args.page_size, prefetch=True),
+        }
+        for name, fn in variants.items():
+            db.reset_stats()
+            t0 = time.perf_counter()
+            df = fn()
+            print(f"{n:>8} {name:<22} {time.perf_counter() - t0:>8.3f} {db.stats['calls']:>6} {len(df):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# benchmarks/bench_scoring.py
+"""Scaling benchmark for the scoring functions on synthetic leagues (benchmarks/synthetic.py).
+
+Times settle_bets_date_aware (against LocalSupabase, no latency), calculate_stats_db_only,
+calculate_live_leaderboard_data, calculate_profitable_clubs_fixed, get_recent_form_html (all
+form badges of one MATCHES page, index build included), get_strict_target_gw and a cold
+TeamRatings.fit for every users x seasons size, and writes the best-of-N timings to JSON. --compare prints the ratio against an earlier file.
+
+    python benchmarks/bench_scoring.py --users 5 50 500 --seasons 1 5 20
+    python benchmarks/bench_scoring.py --compare benchmarks/results/scoring_20261017-120000.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import numpy as np
+import pandas as pd
+import app
+from local_supabase import LocalSupabase
+from synthetic import ANCHOR, make_league, season_of, today_anchor
+
+SHORT = {
+    "settle_bets_date_aware": "settle", "calculate_stats_db_only": "stats", "calculate_live_leaderboard_data": "live",
+    "calculate_profitable_clubs_fixed": "clubs", "get_recent_form_html": "form", "get_strict_target_gw": "target_gw",
+    "TeamRatings.fit": "ratings",
+}
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def to_frames(data):
+    """Rows -> the typed frames the app works on (same path as the shared table cache)."""
+    frames = {}
+    for table, rows in data.items():
+        cols = app.TABLE_SPECS[table]['cols']
+        frames[table] = app.normalize_table(table, pd.DataFrame(rows, columns=cols if table == "users" else None))
+    return frames
+
+
+def best_of(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        fn(arg) if setup else fn()
+        times.append(time.perf_counter() - t0)
+    return round(min(times), 5)
+
+
+def fresh_db(data):
+    db = LocalSupabase(data)
+    app.supabase = db
+    app.get_table_cache.clear()
+    app.get_settle_queue.clear()
+    return db
+
+
+def parse_anchor(value):
+    """--anchor: ISO timestamp (UTC when naive) or "today" (synthetic.today_anchor)."""
+    if value == "today": return today_anchor()
+    ts = datetime.datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=datetime.timezone.utc)
+
+
+def bench_size(args, users, seasons):
+    anchor = args.anchor
+    data = make_league(users=users, seasons=seasons, gws=args.gws, matches_per_gw=args.matches_per_gw,
+                       current_gw=args.current_gw, bet_density=args.bet_density, chip_rate=args.chip_rate,
+                       shield_rate=args.shield_rate, anchor=anchor, seed=args.seed)
+    f = to_frames(data)
+    bets, results, bm_log, users_df = f["bets"], f["result"], f["bm_log"], f["users"]
+    season = season_of(anchor, args.current_gw)
+    target_gw = app.get_strict_target_gw(results, season)
+    _, bm_map = app.calculate_stats_db_only(bets, results, bm_log, users_df)
+    page = results[results['gw'] == target_gw]
+
+    def form_page():
+        # a fresh index each time: the app builds it once per results version, so this is the cold-page cost
+        form_index = app.TeamFormIndex(results)
+        for _, m in page.iterrows():
+            app.get_recent_form_html(m['home'], results, m['dt_jst'], season, form_index)
+            app.get_recent_form_html(m['away'], results, m['dt_jst'], season, form_index)
+
+    fns = {
+        "settle_bets_date_aware": (lambda _: app.settle_bets_date_aware(full=True), lambda: fresh_db(data)),
+        "calculate_stats_db_only": (lambda: app.calculate_stats_db_only(bets, results, bm_log, users_df), None),
+        "calculate_live_leaderboard_data": (lambda: app.calculate_live_leaderboard_data(bets, results, bm_map, users_df, target_gw), None),
+        "calculate_profitable_clubs_fixed": (lambda: app.calculate_profitable_clubs_fixed(bets, results), None),
+        "get_recent_form_html": (form_page, None),
+        "get_strict_target_gw": (lambda: app.get_strict_target_gw(results, season), None),
+        "TeamRatings.fit": (lambda: app.TeamRatings.fit(results), None),
+    }
+    timings = {}
+    for name, (fn, setup) in fns.items():
+        if args.only and name not in args.only: continue
+        timings[name] = best_of(fn, args.repeat, setup)
+    return {
+        "users": users, "seasons": seasons, "bets": len(bets), "matches": len(results),
+        "target_gw": target_gw, "timings_sec": timings,
+    }
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(new, old_path):
+    with open(old_path, encoding="utf-8") as fh:
+        prev = json.load(fh)
+    old = {(r["users"], r["seasons"]): r for r in prev["results"]}
+    print(f"\nvs {old_path} (new / old)")
+    if prev["meta"].get("anchor") != new["meta"]["anchor"]:
+        print(f"note: different synthetic data (anchor {prev['meta'].get('anchor')} vs {new['meta']['anchor']})")
+    for r in new["results"]:
+        prev = old.get((r["users"], r["seasons"]))
+        if not prev or "timings_sec" not in prev: continue
+        for name, sec in r.get("timings_sec", {}).items():
+            before = prev["timings_sec"].get(name)
+            if before: print(f"{r['users']:>5} {r['seasons']:>3} {name:<34} {before:>9.4f} -> {sec:>9.4f}  x{sec / before:.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, nargs="+", default=[5, 50, 500])
+    ap.add_argument("--seasons", type=int, nargs="+", default=[1, 5, 20])
+    ap.add_argument("--gws", type=int, default=38)
+    ap.add_argument("--matches-per-gw", type=int, default=10)
+    ap.add_argument("--current-gw", type=int, default=24)
+    ap.add_argument("--bet-density", type=float, default=0.8)
+    ap.add_argument("--chip-rate", type=float, default=0.05)
+    ap.add_argument("--shield-rate", type=float, default=0.03)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--anchor", type=parse_anchor, default=ANCHOR,
+                    help="current GW kickoff of the synthetic league (ISO or 'today'); fixed by default so runs compare")
+    ap.add_argument("--repeat", type=int, default=3, help="best of N")
+    ap.add_argument("--max-bets", type=int, default=300000, help="skip sizes above this many bets (estimated)")
+    ap.add_argument("--only", nargs="+", help="function names to run")
+    ap.add_argument("--out", help="JSON path (default benchmarks/results/scoring_<timestamp>.json)")
+    ap.add_argument("--compare", help="earlier JSON to compare against")
+    args = ap.parse_args()
+
+    out = args.out or os.path.join(RESULTS_DIR, f"scoring_{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    report = {
+        "meta": {
+            "created_at": datetime.datetime.now(app.JST).isoformat(), "git": git_rev(),
+            "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+            "anchor": args.anchor.isoformat(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "anchor")},
+        },
+        "results": [],
+    }
+    print(f"{'users':>5} {'sns':>3} {'bets':>8}  timings (sec, best of {args.repeat})")
+    for users in args.users:
+        for seasons in args.seasons:
+            est = users * seasons * args.gws * args.matches_per_gw * args.bet_density
+            if est > args.max_bets:
+                report["results"].append({"users": users, "seasons": seasons, "skipped": f"~{int(est)} bets > --max-bets"})
+                print(f"{users:>5} {seasons:>3} {int(est):>8}  skipped (--max-bets)")
+                continue
+            r = bench_size(args, users, seasons)
+            report["results"].append(r)
+            print(f"{users:>5} {seasons:>3} {r['bets']:>8}  " + "  ".join(f"{SHORT[k]}={v:.4f}" for k, v in r["timings_sec"].items()), flush=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, ensure_ascii=False)
+    print(f"\nwrote {out}")
+    if args.compare: compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
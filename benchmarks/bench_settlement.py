@@ -0,0 +1,136 @@
+# benchmarks/bench_settlement.py
+"""Settlement benchmark + equivalence check: compute_settlement() vs. the previous iterrows loop.
+
+Builds synthetic seasons (random scores, picks, chips, shields, missing/zero odds, stale stored
+results) and asserts that both implementations produce the same write plan before timing them.
+
+    python benchmarks/bench_settlement.py --bets 10000 50000 --seasons 5
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import pandas as pd
+import app
+
+
+def legacy_settle(merged, df_o):
+    """The per-row loop settle_bets_date_aware() used before compute_settlement (reference only)."""
+    plan = {}
+    for _, row in merged.iterrows():
+        if row['match_status'] == 'FINISHED':
+            h_s = int(row['home_score'])
+            a_s = int(row['away_score'])
+            is_void = bool(row.get('bm_shield', False))
+            outcome = "DRAW"
+            if h_s > a_s: outcome = "HOME"
+            elif a_s > h_s: outcome = "AWAY"
+
+            bet_pick = row['pick']
+            final_res = 'WIN' if bet_pick == outcome else 'LOSE'
+            if is_void: final_res = 'VOID'
+            stake = float(row['stake']) if row['stake'] else 0
+
+            if row['gw_num'] >= 21:
+                o_row = df_o[df_o['match_id'] == row['match_id']]
+                base_odds = 1.0
+                if not o_row.empty:
+                    if bet_pick == 'HOME': base_odds = float(o_row.iloc[0]['home_win'])
+                    elif bet_pick == 'DRAW': base_odds = float(o_row.iloc[0]['draw'])
+                    elif bet_pick == 'AWAY': base_odds = float(o_row.iloc[0]['away_win'])
+            else:
+                base_odds = float(row['odds']) if pd.notna(row['odds']) and row['odds'] else 1.0
+
+            if row['chip_used'] == 'BOOST': base_odds += 1.0
+
+            if final_res == 'WIN':
+                payout = int(stake * base_odds)
+                net = int(payout - stake)
+            elif final_res == 'VOID':
+                payout = int(stake)
+                net = 0
+            else:
+                payout = 0
+                net = int(-stake)
+
+            curr_res = row['result']
+            curr_net = row['net']
+            curr_stored_odds = float(row['odds']) if pd.notna(row['odds']) and row['odds'] else 0
+
+            odds_diff = abs(curr_stored_odds - base_odds) > 0.01
+            should_update_odds = (row['gw_num'] >= 21) and odds_diff
+
+            if (curr_res != final_res) or (int(curr_net) != net) or should_update_odds:
+                plan[row['key']] = (final_res, payout, net, base_odds if should_update_odds else None)
+    return plan
+
+
+def vector_settle(merged, df_o):
+    c = app.compute_settlement(merged, app.OddsBook(df_o))
+    return {k: (r, int(p), int(n), float(o) if chg else None) for k, r, p, n, o, chg in zip(
+        c['key'], c['result_new'], c['payout_new'], c['net_new'], c['odds_new'], c['odds_changed'])}
+
+
+def make_season(n_bets, seed):
+    rng = random.Random(seed)
+    n_matches = max(10, n_bets // 20)
+    results, odds = [], []
+    for m in range(n_matches):
+        gw = m * 38 // n_matches + 1
+        finished = rng.random() < 0.7
+        results.append({
+            "match_id": 500000 + m, "gw": f"GW{gw}", "home": f"T{m % 20}", "away": f"T{(m + 7) % 20}",
+            "utc_kickoff": "2025-01-01T12:00:00Z", "status": "FINISHED" if finished else rng.choice(["SCHEDULED", "IN_PLAY"]),
+            "home_score": rng.randint(0, 4) if finished else None, "away_score": rng.randint(0, 4) if finished else None,
+            "bm_shield": rng.random() < 0.05, "updated_at": None,
+        })
+        if rng.random() < 0.9:  # some matches have no odds row
+            odds.append({"match_id": 500000 + m, "home_win": round(rng.uniform(1.2, 6), 2),
+                         "draw": round(rng.uniform(2.5, 5), 2), "away_win": round(rng.uniform(1.2, 8), 2)})
+    bets = []
+    for i in range(n_bets):
+        m = results[rng.randrange(n_matches)]
+        bets.append({
+            "key": f"{m['gw']}:u{i}:{m['match_id']}", "user": f"u{i % 12}", "match_id": m['match_id'], "match": "",
+            "pick": rng.choice(["HOME", "DRAW", "AWAY", "HOME", "AWAY", "home ", ""]),
+            "stake": rng.choice([100, 500, 1000, 3000, 20000]),
+            "odds": rng.choice([None, 0, 1.85, 2.1, 3.3, round(rng.uniform(1.1, 9), 2)]),
+            "result": rng.choice(["", "WIN", "LOSE", "VOID"]), "payout": 0,
+            "net": rng.choice([0, -100, 1100, rng.randint(-20000, 20000)]),
+            "gw": m['gw'], "placed_at": "2025-01-01T00:00:00+09:00",
+            "chip_used": rng.choice(["", "", "", "BOOST", "LIMIT", None]), "status": rng.choice(["OPEN", "AUTO"]),
+        })
+    df_b = app.normalize_table("bets", pd.DataFrame(bets))
+    df_r = app.normalize_table("result", pd.DataFrame(results)).rename(columns={'status': 'match_status'})
+    df_o = app.normalize_table("odds", pd.DataFrame(odds))
+    merged = pd.merge(df_b, df_r[['match_id', 'match_status', 'home_score', 'away_score', 'gw_num', 'bm_shield']], on='match_id', how='inner')
+    return merged, df_o
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--bets", type=int, nargs="+", default=[10000, 50000])
+    ap.add_argument("--seasons", type=int, default=3, help="random seasons checked per size")
+    args = ap.parse_args()
+
+    print(f"{'bets':>8} {'season':>6} {'changes':>8} {'loop sec':>9} {'vector sec':>11} {'equal':>6}")
+    for n in args.bets:
+        for s in range(args.seasons):
+            merged, df_o = make_season(n, seed=n * 100 + s)
+            t0 = time.perf_counter(); old = legacy_settle(merged, df_o); t_old = time.perf_counter() - t0
+            t0 = time.perf_counter(); new = vector_settle(merged, df_o); t_new = time.perf_counter() - t0
+            equal = old == new
+            print(f"{n:>8} {s:>6} {len(new):>8} {t_old:>9.3f} {t_new:>11.4f} {str(equal):>6}")
+            if not equal:
+                diff = sorted(set(old.items()) ^ set(new.items()))[:5]
+                raise SystemExit(f"settlement mismatch (first differences): {diff}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# benchmarks/synthetic.py
+"""Deterministic fake seasons for benchmarks and offline checks.
+
+make_league() returns {table: [row dicts]} in the Supabase schema, ready for LocalSupabase or
+for app.normalize_table(). The same arguments always give the same rows: kickoff dates are
+laid out around `anchor` (the current GW's kickoff), which defaults to the fixed ANCHOR so
+benchmark runs on different days time identical data. App logic that reads the clock (target
+GW, settlement window, lock times) then sees that day as long past; pass anchor=today_anchor()
+when a realistic "now" matters more than reproducibility.
+
+    data = make_league(users=50, seasons=5, bet_density=0.7, seed=1)
+    db = LocalSupabase(data)
+"""
+import datetime
+import random
+
+TEAMS = [
+    "Arsenal FC", "Aston Villa FC", "AFC Bournemouth", "Brentford FC", "Brighton & Hove Albion FC",
+    "Chelsea FC", "Crystal Palace FC", "Everton FC", "Fulham FC", "Ipswich Town FC",
+    "Leicester City FC", "Liverpool FC", "Manchester City FC", "Manchester United FC", "Newcastle United FC",
+    "Nottingham Forest FC", "Southampton FC", "Tottenham Hotspur FC", "West Ham United FC", "Wolverhampton Wanderers FC",
+]
+
+
+ANCHOR = datetime.datetime(2025, 1, 18, 12, 0, tzinfo=datetime.timezone.utc)  # default current-GW kickoff
+
+
+def today_anchor():
+    """Today 12:00 UTC: the current GW is "now" for the app, at the cost of rows changing from day to day."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return now.replace(hour=12, minute=0, second=0, microsecond=0)
+
+
+def season_of(anchor, current_gw):
+    """API_FOOTBALL_SEASON of the newest generated season (the year its GW1 falls in, July-June)."""
+    gw1 = anchor - datetime.timedelta(days=7 * (current_gw - 1))
+    return gw1.year if gw1.month >= 7 else gw1.year - 1
+
+
+def _outcome(h, a):
+    return "HOME" if h > a else ("AWAY" if a > h else "DRAW")
+
+
+def make_league(users=5, seasons=1, gws=38, matches_per_gw=10, current_gw=20, bet_density=0.8,
+                chip_rate=0.05, shield_rate=0.03, auto_rate=0.02, settled=True, anchor=None, seed=0):
+    """Generate `seasons` seasons of `gws` gameweeks; the last one is in progress at `current_gw`.
+
+    bet_density: probability that a user bets on a given match (bookmakers never bet on their GW).
+    chip_rate: BOOST share of bets, and the chance a user breaks the limit in a GW (LIMIT row).
+    shield_rate: share of finished matches voided by the bookmaker's shield.
+    auto_rate: share of GW21+ bets that are AUTO bets instead of user picks.
+    settled: write result / payout / net for finished matches the way settlement does.
+    """
+    rng = random.Random(seed)
+    anchor = anchor or ANCHOR
+    names = [f"user{i:03d}" for i in range(users)]
+    rows = {"users": [], "result": [], "odds": [], "bets": [], "bm_log": [], "user_chips": [], "config": []}
+    rows["users"] = [{"username": u, "password": "pw", "role": "admin" if i == 0 else "user", "team": rng.choice(TEAMS)}
+                     for i, u in enumerate(names)]
+
+    for s in range(seasons):
+        past = seasons - 1 - s  # 0 = current season
+        last_gw = gws if past else current_gw
+        for g in range(1, gws + 1):
+            gw = f"GW{g}"
+            gw_start = anchor + datetime.timedelta(days=7 * (g - current_gw) - 364 * past)
+            bm = names[g % users]  # bm_log is keyed by GW only, so every season must agree with it
+            if not past and g <= current_gw + 1: rows["bm_log"].append({"gw": gw, "bookmaker": bm})
+            limit_users = {u for u in names if u != bm and rng.random() < chip_rate}
+            for j in range(matches_per_gw):
+                mid = 100000 * (s + 1) + 100 * g + j
+                ko = gw_start + datetime.timedelta(hours=2 * (j % 6), days=j // 6)
+                finished = ko < anchor - datetime.timedelta(hours=2)
+                live = not finished and ko <= anchor
+                home, away = rng.sample(TEAMS, 2)
+                h, a = (rng.randint(0, 4), rng.randint(0, 3)) if (finished or live) else (None, None)
+                shield = finished and rng.random() < shield_rate
+                rows["result"].append({
+                    "match_id": mid, "gw": gw, "home": home, "away": away,
+                    "utc_kickoff": ko.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "status": "FINISHED" if finished else ("IN_PLAY" if live else "TIMED"),
+                    "home_score": h, "away_score": a, "bm_shield": shield, "updated_at": anchor.isoformat(),
+                })
+                odds = {"HOME": round(rng.uniform(1.3, 5.0), 2), "DRAW": round(rng.uniform(2.8, 4.5), 2), "AWAY": round(rng.uniform(1.3, 7.0), 2)}
+                rows["odds"].append({"match_id": mid, "home_win": odds["HOME"], "draw": odds["DRAW"], "away_win": odds["AWAY"]})
+                if g > last_gw + 1: continue  # no bets beyond next GW
+                for u in names:
+                    if u == bm or rng.random() >= bet_density: continue
+                    auto = g >= 21 and finished and rng.random() < auto_rate
+                    pick = "HOME" if auto else rng.choice(("HOME", "DRAW", "AWAY"))
+                    stake = 100 if auto else rng.choice((100, 200, 500, 1000, 2000))
+                    chip = "BOOST" if not auto and rng.random() < chip_rate else ""
+                    bet = {
+                        "key": f"{gw}:{u}:{mid}", "user": u, "match_id": mid, "match": f"{home} vs {away}",
+                        "pick": pick, "stake": stake, "odds": odds[pick], "result": "", "payout": 0, "net": 0, "gw": gw,
+                        "placed_at": (ko - datetime.timedelta(hours=rng.randint(2, 72))).isoformat(),
+                        "chip_used": chip, "status": "AUTO" if auto else "OPEN",
+                    }
+                    if settled and finished:
+                        eff = odds[pick] + (1.0 if chip == "BOOST" else 0.0)
+                        res = "VOID" if shield else ("WIN" if pick == _outcome(h, a) else "LOSE")
+                        payout = int(stake * eff) if res == "WIN" else (stake if res == "VOID" else 0)
+                        bet.update(result=res, payout=payout, net=0 if res == "VOID" else payout - stake)
+                    rows["bets"].append(bet)
+            for u in sorted(limit_users):
+                if g > last_gw + 1: break
+                rows["bets"].append({
+                    "key": f"{gw}:{u}:LIMIT", "user": u, "match_id": 999999, "match": "", "pick": "LIMIT_BREAKER",
+                    "stake": 0, "odds": None, "result": "", "payout": 0, "net": 0, "gw": gw,
+                    "placed_at": gw_start.isoformat(), "chip_used": "LIMIT", "status": "OPEN",
+                })
+
+    rows["user_chips"] = [{"user_name": u, "chip_type": c, "amount": rng.randint(0, 3)} for u in names for c in ("BOOST", "LIMIT", "SHIELD")]
+    rows["config"] = [
+        {"key": "API_FOOTBALL_SEASON", "value": str(season_of(anchor, current_gw))},
+        {"key": "lock_minutes_before_earliest", "value": "60"},
+        {"key": "max_total_stake_per_gw", "value": "8000"},
+    ]
+    return rows
@@ -0,0 +1,268 @@
+# local_supabase.py
+"""In-memory stand-in for the Supabase client, for offline profiling and load tests.
+
+Implements the part of the postgrest query builder that app.py uses:
+select / insert / upsert / update / delete, the filters eq / neq / in_ / lt / lte / gt / gte /
+match, plus order / range / limit and count="exact". Every execute() can sleep for a
+configurable latency so round-trip costs show up in timings.
+
+    db = LocalSupabase({"bets": [...], "result": [...]}, latency=0.03)
+    app.supabase = db                       # scripts / benchmarks
+    # or in .streamlit/secrets.toml:  [local_db] seed = "seed.json"  latency = 0.03
+"""
+import copy
+import json
+import random
+import threading
+import time
+
+# Primary keys mirror the Supabase schema (used for upsert conflict resolution and page ordering)
+PRIMARY_KEYS = {
+    "bets": ["key"],
+    "odds": ["match_id"],
+    "result": ["match_id"],
+    "bm_log": ["gw"],
+    "users": ["username"],
+    "config": ["key"],
+    "user_chips": ["user_name", "chip_type"],
+}
+
+
+class LocalResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _coerce(stored, literal):
+    """Cast the filter literal to the stored value's type, like Postgres does for a typed column."""
+    if isinstance(stored, bool):
+        return stored, literal in (True, 1, "true", "True", "TRUE")
+    if isinstance(stored, (int, float)):
+        try: return stored, float(literal)
+        except (TypeError, ValueError): return str(stored), str(literal)
+    return str(stored), str(literal)
+
+
+def _test(op, stored, literal):
+    if stored is None or literal is None: return False  # SQL NULL semantics
+    a, b = _coerce(stored, literal)
+    try:
+        if op == "eq": return a == b
+        if op == "lt": return a < b
+        if op == "lte": return a <= b
+        if op == "gt": return a > b
+        if op == "gte": return a >= b
+    except TypeError:
+        return False
+    raise ValueError(op)
+
+
+class LocalQuery:
+    def __init__(self, client, table):
+        self._client = client
+        self._table = table
+        self._op = None
+        self._columns = None
+        self._payload = None
+        self._filters = []
+        self._orders = []
+        self._range = None
+        self._count = None
+        self._on_conflict = None
+        self._ignore_duplicates = False
+
+    # --- operations ---
+    def select(self, *columns, count=None, head=None):
+        cols = ",".join(columns) if columns else "*"
+        self._op = "select"
+        self._columns = None if cols.strip() == "*" else [c.strip() for c in cols.split(",") if c.strip()]
+        self._count = count
+        return self
+
+    def insert(self, json, count=None, returning=None, upsert=False, default_to_null=True):
+        self._op = "upsert" if upsert else "insert"
+        self._payload = json
+        return self
+
+    def upsert(self, json, count=None, returning=None, ignore_duplicates=False, on_conflict="", default_to_null=True):
+        self._op = "upsert"
+        self._payload = json
+        self._on_conflict = [c.strip() for c in on_conflict.split(",")] if on_conflict else None
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, json, count=None, returning=None):
+        self._op = "update"
+        self._payload = json
+        return self
+
+    def delete(self, count=None, returning=None):
+        self._op = "delete"
+        return self
+
+    # --- filters ---
+    def eq(self, column, value): return self._add(lambda r: _test("eq", r.get(column), value))
+    def neq(self, column, value): return self._add(lambda r: r.get(column) is not None and not _test("eq", r.get(column), value))
+    def lt(self, column, value): return self._add(lambda r: _test("lt", r.get(column), value))
+    def lte(self, column, value): return self._add(lambda r: _test("lte", r.get(column), value))
+    def gt(self, column, value): return self._add(lambda r: _test("gt", r.get(column), value))
+    def gte(self, column, value): return self._add(lambda r: _test("gte", r.get(column), value))
+
+    def in_(self, column, values):
+        values = list(values)
+        return self._add(lambda r: any(_test("eq", r.get(column), v) for v in values))
+
+    def match(self, query):
+        for column, value in query.items(): self.eq(column, value)
+        return self
+
+    # --- modifiers ---
+    def order(self, column, desc=False, nullsfirst=None, foreign_table=None):
+        self._orders.append((column, desc))
+        return self
+
+    def range(self, start, end, foreign_table=None):
+        self._range = (start, end)
+        return self
+
+    def limit(self, size, foreign_table=None):
+        self._range = (0, size - 1)
+        return self
+
+    def execute(self):
+        return self._client._execute(self)
+
+    def _add(self, pred):
+        self._filters.append(pred)
+        return self
+
+    def _matches(self, row):
+        return all(f(row) for f in self._filters)
+
+
+class LocalSupabase:
+    """Drop-in replacement for supabase.Client.table(...) backed by in-memory tables.
+
+    latency: seconds slept per execute() (plus uniform jitter), outside the table lock so that
+    concurrent callers overlap the way real HTTP round trips do.
+    max_rows: server-side cap on rows returned by one select (Supabase default is 1000).
+    """
+    def __init__(self, tables=None, latency=0.0, jitter=0.0, max_rows=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.max_rows = max_rows
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self._tables = {}  # table -> {pk tuple: row}
+        self._gen = {}  # table -> write generation (invalidates _sorted)
+        self._sorted = {}  # (table, orders) -> (gen, rows in that order); stands in for an index
+        self.stats = {"calls": 0, "rows_out": 0, "rows_in": 0, "by_table": {}}
+        for name, rows in (tables or {}).items():
+            self.load(name, rows)
+
+    @classmethod
+    def from_json(cls, path, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def dump_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+
+    def load(self, name, rows):
+        with self._lock:
+            store = self._tables.setdefault(name, {})
+            for row in rows:
+                store[self._key(name, row, None, len(store))] = dict(row)
+            self._touch(name)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: [dict(r) for r in store.values()] for name, store in self._tables.items()}
+
+    def rows(self, name):
+        with self._lock:
+            return [dict(r) for r in self._tables.get(name, {}).values()]
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"calls": 0, "rows_out": 0, "rows_in": 0, "by_table": {}}
+
+    def table(self, name):
+        return LocalQuery(self, name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    # --- internals ---
+    def _key(self, name, row, on_conflict, fallback):
+        cols = on_conflict or PRIMARY_KEYS.get(name)
+        if not cols: return ("__row__", fallback)
+        return tuple(str(row.get(c)) for c in cols)
+
+    def _touch(self, name):
+        self._gen[name] = self._gen.get(name, 0) + 1
+
+    def _ordered(self, name, store, orders):
+        if not orders: return list(store.values())
+        key = (name, tuple(orders))
+        hit = self._sorted.get(key)
+        if hit and hit[0] == self._gen.get(name, 0): return hit[1]
+        rows = list(store.values())
+        for column, desc in reversed(orders):
+            # NULLs last (Postgres default for ascending order)
+            present = [r for r in rows if r.get(column) is not None]
+            missing = [r for r in rows if r.get(column) is None]
+            present.sort(key=lambda r: r[column], reverse=desc)
+            rows = present + missing
+        self._sorted[key] = (self._gen.get(name, 0), rows)
+        return rows
+
+    def _sleep(self):
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0: time.sleep(delay)
+
+    def _execute(self, q):
+        self._sleep()
+        with self._lock:
+            store = self._tables.setdefault(q._table, {})
+            per = self.stats["by_table"].setdefault(q._table, {})
+            per[q._op] = per.get(q._op, 0) + 1
+            self.stats["calls"] += 1
+            if q._op == "select": return self._select(q, store)
+            self._touch(q._table)
+            if q._op in ("insert", "upsert"): return self._write(q, store)
+            if q._op == "update":
+                hit = [r for r in store.values() if q._matches(r)]
+                for r in hit: r.update(copy.deepcopy(q._payload))
+                self.stats["rows_in"] += len(hit)
+                return LocalResponse([dict(r) for r in hit])
+            if q._op == "delete":
+                keys = [k for k, r in store.items() if q._matches(r)]
+                removed = [store.pop(k) for k in keys]
+                return LocalResponse(removed)
+            raise ValueError(f"unsupported operation: {q._op}")
+
+    def _select(self, q, store):
+        rows = self._ordered(q._table, store, q._orders)
+        if q._filters: rows = [r for r in rows if q._matches(r)]
+        total = len(rows) if q._count else None
+        if q._range: rows = rows[q._range[0]:q._range[1] + 1]
+        if self.max_rows is not None: rows = rows[:self.max_rows]
+        if q._columns: out = [{c: r.get(c) for c in q._columns} for r in rows]
+        else: out = [dict(r) for r in rows]
+        self.stats["rows_out"] += len(out)
+        return LocalResponse(out, total)
+
+    def _write(self, q, store):
+        payload = q._payload if isinstance(q._payload, list) else [q._payload]
+        for row in payload:
+            key = self._key(q._table, row, q._on_conflict, len(store))
+            if key in store:
+                if q._op == "insert": raise ValueError(f"duplicate key {key} in {q._table}")
+                if not q._ignore_duplicates: store[key].update(copy.deepcopy(row))
+            else:
+                store[key] = copy.deepcopy(row)
+        self.stats["rows_in"] += len(payload)
+        return LocalResponse([dict(r) for r in payload])
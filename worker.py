@@ -0,0 +1,113 @@
+# worker.py
+"""Out-of-band sync + settlement worker.
+
+Runs sync_api() -> settle_bets_date_aware() -> team ratings refit (plus run_maintenance() every
+MAINTENANCE_INTERVAL_SEC) on a schedule derived from the fixture calendar in the `result`
+table: every POLL_LIVE_SEC while a match can be in play (PRE_KICKOFF_MIN before
+kickoff until it is reported finished, normally ~final whistle + margin, at most
+MAX_LIVE_MIN after kickoff), otherwise it sleeps until the next window opens (at most
+IDLE_MAX_SEC, so fixture changes are still picked up). Every cycle writes a heartbeat to
+config (refreshed every HEARTBEAT_SEC while idle); while it is fresh (app.worker_is_alive: the
+planned next run, but never more than app.WORKER_MAX_SILENCE_SEC after the last beat) the app
+skips the in-request sync and only reads settled data.
+Next to it goes the incremental state (last full rescan, queued match_ids, last maintenance,
+API validators), which a new process restores on start, so --once runs from cron stay incremental.
+
+Run from the repository root so .streamlit/secrets.toml is found:
+
+    python worker.py                            # loop until SIGINT / SIGTERM
+    python worker.py --once --interval 300      # single cycle (cron every 5 min)
+"""
+import argparse
+import json
+import logging
+import signal
+import threading
+import time
+
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import pandas as pd
+import app
+
+POLL_LIVE_SEC = 60  # 試合中の同期間隔 (API は条件付きリクエストなので変化が無ければ安い)
+PRE_KICKOFF_MIN = 5  # キックオフ前から監視を始める (ラインナップ・延期の反映)
+MATCH_WINDOW_MIN = 135  # キックオフ〜試合終了 + 余裕。この間は終了が確認できるまで毎分
+MAX_LIVE_MIN = 240  # 中断・遅延でも FINISHED にならない試合はここで諦め、通常スケジュールに戻す
+IDLE_MAX_SEC = 6 * 3600  # 試合が無い期間も日程変更を拾うため最低この間隔で同期
+HEARTBEAT_SEC = 300  # 待機中もこの間隔で heartbeat を更新 (app.WORKER_MAX_SILENCE_SEC より短く)
+FINAL_STATUSES = ("FINISHED", "AWARDED", "POSTPONED", "CANCELLED")
+
+
+def plan_next_run(results, now):
+    """Seconds until the next cycle and why, from kickoff times and match status."""
+    if results.empty: return IDLE_MAX_SEC, "no fixtures"
+    ko = results['dt_jst']
+    start = ko - pd.Timedelta(minutes=PRE_KICKOFF_MIN)
+    unfinished = ~results['status'].astype(object).isin(FINAL_STATUSES)
+    in_window = (start <= now) & (now <= ko + pd.Timedelta(minutes=MATCH_WINDOW_MIN))
+    overdue = (ko <= now) & (now <= ko + pd.Timedelta(minutes=MAX_LIVE_MIN))
+    live = unfinished & (in_window | overdue)
+    if live.any(): return POLL_LIVE_SEC, f"{int(live.sum())} live"
+    upcoming = start[(start > now) & unfinished]
+    if upcoming.empty: return IDLE_MAX_SEC, "idle"
+    wait = (upcoming.min() - now).total_seconds()
+    return max(POLL_LIVE_SEC, min(wait, IDLE_MAX_SEC)), f"next window {upcoming.min():%m/%d %H:%M}"
+
+
+def write_heartbeat(now, next_at, with_state=True):
+    """Heartbeat plus the incremental state (app.export_worker_state), so the next process resumes from it.
+    with_state=False: only the heartbeat (the idle refresh between cycles)."""
+    rows = [{"key": app.WORKER_HEARTBEAT_KEY, "value": json.dumps({"at": now.isoformat(), "next": next_at.isoformat()})}]
+    if with_state: rows.append({"key": app.WORKER_STATE_KEY, "value": json.dumps(app.export_worker_state())})
+    app.supabase.table("config").upsert(rows).execute()
+
+
+def run_cycle(interval=None):
+    """One sync + settle pass; returns (delay_sec, reason) for the next one.
+    interval: the cron period of --once runs; the heartbeat's next run is then the next cron run at the latest."""
+    config = app.get_table("config")
+    token = app.get_api_token(config)
+    season = app.get_config_value(config, "API_FOOTBALL_SEASON", 2024)
+    t0 = time.perf_counter()
+    cleanup = app.run_maintenance_if_due()
+    changed = app.sync_api(token, season)
+    n, msg = app.settle_bets_date_aware(changed or set())
+    app.get_team_ratings()  # 新しい FINISHED があればここでフィットして保存し、アプリ側は保存済みパラメータを読むだけにする
+    now = pd.Timestamp.now(tz=app.JST)
+    delay, reason = plan_next_run(app.get_table("result"), now)
+    write_heartbeat(now, now + pd.Timedelta(seconds=min(delay, interval) if interval else delay))
+    state = "sync failed" if changed is None else f"{len(changed)} changed"
+    if cleanup: state += f", {cleanup['written']} invalid bets deleted"
+    print(f"[{now:%Y-%m-%d %H:%M:%S}] {state}, {n} bets settled ({msg}) in {time.perf_counter() - t0:.2f}s; next in {delay:.0f}s ({reason})", flush=True)
+    return delay, reason
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--once", action="store_true", help="run a single cycle and exit")
+    ap.add_argument("--interval", type=int, help="with --once: the cron period in seconds (keep it <= app.WORKER_MAX_SILENCE_SEC)")
+    args = ap.parse_args()
+    if app.supabase is None: raise SystemExit("Supabase client unavailable (check .streamlit/secrets.toml)")
+
+    # cron (--once) starts a new process every run: without this each run would be a full rescan,
+    # full maintenance and an unconditional API fetch
+    app.restore_worker_state(app.get_table("config"))
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM): signal.signal(sig, lambda *_: stop.set())
+    while not stop.is_set():
+        try: delay, _ = run_cycle(args.interval if args.once else None)
+        except Exception as e:
+            print(f"Worker Error: {e}", flush=True)
+            delay = POLL_LIVE_SEC
+        if args.once: break
+        wake = time.time() + delay
+        # long idle waits are cut into HEARTBEAT_SEC steps so the app keeps seeing a fresh heartbeat
+        while not stop.wait(min(HEARTBEAT_SEC, max(0.0, wake - time.time()))) and time.time() < wake:
+            now = pd.Timestamp.now(tz=app.JST)
+            try: write_heartbeat(now, now + pd.Timedelta(seconds=wake - time.time()), with_state=False)
+            except Exception as e: print(f"Heartbeat Error: {e}", flush=True)
+
+
+if __name__ == "__main__":
+    main()